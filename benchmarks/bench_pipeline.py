@@ -0,0 +1,209 @@
+"""
+Воспроизводимый бенчмарк конвейера примерки на синтетических изображениях.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_pipeline --sizes 1 4 12 --output bench.json
+    python -m benchmarks.bench_pipeline --output bench.json --save-baseline benchmarks/baseline.json
+    python -m benchmarks.bench_pipeline --baseline benchmarks/baseline.json
+
+Базовая линия сохраняется на той же машине перед изменением и в репозиторий
+не входит: абсолютные задержки зависят от железа. При сравнении с ней код возврата 1,
+если p50 какого-либо замера вырос больше чем на --tolerance.
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import platform
+import sys
+import time
+from typing import Callable, Dict, List
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import size_for_megapixels, make_person, make_garment, encode_jpeg
+from config import config
+from services.clothes_placer import ClothesPlacer
+from services.garment_cache import GarmentCache
+from services.image_processor import ImageProcessor
+from services.segmentation import SimpleSegmentation
+from utils.file_handlers import FileHandler
+from utils.image_buffer import DecodedImage
+
+# p99 по меньшему числу прогонов — это просто максимум, его не показываем
+MIN_RUNS_FOR_P99 = 100
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль с линейной интерполяцией"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def measure(func: Callable[[], object], repeat: int, warmup: int) -> Dict[str, float]:
+    """Задержки в секундах и пропускная способность в операциях в секунду"""
+    for _ in range(warmup):
+        func()
+    
+    timings = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    total = time.perf_counter() - started
+    
+    result = {
+        'runs': repeat,
+        'mean': sum(timings) / len(timings),
+        'p50': percentile(timings, 0.50),
+        'p95': percentile(timings, 0.95),
+        'throughput': repeat / total,
+    }
+    if repeat >= MIN_RUNS_FOR_P99:
+        result['p99'] = percentile(timings, 0.99)
+    return result
+
+def _save_jpeg(image, **params) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', **params)
+    return buffer.getvalue()
+
+def build_cases(megapixels: float) -> Dict[str, Callable[[], object]]:
+    """Замеряемые операции для одного размера входных изображений"""
+    width, height = size_for_megapixels(megapixels)
+    person = make_person(width, height)
+    garment = make_garment(width, height)
+    person_bgr = np.ascontiguousarray(person[:, :, ::-1])
+    person_jpeg = encode_jpeg(person)
+    garment_jpeg = encode_jpeg(garment)
+    
+    segmentation = SimpleSegmentation()
+    placer = ClothesPlacer()
+    file_handler = FileHandler()
+    
+    garment_work = DecodedImage.from_bytes(garment_jpeg, max_side=config.image.working_max_side).rgb
+    garment_mask = segmentation.remove_clothes_background(garment_work)
+    body_points = segmentation.detect_pose_landmarks(person)
+    
+    overlay_size = (width // 2, height // 3)
+    overlay = cv2.resize(garment, overlay_size)
+    overlay_mask = cv2.resize(segmentation.remove_clothes_background(garment), overlay_size)
+    person_pil = DecodedImage(format='jpeg', pixels=person).pil
+    
+    # Без кэша одежды каждый прогон проходит весь конвейер
+    cold_processor = ImageProcessor()
+    cold_processor.garment_cache = GarmentCache(max_bytes=0, disk_dir='')
+    warm_processor = ImageProcessor()
+    warm_processor.garment_cache = GarmentCache(disk_dir='')
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(
+        warm_processor.process_try_on(person_jpeg, garment_jpeg, 'bench-garment')
+    )
+    
+    return {
+        'segment_human': lambda: segmentation.segment_human(person_bgr),
+        'segment_human_single_scale': lambda: segmentation.segment_human(person_bgr, coarse_side=0),
+        'remove_clothes_background': lambda: segmentation.remove_clothes_background(garment),
+        'place_clothes_smart': lambda: placer.place_clothes_smart(
+            person, garment_work, body_points, clothes_mask=garment_mask
+        ),
+        '_blend_images': lambda: placer._blend_images(
+            person, overlay, overlay_mask, width // 4, height // 3
+        ),
+        'pil_to_bytes': lambda: file_handler.pil_to_bytes(person_pil),
+        'pil_to_bytes_fast': lambda: file_handler.pil_to_bytes(person_pil, fast=True),
+        'pil_to_bytes_webp': lambda: file_handler.pil_to_bytes(person_pil, format='WEBP'),
+        # Кодирование до подбора качества (q95) и progressive с optimize, включаемый
+        # TRYON_OUTPUT_PROGRESSIVE=1, — для сравнения с pil_to_bytes по умолчанию
+        'encode_q95_baseline': lambda: _save_jpeg(person_pil, quality=95),
+        'encode_progressive': lambda: _save_jpeg(
+            person_pil, quality=file_handler.choose_quality(
+                width * height, config.image.output_target_bytes
+            ), subsampling=2, optimize=True, progressive=True
+        ),
+        'process_try_on': lambda: loop.run_until_complete(
+            cold_processor.process_try_on(person_jpeg, garment_jpeg)
+        ),
+        'process_try_on_cached_garment': lambda: loop.run_until_complete(
+            warm_processor.process_try_on(person_jpeg, None, 'bench-garment')
+        ),
+    }
+
+def run_benchmarks(sizes: List[float], repeat: int, warmup: int, only: List[str]) -> Dict:
+    results = {}
+    for megapixels in sizes:
+        for name, func in build_cases(megapixels).items():
+            if only and name not in only:
+                continue
+            key = f'{megapixels:g}mp/{name}'
+            results[key] = measure(func, repeat, warmup)
+            print(
+                f"{key:45s} p50={results[key]['p50'] * 1000:9.2f} ms "
+                f"p95={results[key]['p95'] * 1000:9.2f} ms "
+                f"{results[key]['throughput']:8.2f} op/s"
+            )
+    
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'opencv': cv2.__version__,
+            'working_max_side': config.image.working_max_side,
+            'output_max_side': config.image.output_max_side,
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+def compare(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Список регрессий по p50 относительно базовой линии"""
+    regressions = []
+    for key, base in baseline.get('results', {}).items():
+        result = current['results'].get(key)
+        if result is None:
+            continue
+        ratio = result['p50'] / base['p50'] if base['p50'] else 1.0
+        marker = 'REGRESSION' if ratio > 1 + tolerance else 'ok'
+        print(f"{key:45s} {base['p50'] * 1000:9.2f} -> {result['p50'] * 1000:9.2f} ms  x{ratio:.2f}  {marker}")
+        if ratio > 1 + tolerance:
+            regressions.append(key)
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера примерки")
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 4, 12], help="размеры в мегапикселях")
+    parser.add_argument('--repeat', type=int, default=30, help=f"p99 считается от {MIN_RUNS_FOR_P99} прогонов")
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--only', nargs='*', default=[], help="запустить только эти замеры")
+    parser.add_argument('--output', help="куда сохранить результаты в JSON")
+    parser.add_argument('--baseline', help="JSON базовой линии для сравнения")
+    parser.add_argument('--save-baseline', help="сохранить результаты как новую базовую линию")
+    parser.add_argument('--tolerance', type=float, default=0.15, help="допустимый рост p50")
+    args = parser.parse_args(argv)
+    
+    # Логи конвейера на каждый прогон только мешают
+    logging.basicConfig(level=logging.WARNING)
+    
+    current = run_benchmarks(args.sizes, args.repeat, args.warmup, args.only)
+    
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, 'w') as f:
+            json.dump(current, f, indent=2)
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            return 1
+    
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,246 @@
+"""
+Локальная замена Telegram Bot API для нагрузочного теста.
+
+Отдает боту обновления (getUpdates), файлы (getFile и /file/...) и принимает
+его ответы (sendMessage, sendPhoto, editMessageMedia и т.д.). Бот подключается
+к ней без изменений кода через TELEGRAM_API_URL.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'LoadTest', 'username': 'loadtest_bot'}
+# Больше обновлений за один getUpdates Telegram не отдает
+MAX_UPDATES = 100
+
+class APIError(Exception):
+    """Ответ Bot API с ok=false"""
+    
+    def __init__(self, description: str, code: int = 400):
+        super().__init__(description)
+        self.description = description
+        self.code = code
+
+@dataclass
+class OutgoingMessage:
+    """Запрос бота, адресованный пользователю"""
+    method: str
+    chat_id: int
+    text: Optional[str] = None
+    caption: Optional[str] = None
+    at: float = field(default_factory=time.perf_counter)
+
+class FakeBotAPI:
+    """Сервер Bot API в памяти: обновления, файлы и исходящие сообщения по чатам"""
+    
+    def __init__(self, host: str = '127.0.0.1', port: int = 8081):
+        self.host = host
+        self.port = port
+        self.files: Dict[str, bytes] = {}
+        self.calls: Counter = Counter()
+        # Бот начал длинный опрос — значит, запуск завершен
+        self.ready = asyncio.Event()
+        self._outboxes: Dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        self._updates: List[Dict] = []
+        self._new_update = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._runner: Optional[web.AppRunner] = None
+    
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+    
+    async def start(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route('*', '/bot{token}/{method}', self._handle_method)
+        app.router.add_get('/file/bot{token}/{path:.+}', self._handle_file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+    
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+    
+    def outbox(self, chat_id: int) -> asyncio.Queue:
+        """Очередь запросов бота в чат chat_id"""
+        return self._outboxes[chat_id]
+    
+    def add_photo(self, data: bytes, width: int, height: int) -> List[Dict]:
+        """Файл для скачивания ботом; возвращает поле photo входящего сообщения"""
+        file_id = self._store_file(data)
+        return [{
+            'file_id': file_id,
+            'file_unique_id': f'u{file_id}',
+            'width': width,
+            'height': height,
+            'file_size': len(data),
+        }]
+    
+    def push_message(
+        self,
+        user_id: int,
+        text: Optional[str] = None,
+        photo: Optional[List[Dict]] = None
+    ):
+        """Входящее сообщение пользователя для следующего getUpdates"""
+        message = {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+        }
+        if text is not None:
+            message['text'] = text
+            if text.startswith('/'):
+                message['entities'] = [
+                    {'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}
+                ]
+        if photo is not None:
+            message['photo'] = photo
+            
+        self._updates.append({'update_id': next(self._update_ids), 'message': message})
+        self._new_update.set()
+    
+    def _store_file(self, data: bytes) -> str:
+        file_id = f'file{next(self._file_ids)}'
+        self.files[file_id] = data
+        return file_id
+    
+    def _message(self, chat_id: int, message_id: Optional[int] = None, **fields) -> Dict:
+        return {
+            'message_id': message_id or next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            **fields,
+        }
+    
+    def _emit(self, method: str, chat_id: int, text: Optional[str] = None, caption: Optional[str] = None):
+        self._outboxes[chat_id].put_nowait(OutgoingMessage(method, chat_id, text, caption))
+    
+    async def _read_params(self, request: web.Request) -> Dict[str, Any]:
+        if request.content_type == 'application/json':
+            return await request.json()
+        params = {}
+        for name, value in (await request.post()).items():
+            # Загруженные файлы приходят как FileField
+            params[name] = value.file.read() if hasattr(value, 'file') else value
+        for name, value in request.query.items():
+            params.setdefault(name, value)
+        return params
+    
+    async def _handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+        try:
+            params = await self._read_params(request)
+            handler = getattr(self, f'_api_{method.lower()}', None)
+            # Неизвестные методы (sendChatAction, deleteMessage, ...) просто подтверждаются
+            result = await handler(params) if handler is not None else True
+        except APIError as e:
+            return web.json_response(
+                {'ok': False, 'error_code': e.code, 'description': e.description},
+                status=e.code
+            )
+        return web.json_response({'ok': True, 'result': result})
+    
+    async def _handle_file(self, request: web.Request) -> web.Response:
+        file_id = request.match_info['path'].rsplit('/', 1)[-1].split('.', 1)[0]
+        data = self.files.get(file_id)
+        if data is None:
+            raise web.HTTPNotFound()
+        return web.Response(body=data, content_type='image/jpeg')
+    
+    def _photo_field(self, params: Dict[str, Any], value: Any) -> List[Dict]:
+        """Фото из параметра: file_id, attach://<поле> или загруженные bytes"""
+        if isinstance(value, str) and value.startswith('attach://'):
+            value = params[value[len('attach://'):]]
+        if isinstance(value, bytes):
+            file_id = self._store_file(value)
+            size = len(value)
+        else:
+            file_id = value
+            size = len(self.files.get(file_id, b''))
+        return [{'file_id': file_id, 'file_unique_id': f'u{file_id}', 'width': 0, 'height': 0, 'file_size': size}]
+    
+    async def _api_getme(self, params: Dict[str, Any]) -> Dict:
+        return BOT_USER
+    
+    async def _api_getwebhookinfo(self, params: Dict[str, Any]) -> Dict:
+        # aiogram проверяет webhook перед запуском long polling
+        return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+    
+    async def _api_getupdates(self, params: Dict[str, Any]) -> List[Dict]:
+        offset = int(params.get('offset') or 0)
+        timeout = float(params.get('timeout') or 0)
+        limit = min(int(params.get('limit') or MAX_UPDATES), MAX_UPDATES)
+        if timeout > 1:
+            self.ready.set()
+            
+        if offset < 0:
+            return self._updates[offset:]
+        # Обновления до offset подтверждены ботом
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while not self._updates and loop.time() < deadline:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+    
+    async def _api_getfile(self, params: Dict[str, Any]) -> Dict:
+        file_id = params.get('file_id')
+        if file_id not in self.files:
+            raise APIError('Bad Request: invalid file_id')
+        return {
+            'file_id': file_id,
+            'file_unique_id': f'u{file_id}',
+            'file_size': len(self.files[file_id]),
+            'file_path': f'photos/{file_id}.jpg',
+        }
+    
+    async def _api_sendmessage(self, params: Dict[str, Any]) -> Dict:
+        chat_id = int(params['chat_id'])
+        self._emit('sendMessage', chat_id, text=params.get('text'))
+        return self._message(chat_id, text=params.get('text', ''))
+    
+    async def _api_editmessagetext(self, params: Dict[str, Any]) -> Dict:
+        chat_id = int(params['chat_id'])
+        self._emit('editMessageText', chat_id, text=params.get('text'))
+        return self._message(chat_id, int(params['message_id']), text=params.get('text', ''))
+    
+    async def _api_sendphoto(self, params: Dict[str, Any]) -> Dict:
+        chat_id = int(params['chat_id'])
+        photo = self._photo_field(params, params['photo'])
+        self._emit('sendPhoto', chat_id, caption=params.get('caption'))
+        return self._message(chat_id, photo=photo, caption=params.get('caption', ''))
+    
+    async def _api_editmessagemedia(self, params: Dict[str, Any]) -> Dict:
+        chat_id = int(params['chat_id'])
+        media = json.loads(params['media'])
+        photo = self._photo_field(params, media['media'])
+        self._emit('editMessageMedia', chat_id, caption=media.get('caption'))
+        return self._message(chat_id, int(params['message_id']), photo=photo, caption=media.get('caption', ''))
+    
+    async def _api_sendmediagroup(self, params: Dict[str, Any]) -> List[Dict]:
+        chat_id = int(params['chat_id'])
+        media = json.loads(params['media'])
+        self._emit('sendMediaGroup', chat_id, caption=media[0].get('caption') if media else None)
+        return [
+            self._message(chat_id, photo=self._photo_field(params, item['media']), caption=item.get('caption', ''))
+            for item in media
+        ]
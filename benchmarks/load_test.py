@@ -0,0 +1,376 @@
+"""
+Нагрузочный тест бота целиком: локальная замена Bot API, синтетические пользователи
+и отчет о пропускной способности, задержках, памяти и доле ошибок.
+
+Запуск из корня репозитория (бот запускается тестом как отдельный процесс):
+    python -m benchmarks.load_test --users 200 --concurrency 20 --sizes 1:0.7 4:0.25 12:0.05
+    python -m benchmarks.load_test --users 50 --concurrency 50 --output load.json
+
+Уже запущенный бот (TELEGRAM_API_URL=http://127.0.0.1:8081, BOT_TOKEN=123456:LOADTEST):
+    python -m benchmarks.load_test --no-spawn --bot-pid 12345
+
+Каждый пользователь проходит сценарий UserStates: /start, фото человека, фото одежды.
+Задержка примерки — от отправки фото одежды до результата (фото с итоговой подписью).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import signal
+import struct
+import sys
+import time
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.bench_pipeline import percentile
+from benchmarks.fake_bot_api import FakeBotAPI, OutgoingMessage
+from benchmarks.synthetic import size_for_megapixels, make_person, make_garment, encode_jpeg
+
+logger = logging.getLogger(__name__)
+
+LOADTEST_TOKEN = '123456:LOADTEST'
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Подписи и тексты ответов бота, по которым определяется исход
+RESULT_MARKER = 'результат примерки'
+PREVIEW_PREFIX = '👀'
+ERROR_PREFIX = '❌'
+REJECTED_PREFIX = '⚠️'
+
+@dataclass
+class UserResult:
+    user_id: int
+    megapixels: float
+    # completed, error, rejected или timeout
+    status: str
+    selfie_latency: Optional[float] = None
+    preview_latency: Optional[float] = None
+    try_on_latency: Optional[float] = None
+    detail: Optional[str] = None
+
+class StepTimeout(Exception):
+    """Бот не ответил за отведенное время"""
+
+def parse_size_mix(values: List[str]) -> List[Tuple[float, float]]:
+    """'1:0.7' -> (1.0, 0.7): размер в мегапикселях и его доля среди пользователей"""
+    mix = []
+    for value in values:
+        megapixels, _, weight = value.partition(':')
+        mix.append((float(megapixels), float(weight or 1)))
+    return mix
+
+def unique_jpeg(data: bytes, tag: int) -> bytes:
+    """
+    Тот же JPEG с комментарием-меткой после SOI: пиксели не меняются, а bytes
+    отличаются, поэтому кэши одежды и результатов не срабатывают между пользователями.
+    """
+    payload = f'loadtest {tag}'.encode('ascii')
+    return data[:2] + b'\xff\xfe' + struct.pack('>H', len(payload) + 2) + payload + data[2:]
+
+def build_images(mix: List[Tuple[float, float]], variants: int) -> Dict[float, List[Tuple[bytes, bytes, int, int]]]:
+    """Для каждого размера variants пар (фото человека, фото одежды, ширина, высота)"""
+    images = {}
+    for megapixels, _ in mix:
+        width, height = size_for_megapixels(megapixels)
+        images[megapixels] = [
+            (
+                encode_jpeg(make_person(width, height, seed=variant)),
+                encode_jpeg(make_garment(width, height, seed=100 + variant)),
+                width,
+                height
+            )
+            for variant in range(variants)
+        ]
+    return images
+
+def _read_rss(pid: int) -> int:
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def tree_rss(pid: int) -> Optional[Tuple[int, int]]:
+    """RSS процесса и сумма RSS вместе с потомками (пул примерки) по /proc; None вне Linux"""
+    if not os.path.isdir('/proc'):
+        return None
+        
+    children: Dict[int, List[int]] = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                # Имя процесса может содержать пробелы, поля идут после последней ')'
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+        
+    try:
+        own = _read_rss(pid)
+    except OSError:
+        return None
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            total += _read_rss(current)
+        except OSError:
+            pass
+        pending.extend(children.get(current, ()))
+    return own, total
+
+class MemorySampler:
+    """Пиковая память процесса бота за время теста"""
+    
+    def __init__(self, pid: Optional[int], interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_tree_rss = 0
+        self.available = pid is not None
+    
+    async def run(self):
+        while self.available:
+            sample = tree_rss(self.pid)
+            if sample is None:
+                self.available = False
+                break
+            self.peak_rss = max(self.peak_rss, sample[0])
+            self.peak_tree_rss = max(self.peak_tree_rss, sample[1])
+            await asyncio.sleep(self.interval)
+    
+    def report(self) -> Optional[Dict[str, int]]:
+        if not self.peak_rss:
+            return None
+        return {'peak_rss': self.peak_rss, 'peak_tree_rss': self.peak_tree_rss}
+
+async def next_message(outbox: asyncio.Queue, deadline: float) -> OutgoingMessage:
+    remaining = deadline - time.perf_counter()
+    if remaining <= 0:
+        raise StepTimeout()
+    try:
+        return await asyncio.wait_for(outbox.get(), remaining)
+    except asyncio.TimeoutError:
+        raise StepTimeout()
+
+async def simulate_user(
+    api: FakeBotAPI,
+    user_id: int,
+    megapixels: float,
+    images: Tuple[bytes, bytes, int, int],
+    timeout: float
+) -> UserResult:
+    """Один проход сценария: /start -> фото человека -> фото одежды -> результат"""
+    human_data, clothes_data, width, height = images
+    result = UserResult(user_id, megapixels, 'timeout')
+    outbox = api.outbox(user_id)
+    deadline = time.perf_counter() + timeout
+    
+    try:
+        api.push_message(user_id, text='/start')
+        await next_message(outbox, deadline)
+        
+        started = time.perf_counter()
+        api.push_message(user_id, photo=api.add_photo(human_data, width, height))
+        # Бот отвечает на фото человека, только когда оно скачано и сохранено
+        # в состоянии, поэтому одежду можно отправлять сразу после ответа
+        reply = await next_message(outbox, deadline)
+        result.selfie_latency = reply.at - started
+        if (reply.text or '').startswith(ERROR_PREFIX):
+            result.status, result.detail = 'error', reply.text
+            return result
+            
+        started = time.perf_counter()
+        api.push_message(user_id, photo=api.add_photo(clothes_data, width, height))
+        while True:
+            reply = await next_message(outbox, deadline)
+            caption = reply.caption or ''
+            text = reply.text or ''
+            if caption.startswith(PREVIEW_PREFIX):
+                result.preview_latency = reply.at - started
+            elif RESULT_MARKER in caption:
+                result.status, result.try_on_latency = 'completed', reply.at - started
+                return result
+            elif text.startswith(ERROR_PREFIX):
+                result.status, result.detail = 'error', text
+                return result
+            elif text.startswith(REJECTED_PREFIX) or text.startswith('⏳ Предыдущая'):
+                result.status, result.detail = 'rejected', text
+                return result
+            # Остальное — статус обработки и место в очереди
+    except StepTimeout:
+        return result
+
+def summarize(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'p50': percentile(values, 0.50),
+        'p95': percentile(values, 0.95),
+        'p99': percentile(values, 0.99),
+        'max': max(values),
+    }
+
+def build_report(results: List[UserResult], duration: float) -> Dict:
+    completed = [r for r in results if r.status == 'completed']
+    report = {
+        'duration': duration,
+        'users': len(results),
+        'throughput': len(completed) / duration if duration else 0.0,
+        'error_rate': 1 - len(completed) / len(results) if results else 0.0,
+        'outcomes': {
+            status: sum(1 for r in results if r.status == status)
+            for status in ('completed', 'error', 'rejected', 'timeout')
+        },
+        'latency': {
+            'try_on': summarize([r.try_on_latency for r in completed]),
+            'preview': summarize([r.preview_latency for r in results if r.preview_latency is not None]),
+            'selfie': summarize([r.selfie_latency for r in results if r.selfie_latency is not None]),
+        },
+        'by_size': {},
+        'failures': [asdict(r) for r in results if r.status != 'completed'][:20],
+    }
+    for megapixels in sorted({r.megapixels for r in results}):
+        group = [r for r in results if r.megapixels == megapixels]
+        done = [r.try_on_latency for r in group if r.status == 'completed']
+        report['by_size'][f'{megapixels:g}mp'] = {
+            'users': len(group),
+            'error_rate': 1 - len(done) / len(group),
+            'try_on': summarize(done),
+        }
+    return report
+
+async def start_bot(api: FakeBotAPI, command: List[str]) -> asyncio.subprocess.Process:
+    env = dict(os.environ)
+    env.update({
+        'TELEGRAM_API_URL': api.base_url,
+        'BOT_TOKEN': LOADTEST_TOKEN,
+        'BOT_MODE': 'polling',
+    })
+    return await asyncio.create_subprocess_exec(*command, cwd=REPO_ROOT, env=env)
+
+async def stop_bot(process: asyncio.subprocess.Process):
+    """SIGINT для штатной остановки (пул, кэши), затем kill"""
+    if process.returncode is not None:
+        return
+    process.send_signal(signal.SIGINT)
+    try:
+        await asyncio.wait_for(process.wait(), 30)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+async def run_load_test(args) -> Dict:
+    mix = parse_size_mix(args.sizes)
+    images = build_images(mix, args.variants)
+    rng = random.Random(args.seed)
+    
+    api = FakeBotAPI(port=args.port)
+    await api.start()
+    process = await start_bot(api, args.bot_command) if args.spawn else None
+    sampler = MemorySampler(process.pid if process else args.bot_pid)
+    sampler_task = asyncio.create_task(sampler.run())
+    
+    try:
+        await asyncio.wait_for(api.ready.wait(), args.startup_timeout)
+        logger.info(f"Bot is polling, starting {args.users} users (concurrency {args.concurrency})")
+        
+        semaphore = asyncio.Semaphore(args.concurrency)
+        
+        async def user(user_id: int) -> UserResult:
+            megapixels = rng.choices([m for m, _ in mix], weights=[w for _, w in mix])[0]
+            human, clothes, width, height = rng.choice(images[megapixels])
+            if not args.repeat_inputs:
+                human, clothes = unique_jpeg(human, user_id), unique_jpeg(clothes, user_id)
+            async with semaphore:
+                return await simulate_user(
+                    api, user_id, megapixels, (human, clothes, width, height), args.timeout
+                )
+                
+        started = time.perf_counter()
+        results = await asyncio.gather(*(user(1000 + i) for i in range(args.users)))
+        duration = time.perf_counter() - started
+    finally:
+        sampler.available = False
+        sampler_task.cancel()
+        if process is not None:
+            await stop_bot(process)
+        await api.close()
+        
+    report = build_report(results, duration)
+    report['memory'] = sampler.report()
+    report['api_calls'] = dict(api.calls)
+    report['meta'] = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'sizes': {f'{m:g}mp': w for m, w in mix},
+        'repeat_inputs': args.repeat_inputs,
+    }
+    return report
+
+def print_report(report: Dict):
+    outcomes = report['outcomes']
+    print(
+        f"users={report['users']} duration={report['duration']:.1f}s "
+        f"throughput={report['throughput']:.2f} try-on/s error_rate={report['error_rate']:.1%} "
+        f"({', '.join(f'{k}={v}' for k, v in outcomes.items())})"
+    )
+    for name, stats in report['latency'].items():
+        if stats:
+            print(
+                f"{name:10s} p50={stats['p50'] * 1000:9.1f} ms p95={stats['p95'] * 1000:9.1f} ms "
+                f"p99={stats['p99'] * 1000:9.1f} ms"
+            )
+    for size, stats in report['by_size'].items():
+        if stats['try_on']:
+            print(
+                f"{size:10s} p50={stats['try_on']['p50'] * 1000:9.1f} ms "
+                f"p95={stats['try_on']['p95'] * 1000:9.1f} ms error_rate={stats['error_rate']:.1%}"
+            )
+    if report['memory']:
+        print(
+            f"memory     peak_rss={report['memory']['peak_rss'] / 2**20:.0f} MiB "
+            f"with_workers={report['memory']['peak_tree_rss'] / 2**20:.0f} MiB"
+        )
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота примерки")
+    parser.add_argument('--users', type=int, default=100, help="число синтетических пользователей")
+    parser.add_argument('--concurrency', type=int, default=10, help="пользователей одновременно")
+    parser.add_argument('--sizes', nargs='+', default=['1:0.7', '4:0.25', '12:0.05'],
+                        help="размеры фото в мегапикселях и их доли, МП:доля")
+    parser.add_argument('--variants', type=int, default=3, help="разных изображений каждого размера")
+    parser.add_argument('--repeat-inputs', action='store_true',
+                        help="одинаковые bytes у пользователей (проверка кэшей)")
+    parser.add_argument('--timeout', type=float, default=180, help="время на сценарий одного пользователя")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--no-spawn', dest='spawn', action='store_false', help="бот уже запущен")
+    parser.add_argument('--bot-pid', type=int, help="PID уже запущенного бота для замера памяти")
+    parser.add_argument('--bot-command', nargs='+', default=[sys.executable, 'bot.py'])
+    parser.add_argument('--startup-timeout', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="куда сохранить отчет в JSON")
+    args = parser.parse_args(argv)
+    
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    report = asyncio.run(run_load_test(args))
+    print_report(report)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,44 @@
+from io import BytesIO
+from typing import Tuple
+import cv2
+import numpy as np
+from PIL import Image
+
+def size_for_megapixels(megapixels: float, aspect: float = 3 / 4) -> Tuple[int, int]:
+    """(ширина, высота) портретного кадра с заданным числом мегапикселей"""
+    height = int(round((megapixels * 1_000_000 / aspect) ** 0.5))
+    width = int(round(height * aspect))
+    return width, height
+
+def make_person(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Синтетическое фото человека (RGB): фон с шумом, голова, торс и руки"""
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(60, 160, height, dtype=np.float32)[:, None, None]
+    image = np.broadcast_to(gradient, (height, width, 3)).astype(np.uint8).copy()
+    image = cv2.add(image, rng.integers(0, 25, image.shape, dtype=np.uint8))
+    
+    skin = (224, 172, 140)
+    cx = width // 2
+    cv2.ellipse(image, (cx, height // 5), (width // 10, height // 11), 0, 0, 360, skin, -1)
+    cv2.rectangle(image, (width // 4, height // 3), (3 * width // 4, 3 * height // 4), (40, 60, 120), -1)
+    cv2.rectangle(image, (width // 6, height // 3), (width // 4, 2 * height // 3), skin, -1)
+    cv2.rectangle(image, (3 * width // 4, height // 3), (5 * width // 6, 2 * height // 3), skin, -1)
+    return image
+
+def make_garment(width: int, height: int, seed: int = 1) -> np.ndarray:
+    """Синтетическое фото одежды (RGB): футболка на белом фоне"""
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), 245, dtype=np.uint8)
+    color = tuple(int(c) for c in rng.integers(20, 180, 3))
+    body = np.array([
+        (0.30, 0.15), (0.42, 0.10), (0.58, 0.10), (0.70, 0.15), (0.92, 0.32),
+        (0.80, 0.42), (0.72, 0.35), (0.72, 0.92), (0.28, 0.92), (0.28, 0.35),
+        (0.20, 0.42), (0.08, 0.32)
+    ]) * (width, height)
+    cv2.fillPoly(image, [body.astype(np.int32)], color)
+    return image
+
+def encode_jpeg(image: np.ndarray, quality: int = 90) -> bytes:
+    buffer = BytesIO()
+    Image.fromarray(image).save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
@@ -1,9 +1,16 @@
+import time
+# Время запуска считается от начала импорта модулей
+STARTED = time.perf_counter()
+
 import asyncio
 import logging
+import tracemalloc
 from aiogram import Bot, Dispatcher, types
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.dispatcher import FSMContext
 from aiogram.utils import executor
+from aiogram.utils.exceptions import TelegramAPIError
 
 from config import config
 from states.user_states import UserStates
@@ -14,8 +21,18 @@ from handlers.start import (
     handle_wrong_input_human, 
     handle_wrong_input_clothes
 )
-from handlers.photo_handlers import handle_human_photo, handle_clothes_photo
+from handlers.photo_handlers import (
+    handle_human_photo,
+    handle_clothes_photo,
+    handle_clothes_album,
+    handle_catalog_item
+)
 from handlers.errors import handle_telegram_error, handle_other_errors
+from handlers.admin import toggle_profiling, show_stats
+from services.executor import try_on_executor
+from services.registry import registry
+from utils.http_client import download_client
+from utils.metrics import metrics
 
 # Настройка логирования
 logging.basicConfig(
@@ -23,8 +40,13 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
+registry.timings['imports'] = time.perf_counter() - STARTED
+
 # Инициализация бота
-bot = Bot(token=config.bot.token)
+bot = Bot(
+    token=config.bot.token,
+    server=TelegramAPIServer.from_base(config.api.telegram_api_url)
+)
 storage = MemoryStorage()
 dp = Dispatcher(bot, storage=storage)
 
@@ -32,6 +54,8 @@ dp = Dispatcher(bot, storage=storage)
 def register_handlers():
     # Команды
     dp.register_message_handler(send_welcome, commands=['start'], state='*')
+    dp.register_message_handler(toggle_profiling, commands=['profile'], state='*')
+    dp.register_message_handler(show_stats, commands=['stats'], state='*')
     
     # Фото хендлеры
     dp.register_message_handler(
@@ -39,12 +63,26 @@ def register_handlers():
         state=UserStates.waiting_for_human_photo, 
         content_types=types.ContentType.PHOTO
     )
+    # Альбом одежды проверяется раньше одиночного фото
+    dp.register_message_handler(
+        handle_clothes_album,
+        lambda message: message.media_group_id is not None,
+        state=UserStates.waiting_for_clothes_photo,
+        content_types=types.ContentType.PHOTO
+    )
     dp.register_message_handler(
         handle_clothes_photo, 
         state=UserStates.waiting_for_clothes_photo, 
         content_types=types.ContentType.PHOTO
     )
     
+    # Вещь из каталога по номеру
+    dp.register_message_handler(
+        handle_catalog_item,
+        regexp=r'^\s*#\d+\s*$',
+        state=UserStates.waiting_for_clothes_photo
+    )
+    
     # Неправильный ввод
     dp.register_message_handler(
         handle_wrong_input_human, 
@@ -61,18 +99,38 @@ def register_handlers():
 
 async def on_startup(dp):
     """Действия при запуске бота"""
-    logging.info("Бот запущен")
     register_handlers()
+    await download_client.start()
+    # Процессы пула поднимаются и прогреваются синтетической примеркой
+    with registry.timed('pool'):
+        await try_on_executor.start()
+    if config.workers.warm_up:
+        with registry.timed('services'):
+            await registry.warm_up()
+    registry.timings['total'] = time.perf_counter() - STARTED
+    logging.info(f"Бот запущен: {registry.report()}")
+    
+    if config.metrics.trace_memory:
+        tracemalloc.start()
+    if metrics.exporter is not None:
+        asyncio.create_task(metrics.run_export_loop(config.metrics.export_interval))
 
 async def on_shutdown(dp):
     """Действия при остановке бота"""
     logging.info("Бот остановлен")
+    await try_on_executor.shutdown()
+    await download_client.close()
+    metrics.export()
     await bot.close()
 
 if __name__ == '__main__':
-    executor.start_polling(
-        dp,
-        on_startup=on_startup,
-        on_shutdown=on_shutdown,
-        skip_updates=True
-    )
+    if config.webhook.mode == 'webhook':
+        from webhook_server import run_webhook
+        run_webhook(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+    else:
+        executor.start_polling(
+            dp,
+            on_startup=on_startup,
+            on_shutdown=on_shutdown,
+            skip_updates=True
+        )
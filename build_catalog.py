@@ -0,0 +1,110 @@
+"""
+Подготовка каталога одежды магазина-партнера для примерки по номеру («#123»).
+
+    python build_catalog.py catalog/photos data/catalog
+    python build_catalog.py catalog/photos data/catalog --scales 384,640,1280 --workers 8
+
+Номер вещи — имя файла без расширения. Фон удаляется один раз, одежда сохраняется
+в нескольких размерах как premultiplied RGBA в архив, который бот отображает
+в память (CATALOG_DIR=data/catalog).
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from config import config
+from services.catalog import CatalogWriter, premultiply
+from services.segmentation import SimpleSegmentation
+from utils.image_buffer import DecodedImage
+
+logger = logging.getLogger(__name__)
+
+_segmentation = None
+
+def _init_worker():
+    global _segmentation
+    _segmentation = SimpleSegmentation()
+
+def _prepare_item(args: Tuple[str, List[int]]) -> Tuple[str, Optional[List[np.ndarray]]]:
+    """Маска считается один раз в наибольшем размере, остальные размеры — уменьшением"""
+    path, scales = args
+    try:
+        with open(path, 'rb') as f:
+            image = DecodedImage.from_bytes(f.read(), max_side=max(scales))
+        rgb = image.rgb
+        mask = _segmentation.remove_clothes_background(rgb)
+        
+        result = []
+        for max_side in sorted(scales, reverse=True):
+            factor = max_side / max(image.width, image.height)
+            if factor < 1:
+                size = (max(1, round(image.width * factor)), max(1, round(image.height * factor)))
+                scaled_rgb = cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+                scaled_mask = cv2.resize(mask, size, interpolation=cv2.INTER_AREA)
+            else:
+                scaled_rgb, scaled_mask = rgb, mask
+            result.append(premultiply(scaled_rgb, scaled_mask))
+        return path, result
+    except Exception as e:
+        logger.error(f"Error preparing {path}: {e}")
+        return path, None
+
+def find_images(catalog_dir: str) -> List[str]:
+    return sorted(
+        os.path.join(catalog_dir, name) for name in os.listdir(catalog_dir)
+        if os.path.splitext(name)[1].lower() in config.image.supported_formats
+    )
+
+def build_catalog(catalog_dir: str, out_dir: str, scales: List[int], workers: int) -> int:
+    return build_archive(find_images(catalog_dir), out_dir, scales, workers)
+
+def build_archive(paths: List[str], out_dir: str, scales: List[int], workers: int) -> int:
+    """Архив из списка файлов; номер вещи — имя файла без расширения"""
+    writer = CatalogWriter(out_dir)
+    started = time.perf_counter()
+    failed = 0
+    
+    with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+        for path, result in pool.imap(_prepare_item, [(p, scales) for p in paths]):
+            if result is None:
+                failed += 1
+                continue
+            # Писатель один, поэтому архив собирается в главном процессе по порядку
+            item_id = os.path.splitext(os.path.basename(path))[0]
+            writer.add(item_id, item_id, result)
+            
+    writer.finish()
+    logger.info(
+        f"Catalog built: {len(writer.items)} items, {failed} failed, "
+        f"{time.perf_counter() - started:.1f}s"
+    )
+    return failed
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('catalog_dir', help='Каталог с фото одежды')
+    parser.add_argument('out_dir', help='Куда записать архив')
+    parser.add_argument(
+        '--scales', default=f'{config.image.preview_max_side},{config.image.working_max_side}',
+        help='Размеры по большей стороне через запятую'
+    )
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+    
+    scales = [int(s) for s in args.scales.split(',') if s.strip()]
+    failed = build_catalog(args.catalog_dir, args.out_dir, scales, args.workers)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    sys.exit(main())
@@ -10,18 +10,146 @@ class BotConfig:
 class ImageProcessingConfig:
     max_file_size: int = 10 * 1024 * 1024  # 10MB
     supported_formats: tuple = ('.jpg', '.jpeg', '.png', '.webp')
+    # Верхняя граница качества; фактическое подбирается под output_target_bytes
     output_quality: int = 95
+    output_format: str = os.getenv("TRYON_OUTPUT_FORMAT", "JPEG")
+    output_target_bytes: int = int(os.getenv("TRYON_OUTPUT_TARGET_BYTES", 400 * 1024))
+    output_progressive: bool = os.getenv("TRYON_OUTPUT_PROGRESSIVE", "0") == "1"
     clothes_scale_factor: float = 0.7
     clothes_position_offset: int = 50
+    # Маски и поза считаются на уменьшенной копии, результат — в размере вывода
+    working_max_side: int = 640
+    output_max_side: int = 1280
+    # Сегментация человека: грубая маска на копии не больше этого размера
+    segmentation_coarse_side: int = 512
+    # Проверяются по заголовку файла до декодирования
+    min_image_side: int = 200
+    max_image_side: int = 8192
+    max_megapixels: float = 40.0
+    # Быстрый предпросмотр перед полным результатом
+    preview: bool = os.getenv("TRYON_PREVIEW", "1") == "1"
+    preview_max_side: int = 384
+    preview_quality: int = 70
+    # Альбом одежды приходит отдельными сообщениями, их собираем за album_wait секунд
+    album_wait: float = 1.0
+    max_batch_garments: int = 10
     
 @dataclass
 class APIConfig:
     remove_bg_api_key: str = os.getenv("REMOVE_BG_API_KEY", "")
     request_timeout: int = 30
+    # Можно указать локальный сервер Bot API (например, для тестов)
+    telegram_api_url: str = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+    download_connections: int = int(os.getenv("DOWNLOAD_CONNECTIONS", 16))
+    download_retries: int = int(os.getenv("DOWNLOAD_RETRIES", 2))
+
+@dataclass
+class WorkerPoolConfig:
+    # 0 — обработка прямо в процессе бота (без пула)
+    workers: int = int(os.getenv("TRYON_WORKERS", os.cpu_count() or 1))
+    max_pending: int = int(os.getenv("TRYON_MAX_PENDING", 32))
+    job_timeout: float = float(os.getenv("TRYON_JOB_TIMEOUT", 60))
+    start_method: str = os.getenv("TRYON_START_METHOD", "")
+    # Синтетическая примерка при запуске, чтобы первый пользователь не ждал прогрева
+    warm_up: bool = os.getenv("TRYON_WARM_UP", "1") == "1"
+
+@dataclass
+class CacheConfig:
+    garment_cache_bytes: int = int(os.getenv("GARMENT_CACHE_BYTES", 256 * 1024 * 1024))
+    # Общий для бота и процессов пула: повторная одежда не скачивается и не сегментируется,
+    # в какой бы процесс ни попала. Пустая строка — только кэш в памяти каждого процесса
+    garment_cache_dir: str = os.getenv("GARMENT_CACHE_DIR", "data/garments")
+    garment_cache_disk_bytes: int = int(os.getenv("GARMENT_CACHE_DISK_BYTES", 2 * 1024 * 1024 * 1024))
+    # Фото человека между двумя сообщениями пользователя
+    photo_store_bytes: int = int(os.getenv("PHOTO_STORE_BYTES", 128 * 1024 * 1024))
+    photo_store_ttl: float = float(os.getenv("PHOTO_STORE_TTL", 30 * 60))
+    photo_store_dir: str = os.getenv("PHOTO_STORE_DIR", "")
+    # Готовые результаты примерки и их file_id в Telegram
+    render_cache_bytes: int = int(os.getenv("RENDER_CACHE_BYTES", 64 * 1024 * 1024))
+    render_cache_dir: str = os.getenv("RENDER_CACHE_DIR", "")
+    render_cache_disk_bytes: int = int(os.getenv("RENDER_CACHE_DISK_BYTES", 1024 * 1024 * 1024))
+
+@dataclass
+class MetricsConfig:
+    # log, prometheus, memory или пусто
+    exporter: str = os.getenv("METRICS_EXPORTER", "log")
+    prometheus_path: str = os.getenv("METRICS_PROMETHEUS_PATH", "tryon.prom")
+    export_interval: float = float(os.getenv("METRICS_EXPORT_INTERVAL", 60))
+    # Пик памяти по этапам через tracemalloc (заметно замедляет обработку)
+    trace_memory: bool = os.getenv("METRICS_TRACE_MEMORY", "0") == "1"
+
+@dataclass
+class WebhookConfig:
+    # polling или webhook
+    mode: str = os.getenv("BOT_MODE", "polling")
+    # Публичный адрес; пусто — webhook в Telegram не регистрируется (локальные тесты)
+    url: str = os.getenv("WEBHOOK_URL", "")
+    path: str = os.getenv("WEBHOOK_PATH", "/webhook")
+    host: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    port: int = int(os.getenv("WEBHOOK_PORT", 8080))
+    secret_token: str = os.getenv("WEBHOOK_SECRET", "")
+    max_concurrency: int = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", 64))
+    max_pending: int = int(os.getenv("WEBHOOK_MAX_PENDING", 1000))
+
+@dataclass
+class JobQueueConfig:
+    # 1 — обработчики только ставят задачи, рендерят отдельные процессы worker.py
+    enabled: bool = os.getenv("JOB_QUEUE", "0") == "1"
+    path: str = os.getenv("JOB_QUEUE_PATH", "data/jobs.sqlite3")
+    wal: bool = os.getenv("JOB_QUEUE_WAL", "1") == "1"
+    visibility_timeout: float = float(os.getenv("JOB_VISIBILITY_TIMEOUT", 120))
+    max_attempts: int = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+    poll_interval: float = float(os.getenv("JOB_POLL_INTERVAL", 0.5))
+    # Сколько хранить завершенные задачи, секунды; 0 — не удалять
+    retention: float = float(os.getenv("JOB_RETENTION", 7 * 24 * 3600))
+    purge_interval: float = 3600
+
+@dataclass
+class CatalogConfig:
+    # Архив, собранный build_catalog.py; пусто — примерка по номеру отключена
+    path: str = os.getenv("CATALOG_DIR", "")
+
+@dataclass
+class PoseConfig:
+    # heuristic — доли кадра; dnn — модель OpenCV DNN из POSE_MODEL_PATH
+    backend: str = os.getenv("POSE_BACKEND", "heuristic")
+    model_path: str = os.getenv("POSE_MODEL_PATH", "")
+    # Сторона входа модели, пиксели
+    input_size: int = int(os.getenv("POSE_INPUT_SIZE", 256))
+    min_confidence: float = 0.1
+    max_batch: int = 8
+    # Точек скольких фото помнить в каждом процессе
+    cache_size: int = int(os.getenv("POSE_CACHE_SIZE", 1024))
+
+@dataclass
+class AdmissionConfig:
+    # Суммарный размер одновременно обрабатываемых изображений, мегапиксели
+    max_megapixels: float = float(os.getenv("ADMISSION_MAX_MEGAPIXELS", 12 * (os.cpu_count() or 1)))
+    max_queue: int = int(os.getenv("ADMISSION_MAX_QUEUE", 64))
+    # Одновременных примерок на одного пользователя
+    per_user: int = int(os.getenv("ADMISSION_PER_USER", 1))
+    # Сколько запрос может ждать в очереди, секунды
+    max_wait: float = float(os.getenv("ADMISSION_MAX_WAIT", 30))
+
+@dataclass
+class QualityConfig:
+    # Под нагрузкой запрос получает уровень попроще, чтобы успеть к сроку
+    tiers: bool = os.getenv("TRYON_QUALITY_TIERS", "1") == "1"
+    # Срок ответа от получения фото одежды до готового результата, секунды
+    deadline: float = float(os.getenv("TRYON_DEADLINE", 10))
 
 class Config:
     bot = BotConfig()
     image = ImageProcessingConfig()
     api = APIConfig()
+    workers = WorkerPoolConfig()
+    cache = CacheConfig()
+    metrics = MetricsConfig()
+    webhook = WebhookConfig()
+    queue = JobQueueConfig()
+    admission = AdmissionConfig()
+    catalog = CatalogConfig()
+    pose = PoseConfig()
+    quality = QualityConfig()
 
 config = Config()
@@ -0,0 +1,49 @@
+from aiogram import types
+
+from config import config
+from services.admission import admission
+from services.registry import registry
+from utils.metrics import metrics, PROFILE_MODES
+
+def _is_admin(message: types.Message) -> bool:
+    return bool(config.bot.admin_id) and message.from_user.id == config.bot.admin_id
+
+async def toggle_profiling(message: types.Message):
+    """/profile [cprofile|tracemalloc|off] — профилирование следующих запросов"""
+    if not _is_admin(message):
+        return
+    
+    mode = message.get_args().strip().lower()
+    if mode in ('', 'off'):
+        metrics.profile_mode = None
+        await message.answer("Профилирование выключено")
+    elif mode in PROFILE_MODES:
+        metrics.profile_mode = mode
+        await message.answer(f"Профилирование включено: {mode}. Отчеты пишутся в лог.")
+    else:
+        await message.answer(f"Режимы: {', '.join(PROFILE_MODES)}, off")
+
+async def show_stats(message: types.Message):
+    """/stats — сводка по этапам обработки"""
+    if not _is_admin(message):
+        return
+    
+    lines = []
+    for stage, stats in sorted(metrics.snapshot().items()):
+        wall = stats.wall_time
+        if not wall.count:
+            continue
+        lines.append(
+            f"{stage}: {wall.count} шт., среднее {wall.sum / wall.count:.3f} с, "
+            f"p95 ≤ {wall.quantile(0.95)} с"
+        )
+    
+    lines.append(
+        f"допуск: в работе {admission.active} ({admission.active_megapixels:.1f} МП "
+        f"из {admission.max_megapixels:.0f}), в очереди {admission.queued}"
+    )
+    tiers = registry.get('image_processor').tiers
+    lines.append(f"качество (срок {tiers.deadline:.0f} с): {tiers.report()}")
+    if registry.timings:
+        lines.append(f"запуск: {registry.report()}")
+    await message.answer('\n'.join(lines))
@@ -1,32 +1,210 @@
+import asyncio
 import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 from aiogram import types
 from aiogram.dispatcher import FSMContext
 
 from states.user_states import UserStates
-from services.image_processor import ImageProcessor
-from utils.file_handlers import FileHandler
+from services.executor import try_on_executor, ExecutorBusyError
+from services.admission import admission, AdmissionRejected, USER_LIMIT, WAIT_TIMEOUT
+from services.job_queue import JobQueue, TRY_ON, TRY_ON_BATCH
+from services.catalog import catalog_key
+from services.quality import QualityTier
+from services.registry import registry
+from services.try_on_flow import (
+    RESULT_CAPTION, FAILURE_TEXT, RENDER_FAILED_TEXT, REJECTED_PHOTO_TEXT, render_with_refetch
+)
+from utils.blob_store import BlobStore
+from utils.validators import ImageRejectedError
 from config import config
 
-# Инициализация сервисов
-image_processor = ImageProcessor()
-file_handler = FileHandler()
+def _create_image_processor():
+    # OpenCV и конвейер загружаются при создании сервиса, а не при импорте хендлеров
+    from services.image_processor import ImageProcessor
+    return ImageProcessor(executor=try_on_executor)
+
+def _create_file_handler():
+    from utils.file_handlers import FileHandler
+    return FileHandler()
+
+def _create_render_cache():
+    from services.render_cache import RenderCache
+    return RenderCache()
+
+# Сервисы создаются при первом обращении или заранее в registry.warm_up()
+registry.register('image_processor', _create_image_processor)
+registry.register('file_handler', _create_file_handler)
+registry.register('photo_store', BlobStore)
+registry.register('render_cache', _create_render_cache)
+image_processor = registry.lazy('image_processor')
+file_handler = registry.lazy('file_handler')
+photo_store = registry.lazy('photo_store')
+render_cache = registry.lazy('render_cache')
+# В режиме очереди рендерят отдельные процессы worker.py
+job_queue = JobQueue() if config.queue.enabled else None
+# Сообщения альбомов одежды, которые еще собираются: media_group_id -> сообщения
+_albums: Dict[str, List[types.Message]] = {}
+
+async def _download_garment(bot, file_id: str) -> Optional[bytes]:
+    """
+    Скачивание одежды с проверкой размера и заголовка на лету: отклоненный файл
+    (ImageRejectedError) не докачивается и не доходит до декодирования
+    """
+    return await file_handler.download_telegram_file(bot, file_id, validate=True)
+
+async def _process_try_on(
+    bot,
+    human_photo_data: bytes,
+    clothes_photo_data: Optional[bytes],
+    file_id: str,
+    clothes_key: str,
+    on_preview: Optional[Callable[[bytes], Awaitable[bool]]] = None,
+    tier: Optional[QualityTier] = None
+) -> Optional[bytes]:
+    """Примерка с докачкой одежды, если ее успели вытеснить из кэша"""
+    async def render(clothes_data: List[Optional[bytes]], retry: bool) -> Optional[bytes]:
+        # Предпросмотр показываем только в первой попытке
+        return await image_processor.process_try_on(
+            human_photo_data, clothes_data[0], clothes_key, None if retry else on_preview, tier
+        )
+        
+    return await render_with_refetch(
+        render, [clothes_photo_data], lambda _: _download_garment(bot, file_id)
+    )
+
+async def _process_batch_try_on(
+    bot,
+    human_photo_data: bytes,
+    garments: List[list],
+    file_ids: List[str]
+) -> List[Optional[bytes]]:
+    """Пакетная примерка с докачкой вытесненной из кэша одежды"""
+    async def render(clothes_data: List[Optional[bytes]], retry: bool) -> List[Optional[bytes]]:
+        return await image_processor.process_batch_try_on(
+            human_photo_data, [(data, garment[1]) for data, garment in zip(clothes_data, garments)]
+        )
+        
+    results = await render_with_refetch(
+        render, [garment[0] for garment in garments], lambda i: _download_garment(bot, file_ids[i])
+    )
+    return results or [None] * len(garments)
+
+def _garment_ref(message: types.Message) -> Tuple[Optional[str], str]:
+    """file_id и ключ одежды: фото из сообщения или вещь каталога по номеру «#123»"""
+    if message.photo:
+        photo = message.photo[-1]
+        return photo.file_id, photo.file_unique_id
+    return None, catalog_key(message.text.strip().lstrip('#'))
+
+async def _is_current_try_on(state: FSMContext, try_on_id: int) -> bool:
+    """Пользователь еще ждет эту примерку: не начал заново и не прислал новые фото"""
+    if await state.get_state() != UserStates.waiting_for_clothes_photo.state:
+        return False
+    return (await state.get_data()).get('try_on_id') == try_on_id
+
+async def _send_cached_render(message: types.Message, render_key: str) -> bool:
+    """Отправка уже готового результата: по file_id без загрузки или из bytes"""
+    cached = render_cache.get(render_key)
+    if cached is None:
+        return False
+        
+    try:
+        sent = await message.answer_photo(
+            photo=cached.file_id or file_handler.as_input_file(cached.data),
+            caption=RESULT_CAPTION
+        )
+    except Exception as e:
+        # Например, file_id от другого бота: результат просто пересчитаем
+        logging.error(f"Error sending cached render: {e}")
+        return False
+        
+    if cached.file_id is None:
+        render_cache.set_file_id(render_key, sent.photo[-1].file_id)
+    return True
+
+def _remember_render(render_key: str, result_image_data: bytes, sent, tier: Optional[QualityTier] = None):
+    # Упрощенный результат под нагрузкой не должен отдаваться повторно вместо полного
+    if tier is not None and tier.degraded:
+        return
+    render_cache.put(render_key, result_image_data)
+    # edit_media возвращает сообщение, а для inline-сообщений — True
+    if isinstance(sent, types.Message) and sent.photo:
+        render_cache.set_file_id(render_key, sent.photo[-1].file_id)
+
+async def _load_human_photo(bot, user_data: dict) -> Optional[bytes]:
+    """Фото человека из хранилища; если его вытеснили — скачиваем заново"""
+    human_photo_data = photo_store.get(user_data.get('human_photo_blob'))
+    human_photo_id = user_data.get('human_photo_id')
+    if not human_photo_data and human_photo_id:
+        human_photo_data = await file_handler.download_telegram_file(bot, human_photo_id)
+    return human_photo_data
+
+async def _run_admitted(message: types.Message, status_message: types.Message, cost: float, run):
+    """
+    Обработка через контроль допуска с показом места в очереди.
+    Возвращает (допущен, результат); при отказе пользователь уже уведомлен.
+    """
+    waited = False
+    
+    async def report_position(position: int):
+        nonlocal waited
+        waited = True
+        await status_message.edit_text(
+            f"⏳ Сейчас много запросов, вы в очереди: {position}. Обработка начнется автоматически."
+        )
+        
+    try:
+        async with admission.admit(message.from_user.id, cost, on_position=report_position):
+            if waited:
+                await status_message.edit_text("⏳ Обрабатываю фото... Это займет несколько секунд.")
+            return True, await run()
+    except AdmissionRejected as e:
+        if e.reason == USER_LIMIT:
+            await message.answer("⏳ Предыдущая примерка еще обрабатывается. Дождитесь результата.")
+        elif e.reason == WAIT_TIMEOUT:
+            await message.answer("⚠️ Очередь не успела дойти. Отправьте фото одежды еще раз чуть позже.")
+        else:
+            await message.answer("⚠️ Сейчас слишком много запросов. Отправьте фото одежды еще раз через минуту.")
+    except ImageRejectedError as e:
+        # Одежду, вытесненную из кэша во время обработки, пришлось скачать заново
+        await message.answer(f"❌ {e}. Отправьте другое фото одежды.")
+    except ExecutorBusyError:
+        # Фото человека остается в состоянии, можно просто прислать одежду снова
+        await message.answer("⚠️ Сейчас слишком много запросов. Отправьте фото одежды еще раз через минуту.")
+    return False, None
 
 async def handle_human_photo(message: types.Message, state: FSMContext):
     """Обработчик фото человека"""
     try:
-        await message.answer("✅ Фото получено! Теперь отправьте фото одежды 👕")
-        
         # Сохраняем фото человека
         photo = message.photo[-1]
         file_id = photo.file_id
         
-        image_data = await file_handler.download_telegram_file(message.bot, file_id)
+        try:
+            image_data = await file_handler.download_telegram_file(
+                message.bot, file_id, validate=True
+            )
+        except ImageRejectedError as e:
+            await message.answer(REJECTED_PHOTO_TEXT.format(error=e))
+            return
+            
         if not image_data:
             await message.answer("❌ Не удалось загрузить фото. Попробуйте еще раз.")
             return
         
-        await state.update_data(human_photo=image_data)
+        # В состоянии FSM храним только ссылки: file_id и ключ в ограниченном хранилище
+        user_data = await state.get_data()
+        photo_store.delete(user_data.get('human_photo_blob'))
+        await state.update_data(
+            try_on_id=None,
+            human_photo_id=file_id,
+            human_photo_blob=None if job_queue else photo_store.put(image_data)
+        )
         await UserStates.waiting_for_clothes_photo.set()
+        # Просим одежду только после сохранения: иначе она может прийти, пока бот
+        # еще ждет фото человека, и будет принята за новое фото человека
+        await message.answer("✅ Фото получено! Теперь отправьте фото одежды 👕")
         
     except Exception as e:
         logging.error(f"Error handling human photo: {e}")
@@ -35,26 +213,57 @@ async def handle_human_photo(message: types.Message, state: FSMContext):
 
 async def handle_clothes_photo(message: types.Message, state: FSMContext):
     """Обработчик фото одежды"""
+    # Срок ответа отсчитывается от получения фото, включая скачивание и очередь допуска
+    received = time.monotonic()
     try:
-        await message.answer("⏳ Обрабатываю фото... Это займет несколько секунд.")
+        status_message = await message.answer("⏳ Обрабатываю фото... Это займет несколько секунд.")
         
-        # Получаем сохраненное фото человека
+        # Получаем сохраненное фото человека; если его вытеснили — скачиваем заново
         user_data = await state.get_data()
-        human_photo_data = user_data.get('human_photo')
+        human_photo_id = user_data.get('human_photo_id')
+        human_photo_blob = user_data.get('human_photo_blob')
+        
+        if job_queue and human_photo_id:
+            # Воркер сам скачает фото по file_id, проверит их и пришлет результат
+            file_id, clothes_key = _garment_ref(message)
+            job_queue.enqueue(TRY_ON, {
+                'chat_id': message.chat.id,
+                'human_file_id': human_photo_id,
+                'clothes_file_id': file_id,
+                'clothes_key': clothes_key,
+            })
+            await UserStates.waiting_for_human_photo.set()
+            return
+            
+        human_photo_data = await _load_human_photo(message.bot, user_data)
         
         if not human_photo_data:
             await message.answer("❌ Не найдено фото человека. Начните заново.")
             await UserStates.waiting_for_human_photo.set()
             return
         
-        # Сохраняем фото одежды
-        photo = message.photo[-1]
-        file_id = photo.file_id
+        # Сохраняем фото одежды; уже обработанную одежду и вещи каталога не скачиваем
+        file_id, clothes_key = _garment_ref(message)
         
-        clothes_photo_data = await file_handler.download_telegram_file(message.bot, file_id)
-        if not clothes_photo_data:
-            await message.answer("❌ Не удалось загрузить фото одежды. Попробуйте еще раз.")
+        # Эту пару уже примеряли: готовый результат без скачивания одежды и рендера
+        render_key = render_cache.render_key(human_photo_data, clothes_key)
+        if await _send_cached_render(message, render_key):
+            photo_store.delete(human_photo_blob)
+            await UserStates.waiting_for_human_photo.set()
             return
+            
+        clothes_photo_data = None
+        if not image_processor.has_garment(clothes_key):
+            try:
+                clothes_photo_data = await file_handler.download_telegram_file(
+                    message.bot, file_id, validate=True
+                )
+            except ImageRejectedError as e:
+                await message.answer(f"❌ {e}. Отправьте другое фото одежды.")
+                return
+            if not clothes_photo_data:
+                await message.answer("❌ Не удалось загрузить фото одежды. Попробуйте еще раз.")
+                return
         
         # Валидация изображений
         is_valid, error_message = image_processor.validate_images(
@@ -66,22 +275,181 @@ async def handle_clothes_photo(message: types.Message, state: FSMContext):
             await UserStates.waiting_for_human_photo.set()
             return
         
-        # Обработка изображений
-        result_image_data = await image_processor.process_try_on(
-            human_photo_data, clothes_photo_data
+        # Предпросмотр приходит первым, полный результат заменяет его в том же сообщении
+        try_on_id = message.message_id
+        preview_message = None
+        tier = None
+        
+        async def send_preview(preview: bytes) -> bool:
+            nonlocal preview_message
+            if not await _is_current_try_on(state, try_on_id):
+                return False
+            try:
+                preview_message = await message.answer_photo(
+                    photo=file_handler.as_input_file(preview, filename='preview'),
+                    caption="👀 Предварительный результат. Готовлю полное качество..."
+                )
+            except Exception as e:
+                logging.error(f"Error sending preview: {e}")
+            return True
+        
+        async def run() -> Optional[bytes]:
+            nonlocal tier
+            # Отмечаем примерку только после допуска: отклоненный запрос ее не вытесняет
+            await state.update_data(try_on_id=try_on_id)
+            # Уровень качества выбирается по очереди пула на момент допуска
+            tier = image_processor.tiers.choose(time.monotonic() - received)
+            return await _process_try_on(
+                message.bot, human_photo_data, clothes_photo_data, file_id, clothes_key,
+                on_preview=send_preview if config.image.preview else None,
+                tier=tier
+            )
+            
+        # Обработка изображений: допуск по бюджету пикселей, общему и на пользователя
+        admitted, result_image_data = await _run_admitted(
+            message, status_message,
+            admission.estimate_cost(human_photo_data, clothes_photo_data),
+            run
         )
+        if not admitted:
+            return
         
-        if result_image_data:
-            await message.answer_photo(
-                photo=result_image_data,
-                caption="🎉 Вот результат примерки!\n\nХотите попробовать еще? Отправьте новое фото человека."
+        # Пользователь начал заново, пока шла обработка: результат уже не нужен
+        if not await _is_current_try_on(state, try_on_id):
+            photo_store.delete(human_photo_blob)
+            return
+            
+        if result_image_data and preview_message is not None:
+            sent = await preview_message.edit_media(types.InputMediaPhoto(
+                media=file_handler.as_input_file(result_image_data),
+                caption=RESULT_CAPTION
+            ))
+            _remember_render(render_key, result_image_data, sent, tier)
+        elif result_image_data:
+            sent = await message.answer_photo(
+                photo=file_handler.as_input_file(result_image_data),
+                caption=RESULT_CAPTION
             )
+            _remember_render(render_key, result_image_data, sent, tier)
         else:
-            await message.answer("❌ Не удалось обработать фото. Попробуйте с другими изображениями.")
+            await message.answer(RENDER_FAILED_TEXT)
         
+        # Дальше ждем новое фото человека, старое больше не понадобится
+        photo_store.delete(human_photo_blob)
         await UserStates.waiting_for_human_photo.set()
         
     except Exception as e:
         logging.error(f"Error handling clothes photo: {e}")
-        await message.answer("❌ Произошла ошибка при обработке. Попробуйте еще раз.")
+        await message.answer(FAILURE_TEXT)
+        await UserStates.waiting_for_human_photo.set()
+
+async def handle_catalog_item(message: types.Message, state: FSMContext):
+    """Примерка вещи из каталога по номеру: «#123»"""
+    _, clothes_key = _garment_ref(message)
+    if not image_processor.has_garment(clothes_key):
+        await message.answer("❌ Такой вещи нет в каталоге. Проверьте номер или отправьте фото одежды 👕")
+        return
+    await handle_clothes_photo(message, state)
+
+async def handle_clothes_album(message: types.Message, state: FSMContext):
+    """Обработчик альбома одежды: все вещи примеряются на одно фото за один проход"""
+    album = _albums.get(message.media_group_id)
+    if album is not None:
+        album.append(message)
+        return
+        
+    # Фото альбома приходят отдельными сообщениями, первое ждет остальные
+    album = _albums[message.media_group_id] = [message]
+    await asyncio.sleep(config.image.album_wait)
+    del _albums[message.media_group_id]
+    
+    limit = config.image.max_batch_garments
+    if len(album) > limit:
+        await message.answer(
+            f"⚠️ За один раз можно примерить не больше {limit} вещей: примеряю {limit}, "
+            f"пропущено {len(album) - limit}. Остальные отправьте отдельным альбомом."
+        )
+        
+    try:
+        await _process_clothes_album(message, state, album[:limit])
+    except Exception as e:
+        logging.error(f"Error handling clothes album: {e}")
+        await message.answer(FAILURE_TEXT)
+        await UserStates.waiting_for_human_photo.set()
+
+async def _process_clothes_album(message: types.Message, state: FSMContext, album: List[types.Message]):
+    status_message = await message.answer(
+        f"⏳ Примеряю вещей: {len(album)}... Это займет несколько секунд."
+    )
+    
+    user_data = await state.get_data()
+    photos = [m.photo[-1] for m in album]
+    
+    if job_queue and user_data.get('human_photo_id'):
+        # Воркер обработает весь альбом одной задачей
+        job_queue.enqueue(TRY_ON_BATCH, {
+            'chat_id': message.chat.id,
+            'human_file_id': user_data['human_photo_id'],
+            'garments': [
+                {'file_id': photo.file_id, 'key': photo.file_unique_id} for photo in photos
+            ],
+        })
+        await UserStates.waiting_for_human_photo.set()
+        return
+        
+    human_photo_data = await _load_human_photo(message.bot, user_data)
+    if not human_photo_data:
+        await message.answer("❌ Не найдено фото человека. Начните заново.")
         await UserStates.waiting_for_human_photo.set()
+        return
+        
+    # Скачиваем одновременно только ту одежду, которой еще нет в кэше
+    async def download(photo) -> Optional[bytes]:
+        if image_processor.has_garment(photo.file_unique_id):
+            return None
+        data = await _download_garment(message.bot, photo.file_id)
+        if not data:
+            raise ValueError(f"Failed to download garment {photo.file_id}")
+        return data
+        
+    try:
+        clothes_data = await asyncio.gather(*(download(photo) for photo in photos))
+    except ImageRejectedError as e:
+        await message.answer(f"❌ {e}. Отправьте другие фото одежды.")
+        return
+        
+    for data in [None] + [d for d in clothes_data if d is not None]:
+        is_valid, error_message = image_processor.validate_images(human_photo_data, data)
+        if not is_valid:
+            await message.answer(f"❌ {error_message}")
+            await UserStates.waiting_for_human_photo.set()
+            return
+            
+    # Человек декодируется один раз на весь альбом и входит в стоимость один раз
+    garments = [[data, photo.file_unique_id] for data, photo in zip(clothes_data, photos)]
+    cost = admission.estimate_cost(human_photo_data) + sum(
+        admission.estimate_cost(data) for data in clothes_data if data
+    )
+    admitted, results = await _run_admitted(
+        message, status_message, cost,
+        lambda: _process_batch_try_on(
+            message.bot, human_photo_data, garments, [photo.file_id for photo in photos]
+        )
+    )
+    if not admitted:
+        return
+        
+    images = [result for result in results if result]
+    if len(images) > 1:
+        await message.answer_media_group(file_handler.as_media_group(images, caption=RESULT_CAPTION))
+    elif images:
+        await message.answer_photo(photo=file_handler.as_input_file(images[0]), caption=RESULT_CAPTION)
+        
+    if not images:
+        await message.answer(RENDER_FAILED_TEXT)
+    elif len(images) < len(results):
+        await message.answer(f"⚠️ Не удалось примерить вещей: {len(results) - len(images)}.")
+        
+    # Дальше ждем новое фото человека, старое больше не понадобится
+    photo_store.delete(user_data.get('human_photo_blob'))
+    await UserStates.waiting_for_human_photo.set()
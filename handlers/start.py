@@ -12,7 +12,7 @@ async def send_welcome(message: types.Message):
 
 📋 **Как использовать:**
 1. Отправьте свое фото (желательно в полный рост на нейтральном фоне)
-2. Отправьте фото одежды, которую хотите примерить
+2. Отправьте фото одежды, которую хотите примерить (можно альбомом до 10 вещей) или номер вещи из каталога, например #123
 3. Получите результат примерки!
 
 💡 **Советы для лучшего результата:**
@@ -23,8 +23,9 @@ async def send_welcome(message: types.Message):
 Начнем? Отправьте ваше фото 📸
     """
     
-    await message.answer(welcome_text)
+    # Состояние меняется до ответа, чтобы фото, отправленное сразу после него, не потерялось
     await UserStates.waiting_for_human_photo.set()
+    await message.answer(welcome_text)
 
 async def handle_wrong_input_human(message: types.Message):
     """Неправильный ввод в состоянии ожидания фото человека"""
@@ -0,0 +1,202 @@
+"""
+Пакетный рендер примерок без Telegram: все пары человек × одежда.
+
+    python render_offline.py people/ garments/ renders/
+    python render_offline.py people.txt garments.txt renders/ --workers 16
+
+Вход — каталог с изображениями или список путей (по одному в строке, '#' — комментарий).
+Одежда готовится один раз в архив каталога (renders/.garments, как в build_catalog.py),
+который все процессы пула отображают в память. Человек декодируется, и поза ищется
+один раз на все его пары; позы людей одного задания ищутся одним пакетом модели.
+Результаты пишутся по мере готовности в renders/<человек>/<одежда>.jpg. Повторный запуск пропускает готовые файлы, поэтому
+прерванный рендер продолжается с места остановки.
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+
+from build_catalog import build_archive, find_images
+from config import config
+from services.catalog import GarmentCatalog, catalog_key
+from services.garment_cache import GarmentCache
+from services.image_processor import ImageProcessor
+from utils.disk_lru import write_atomic
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = '.garments'
+# Задание — человек и часть его вещей; не больше этого числа заданий на процесс
+TASKS_PER_WORKER = 4
+
+_processor = None
+
+def _init_worker(archive_dir: str):
+    global _processor
+    # Параллелизм дают процессы; потоки OpenCV внутри каждого только мешают
+    cv2.setNumThreads(1)
+    _processor = ImageProcessor()
+    _processor.catalog = GarmentCatalog(archive_dir)
+    _processor.garment_cache = GarmentCache(max_bytes=0, disk_dir='')
+
+def read_inputs(source: str) -> List[str]:
+    """Изображения каталога или пути из списка (относительные — от места списка)"""
+    if os.path.isdir(source):
+        return find_images(source)
+        
+    base_dir = os.path.dirname(os.path.abspath(source))
+    with open(source, encoding='utf-8') as f:
+        lines = [line.strip() for line in f]
+    return [
+        os.path.join(base_dir, line) for line in lines
+        if line and not line.startswith('#')
+    ]
+
+def item_names(paths: List[str]) -> Dict[str, str]:
+    """Имя файла без расширения -> путь; имена должны быть уникальны"""
+    names: Dict[str, str] = {}
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name in names:
+            raise ValueError(f"Duplicate input name '{name}': {names[name]} and {path}")
+        names[name] = path
+    return names
+
+def output_path(out_dir: str, person: str, garment: str) -> str:
+    extension = '.webp' if config.image.output_format.upper() == 'WEBP' else '.jpg'
+    return os.path.join(out_dir, person, garment + extension)
+
+def _render_task(args: Tuple[List[Tuple[str, str, List[str]]], str]) -> List[Tuple[str, int, List[str]]]:
+    """
+    Пары нескольких людей, каждого с частью одежды; результаты пишутся сразу.
+    Позы людей задания ищутся одним пакетом.
+    """
+    entries, out_dir = args
+    people = []
+    rendered: List[set] = []
+    for person, person_path, garments in entries:
+        try:
+            with open(person_path, 'rb') as f:
+                human_image_data = f.read()
+            os.makedirs(os.path.join(out_dir, person), exist_ok=True)
+        except OSError as e:
+            logger.error(f"Error reading {person_path}: {e}")
+            human_image_data = b''
+        people.append((human_image_data, [(None, catalog_key(garment)) for garment in garments]))
+        rendered.append(set())
+        
+    try:
+        for p, i, result in _processor.iter_people_try_on(people):
+            if result:
+                person, _, garments = entries[p]
+                write_atomic(output_path(out_dir, person, garments[i]), result)
+                rendered[p].add(i)
+    except Exception as e:
+        logger.error(f"Error rendering {', '.join(entry[0] for entry in entries)}: {e}")
+        
+    return [
+        (person, len(done), [g for i, g in enumerate(garments) if i not in done])
+        for (person, _, garments), done in zip(entries, rendered)
+    ]
+
+def plan_tasks(
+    persons: Dict[str, str],
+    garments: List[str],
+    out_dir: str,
+    workers: int
+) -> List[Tuple[List[Tuple[str, str, List[str]]], str]]:
+    """
+    Задания по недостающим результатам. Вещи человека делятся на части, только когда
+    людей меньше, чем нужно для загрузки всех процессов; когда людей с избытком,
+    в задание попадают несколько человек, чтобы позы искались пакетом.
+    """
+    pending = {
+        person: [g for g in garments if not os.path.exists(output_path(out_dir, person, g))]
+        for person in persons
+    }
+    pending = {person: items for person, items in pending.items() if items}
+    if not pending:
+        return []
+        
+    target = workers * TASKS_PER_WORKER
+    parts = max(1, -(-target // len(pending)))
+    entries = []
+    for person, items in pending.items():
+        size = max(1, -(-len(items) // parts))
+        for start in range(0, len(items), size):
+            entries.append((person, persons[person], items[start:start + size]))
+            
+    group = max(1, min(config.pose.max_batch, len(entries) // target))
+    return [(entries[start:start + group], out_dir) for start in range(0, len(entries), group)]
+
+def prepare_garments(garments: Dict[str, str], out_dir: str, workers: int) -> str:
+    """Архив одежды; уже собранный при прошлом запуске используется повторно"""
+    archive_dir = os.path.join(out_dir, ARCHIVE_DIR)
+    existing = set(GarmentCatalog(archive_dir).item_ids()) if os.path.isdir(archive_dir) else set()
+    if not set(garments) <= existing:
+        logger.info(f"Preparing {len(garments)} garments")
+        build_archive(list(garments.values()), archive_dir, [config.image.working_max_side], workers)
+    return archive_dir
+
+def render_all(
+    person_source: str,
+    garment_source: str,
+    out_dir: str,
+    workers: int
+) -> int:
+    persons = item_names(read_inputs(person_source))
+    garments = item_names(read_inputs(garment_source))
+    os.makedirs(out_dir, exist_ok=True)
+    
+    archive_dir = prepare_garments(garments, out_dir, workers)
+    available = set(GarmentCatalog(archive_dir).item_ids())
+    skipped = sorted(set(garments) - available)
+    if skipped:
+        logger.warning(f"Garments failed to prepare and are skipped: {', '.join(skipped)}")
+        
+    tasks = plan_tasks(persons, [g for g in garments if g in available], out_dir, workers)
+    total = sum(len(entry[2]) for entries, _ in tasks for entry in entries)
+    logger.info(
+        f"{len(persons)} persons x {len(available)} garments, "
+        f"{total} renders pending in {len(tasks)} tasks"
+    )
+    
+    started = time.perf_counter()
+    done = failed = 0
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(archive_dir,)) as pool:
+        for results in pool.imap_unordered(_render_task, tasks):
+            for person, rendered, failures in results:
+                done += rendered
+                failed += len(failures)
+                for garment in failures:
+                    logger.error(f"Failed to render {person} x {garment}")
+            elapsed = time.perf_counter() - started
+            logger.info(
+                f"{done + failed}/{total} renders, {failed} failed, "
+                f"{done / elapsed if elapsed else 0:.1f} renders/s"
+            )
+            
+    return failed + len(skipped) * len(persons)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('persons', help='Каталог или список фото людей')
+    parser.add_argument('garments', help='Каталог или список фото одежды')
+    parser.add_argument('out_dir', help='Куда писать результаты')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+    
+    failed = render_all(args.persons, args.garments, args.out_dir, args.workers)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    sys.exit(main())
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+
+from config import config
+from utils.metrics import metrics
+from utils.validators import ImageValidator
+
+logger = logging.getLogger(__name__)
+
+# Причины отказа
+QUEUE_FULL = 'queue_full'
+USER_LIMIT = 'user_limit'
+WAIT_TIMEOUT = 'wait_timeout'
+
+class AdmissionRejected(Exception):
+    """Запрос не допущен к обработке"""
+    
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+@dataclass
+class _Ticket:
+    user_id: int
+    cost: float
+    granted: bool = False
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+
+class AdmissionController:
+    """
+    Допуск примерок к обработке по бюджету в мегапикселях, а не по числу запросов:
+    запрос стоит столько, сколько пикселей конвейер действительно декодирует. Ожидающие запросы стоят в очереди
+    FIFO ограниченной длины; запрос, не дождавшийся очереди за max_wait, снимается,
+    поэтому время ответа под перегрузкой остается ограниченным.
+    """
+    
+    def __init__(
+        self,
+        max_megapixels: Optional[float] = None,
+        max_queue: Optional[int] = None,
+        per_user: Optional[int] = None,
+        max_wait: Optional[float] = None
+    ):
+        self.max_megapixels = max_megapixels or config.admission.max_megapixels
+        self.max_queue = config.admission.max_queue if max_queue is None else max_queue
+        self.per_user = per_user or config.admission.per_user
+        self.max_wait = max_wait or config.admission.max_wait
+        self.active_megapixels = 0.0
+        self.active = 0
+        self._waiters: Deque[_Ticket] = deque()
+        self._per_user: Dict[int, int] = {}
+    
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+    
+    @staticmethod
+    def estimate_cost(human_image_data: bytes, clothes_image_data: Optional[bytes] = None) -> float:
+        """
+        Стоимость примерки в мегапикселях: размер, до которого конвейер декодирует
+        фото (человек — до output_max_side, одежда — до working_max_side), по заголовкам
+        файлов. Полное разрешение 12-мегапиксельного фото конвейер не декодирует.
+        """
+        from utils.image_buffer import _fit_size
+        pixels = 0
+        for data, max_side in (
+            (human_image_data, config.image.output_max_side),
+            (clothes_image_data, config.image.working_max_side),
+        ):
+            if not data:
+                continue
+            header = ImageValidator.probe_header(data)
+            if header is None:
+                # Без заголовка считаем по максимальному размеру декодирования
+                pixels += max_side ** 2
+            elif max(header.width, header.height) > max_side:
+                width, height = _fit_size((header.width, header.height), max_side)
+                pixels += width * height
+            else:
+                pixels += header.width * header.height
+        return pixels / 1_000_000
+    
+    @asynccontextmanager
+    async def admit(
+        self,
+        user_id: int,
+        cost: float,
+        on_position: Optional[Callable[[int], Awaitable[None]]] = None
+    ) -> AsyncIterator[None]:
+        """
+        Ожидание бюджета для запроса. on_position(n) вызывается при постановке
+        в очередь и при каждом изменении места в ней.
+        """
+        if self._per_user.get(user_id, 0) >= self.per_user:
+            raise AdmissionRejected(USER_LIMIT)
+        # Запрос дороже всего бюджета выполняется, когда остальные закончат
+        cost = min(cost, self.max_megapixels)
+        
+        ticket = _Ticket(user_id, cost)
+        if not self._waiters and self._fits(cost):
+            self._grant(ticket)
+        elif len(self._waiters) >= self.max_queue:
+            raise AdmissionRejected(QUEUE_FULL)
+        else:
+            self._waiters.append(ticket)
+            
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        try:
+            if not ticket.granted:
+                with metrics.stage('admission_wait', sync=False):
+                    await self._wait(ticket, on_position)
+            yield
+        finally:
+            self._per_user[user_id] -= 1
+            if not self._per_user[user_id]:
+                del self._per_user[user_id]
+            if ticket.granted:
+                self.active -= 1
+                self.active_megapixels -= ticket.cost
+            else:
+                self._waiters.remove(ticket)
+            self._dispatch()
+    
+    async def _wait(self, ticket: _Ticket, on_position: Optional[Callable[[int], Awaitable[None]]]):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        reported = None
+        while not ticket.granted:
+            position = self._waiters.index(ticket) + 1
+            if on_position is not None and position != reported:
+                reported = position
+                try:
+                    await on_position(position)
+                except Exception as e:
+                    logger.warning(f"Failed to report queue position: {e}")
+                continue
+                
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise AdmissionRejected(WAIT_TIMEOUT)
+            ticket.changed.clear()
+            try:
+                await asyncio.wait_for(ticket.changed.wait(), timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+    
+    def _fits(self, cost: float) -> bool:
+        return not self.active or self.active_megapixels + cost <= self.max_megapixels
+    
+    def _grant(self, ticket: _Ticket):
+        ticket.granted = True
+        self.active += 1
+        self.active_megapixels += ticket.cost
+        ticket.changed.set()
+    
+    def _dispatch(self):
+        """Допуск запросов из головы очереди; остальные узнают новое место"""
+        while self._waiters and self._fits(self._waiters[0].cost):
+            self._grant(self._waiters.popleft())
+        for ticket in self._waiters:
+            ticket.changed.set()
+
+admission = AdmissionController()
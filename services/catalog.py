@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import uuid
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional
+
+from config import config
+from .garment_cache import GarmentEntry
+
+# NumPy импортируется при работе с архивом: catalog_key нужен хендлерам без него
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CATALOG_VERSION = 1
+# Ключ одежды из каталога в кэше и очереди задач: catalog:<номер>
+CATALOG_PREFIX = 'catalog:'
+DATA_FILE = 'garments.bin'
+INDEX_FILE = 'index.json'
+# Выравнивание записей в архиве, байты
+ALIGNMENT = 64
+
+def catalog_key(item_id: str) -> str:
+    return CATALOG_PREFIX + item_id
+
+def catalog_build_id(path: Optional[str] = None) -> str:
+    """Идентификатор сборки архива, новый при каждой пересборке; пусто без каталога"""
+    path = config.catalog.path if path is None else path
+    if not path:
+        return ''
+    index_path = os.path.join(path, INDEX_FILE)
+    try:
+        with open(index_path, encoding='utf-8') as f:
+            build_id = json.load(f).get('build_id')
+        # Архивы, собранные до появления build_id, различаем по времени записи индекса
+        return build_id or str(os.stat(index_path).st_mtime_ns)
+    except (OSError, ValueError):
+        return ''
+
+def premultiply(rgb: np.ndarray, alpha: np.ndarray) -> np.ndarray:
+    """RGBA uint8 с цветом, умноженным на альфу (с округлением)"""
+    import numpy as np
+    a = alpha[..., np.newaxis].astype(np.uint16)
+    rgba = np.empty(rgb.shape[:2] + (4,), dtype=np.uint8)
+    rgba[..., :3] = (rgb.astype(np.uint16) * a + 127) // 255
+    rgba[..., 3] = alpha
+    return rgba
+
+class CatalogWriter:
+    """Запись архива каталога: данные одним файлом и индекс смещений"""
+    
+    def __init__(self, out_dir: str):
+        self.out_dir = out_dir
+        self.items: Dict[str, Dict] = {}
+        os.makedirs(out_dir, exist_ok=True)
+        self._data_tmp = os.path.join(out_dir, DATA_FILE + '.tmp')
+        self._file = open(self._data_tmp, 'wb')
+        self._offset = 0
+    
+    def add(self, item_id: str, name: str, scales: Iterable[np.ndarray]):
+        """scales — RGBA-массивы одной вещи в нескольких размерах"""
+        import numpy as np
+        entries = []
+        for rgba in sorted(scales, key=lambda a: a.shape[0] * a.shape[1]):
+            padding = -self._offset % ALIGNMENT
+            self._file.write(b'\0' * padding)
+            self._offset += padding
+            
+            data = np.ascontiguousarray(rgba, dtype=np.uint8)
+            self._file.write(data.tobytes())
+            entries.append({
+                'offset': self._offset,
+                'width': int(data.shape[1]),
+                'height': int(data.shape[0]),
+            })
+            self._offset += data.nbytes
+            
+        self.items[item_id] = {'name': name, 'scales': entries}
+    
+    def finish(self):
+        """Атомарная замена архива: сначала данные, затем индекс"""
+        self._file.close()
+        os.replace(self._data_tmp, os.path.join(self.out_dir, DATA_FILE))
+        
+        index_tmp = os.path.join(self.out_dir, INDEX_FILE + '.tmp')
+        with open(index_tmp, 'w', encoding='utf-8') as f:
+            json.dump(
+                {'version': CATALOG_VERSION, 'build_id': uuid.uuid4().hex, 'items': self.items},
+                f, ensure_ascii=False
+            )
+        os.replace(index_tmp, os.path.join(self.out_dir, INDEX_FILE))
+
+class GarmentCatalog:
+    """
+    Готовая одежда каталога из отображенного в память архива.
+    Массивы — срезы общего memmap без копирования, поэтому процессы пула
+    делят одни и те же страницы кэша ОС, а загрузка вещи почти ничего не стоит.
+    """
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = config.catalog.path if path is None else path
+        self._items: Optional[Dict[str, Dict]] = None
+        self._data: Optional[np.memmap] = None
+    
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+    
+    def _open(self) -> Dict[str, Dict]:
+        # Открываем лениво, при первом обращении к каталогу
+        if self._items is None:
+            try:
+                with open(os.path.join(self.path, INDEX_FILE), encoding='utf-8') as f:
+                    index = json.load(f)
+                if index.get('version') != CATALOG_VERSION:
+                    raise ValueError(f"Unsupported catalog version: {index.get('version')}")
+                import numpy as np
+                self._data = np.memmap(os.path.join(self.path, DATA_FILE), dtype=np.uint8, mode='r')
+                self._items = index['items']
+                logger.info(f"Garment catalog loaded: {len(self._items)} items")
+            except Exception as e:
+                logger.error(f"Error loading garment catalog: {e}")
+                self._items = {}
+        return self._items
+    
+    def __contains__(self, item_id: str) -> bool:
+        return self.enabled and item_id in self._open()
+    
+    def item_ids(self) -> List[str]:
+        return list(self._open()) if self.enabled else []
+    
+    def get(self, item_id: str, max_side: Optional[int] = None) -> Optional[GarmentEntry]:
+        """Наименьший из размеров вещи не меньше max_side (или наибольший)"""
+        if not self.enabled:
+            return None
+        item = self._open().get(item_id)
+        if item is None:
+            return None
+            
+        max_side = max_side or config.image.working_max_side
+        scales = item['scales']
+        scale = next((s for s in scales if max(s['width'], s['height']) >= max_side), scales[-1])
+        
+        size = scale['width'] * scale['height'] * 4
+        rgba = self._data[scale['offset']:scale['offset'] + size].reshape(
+            scale['height'], scale['width'], 4
+        )
+        return GarmentEntry(pixels=rgba[..., :3], mask=rgba[..., 3], premultiplied=True)
@@ -1,33 +1,52 @@
 import cv2
 import numpy as np
 from PIL import Image
-from typing import Optional, Dict, Tuple
+from typing import Optional, Dict, Tuple, Union
 from config import config
+from .segmentation import SimpleSegmentation
+from .compositing import AlphaCompositor, clip_region
+from utils.metrics import metrics
 
 class ClothesPlacer:
     def __init__(self):
-        self.segmentation_service = SegmentationService()
+        self.segmentation_service = SimpleSegmentation()
+        self.compositor = AlphaCompositor()
     
     def place_clothes_smart(
         self, 
-        human_image: Image.Image, 
-        clothes_image: Image.Image,
-        body_points: Optional[Dict] = None
+        human_image: Union[Image.Image, np.ndarray], 
+        clothes_image: Union[Image.Image, np.ndarray],
+        body_points: Optional[Dict] = None,
+        clothes_mask: Optional[np.ndarray] = None,
+        premultiplied: bool = False
     ) -> Image.Image:
-        """Умное размещение одежды на человеке"""
-        human_np = np.array(human_image)
-        clothes_np = np.array(clothes_image)
+        """
+        Умное размещение одежды на человеке.
+        premultiplied=True — цвет одежды уже умножен на маску (одежда из каталога).
+        """
+        # Для готовых RGB-массивов asarray не копирует данные
+        human_np = np.asarray(human_image)
+        clothes_np = np.asarray(clothes_image)
         
+        # Маска считается один раз в рабочем разрешении одежды
+        # и дальше масштабируется вместе с ней
+        if clothes_mask is None:
+            clothes_mask = self.segmentation_service.remove_clothes_background(clothes_np)
+            
         if body_points:
-            return self._place_with_body_points(human_np, clothes_np, body_points)
+            return self._place_with_body_points(
+                human_np, clothes_np, clothes_mask, body_points, premultiplied
+            )
         else:
-            return self._place_simple(human_np, clothes_np)
+            return self._place_simple(human_np, clothes_np, clothes_mask, premultiplied)
     
     def _place_with_body_points(
         self, 
         human_np: np.ndarray, 
         clothes_np: np.ndarray,
-        body_points: Dict
+        clothes_mask: np.ndarray,
+        body_points: Dict,
+        premultiplied: bool = False
     ) -> Image.Image:
         """Размещение с использованием ключевых точек тела"""
         try:
@@ -37,7 +56,7 @@ class ClothesPlacer:
             nose = body_points.get('nose')
             
             if not all([left_shoulder, right_shoulder]):
-                return self._place_simple(human_np, clothes_np)
+                return self._place_simple(human_np, clothes_np, clothes_mask, premultiplied)
             
             # Вычисляем параметры для размещения
             shoulder_width = abs(right_shoulder[0] - left_shoulder[0])
@@ -50,11 +69,6 @@ class ClothesPlacer:
             new_width = int(clothes_width * scale_factor)
             new_height = int(clothes_height * scale_factor)
             
-            clothes_resized = cv2.resize(clothes_np, (new_width, new_height))
-            
-            # Создаем маску для одежды
-            clothes_mask = self.segmentation_service.remove_clothes_background(clothes_resized)
-            
             # Позиционируем одежду
             start_x = left_shoulder[0] - int(new_width * 0.4)
             start_y = chest_level - int(new_height * 0.2)
@@ -63,18 +77,23 @@ class ClothesPlacer:
             start_x = max(0, min(start_x, human_np.shape[1] - new_width))
             start_y = max(0, min(start_y, human_np.shape[0] - new_height))
             
-            # Накладываем одежду
-            result = self._blend_images(
-                human_np, clothes_resized, clothes_mask, start_x, start_y
+            # Масштабируем и накладываем одежду
+            return self._place_resized(
+                human_np, clothes_np, clothes_mask,
+                new_width, new_height, start_x, start_y, premultiplied
             )
             
-            return Image.fromarray(result)
-            
         except Exception as e:
             print(f"Error in smart placement: {e}")
-            return self._place_simple(human_np, clothes_np)
+            return self._place_simple(human_np, clothes_np, clothes_mask, premultiplied)
     
-    def _place_simple(self, human_np: np.ndarray, clothes_np: np.ndarray) -> Image.Image:
+    def _place_simple(
+        self,
+        human_np: np.ndarray,
+        clothes_np: np.ndarray,
+        clothes_mask: np.ndarray,
+        premultiplied: bool = False
+    ) -> Image.Image:
         """Простое размещение одежды"""
         human_height, human_width = human_np.shape[:2]
         clothes_height, clothes_width = clothes_np.shape[:2]
@@ -88,47 +107,87 @@ class ClothesPlacer:
         new_width = int(clothes_width * scale_factor)
         new_height = int(clothes_height * scale_factor)
         
-        clothes_resized = cv2.resize(clothes_np, (new_width, new_height))
-        clothes_mask = self.segmentation_service.remove_clothes_background(clothes_resized)
-        
         # Позиционируем по центру
         start_x = (human_width - new_width) // 2
         start_y = human_height // 3
         
-        # Накладываем одежду
-        result = self._blend_images(
-            human_np, clothes_resized, clothes_mask, start_x, start_y
+        # Масштабируем и накладываем одежду
+        return self._place_resized(
+            human_np, clothes_np, clothes_mask,
+            new_width, new_height, start_x, start_y, premultiplied
         )
+    
+    def _place_resized(
+        self,
+        human_np: np.ndarray,
+        clothes_np: np.ndarray,
+        clothes_mask: np.ndarray,
+        new_width: int,
+        new_height: int,
+        x: int,
+        y: int,
+        premultiplied: bool = False
+    ) -> Image.Image:
+        """
+        Одежда, масштабированная до new_width x new_height, в точке (x, y).
+        Масштабируется только та часть одежды, которая непрозрачна и попадает в кадр,
+        поэтому работа пропорциональна площади вещи, а не фото.
+        """
+        clothes_height, clothes_width = clothes_np.shape[:2]
+        human_height, human_width = human_np.shape[:2]
+        if new_width <= 0 or new_height <= 0:
+            return Image.fromarray(human_np)
+        scale_x = new_width / clothes_width
+        scale_y = new_height / clothes_height
         
-        return Image.fromarray(result)
+        # Рамка маски, пересеченная с кадром, в координатах масштабированной одежды
+        bx, by, bw, bh = cv2.boundingRect(clothes_mask)
+        left = max(int(bx * scale_x), -x)
+        top = max(int(by * scale_y), -y)
+        right = min(int(np.ceil((bx + bw) * scale_x)), new_width, human_width - x)
+        bottom = min(int(np.ceil((by + bh) * scale_y)), new_height, human_height - y)
+        if right <= left or bottom <= top:
+            return Image.fromarray(human_np)
+            
+        # Соответствующая область исходной одежды
+        src_x1 = int(left / scale_x)
+        src_y1 = int(top / scale_y)
+        src_x2 = max(src_x1 + 1, min(clothes_width, int(np.ceil(right / scale_x))))
+        src_y2 = max(src_y1 + 1, min(clothes_height, int(np.ceil(bottom / scale_y))))
+        
+        size = (right - left, bottom - top)
+        with metrics.stage('resize', pixels=size[0] * size[1]):
+            clothes_resized = cv2.resize(clothes_np[src_y1:src_y2, src_x1:src_x2], size)
+            mask_resized = cv2.resize(clothes_mask[src_y1:src_y2, src_x1:src_x2], size)
+            
+        return self._blend_images(
+            human_np, clothes_resized, mask_resized, x + left, y + top, premultiplied
+        )
     
+    @metrics.timed('blend', size_arg=2)
     def _blend_images(
         self, 
         background: np.ndarray,
         foreground: np.ndarray,
         mask: np.ndarray,
         x: int, 
-        y: int
-    ) -> np.ndarray:
-        """Смешивание изображений с использованием маски"""
-        result = background.copy()
-        fg_height, fg_width = foreground.shape[:2]
-        bg_height, bg_width = background.shape[:2]
-        
-        # Обрезаем если выходит за границы
-        x1, y1 = max(0, x), max(0, y)
-        x2, y2 = min(bg_width, x + fg_width), min(bg_height, y + fg_height)
-        
-        fg_x1, fg_y1 = max(0, -x), max(0, -y)
-        fg_x2, fg_y2 = fg_x1 + (x2 - x1), fg_y1 + (y2 - y1)
-        
-        # Применяем маску и накладываем
-        for channel in range(3):
-            result[y1:y2, x1:x2, channel] = (
-                background[y1:y2, x1:x2, channel] * 
-                (1 - mask[fg_y1:fg_y2, fg_x1:fg_x2] / 255.0) +
-                foreground[fg_y1:fg_y2, fg_x1:fg_x2, channel] * 
-                (mask[fg_y1:fg_y2, fg_x1:fg_x2] / 255.0)
-            )
-        
-        return result
+        y: int,
+        premultiplied: bool = False
+    ) -> Image.Image:
+        """
+        Смешивание изображений с использованием маски. Фон не копируется:
+        смешивается копия области под одеждой, которая вставляется в результат.
+        """
+        # Единственная полнокадровая операция — сборка результата для кодирования
+        result = Image.fromarray(background)
+        region = clip_region(background.shape, foreground.shape, x, y)
+        if region is None:
+            return result
+            
+        (bg_rows, bg_cols), (fg_rows, fg_cols) = region
+        roi = background[bg_rows, bg_cols].copy()
+        self.compositor.blend(
+            roi, foreground[fg_rows, fg_cols], mask[fg_rows, fg_cols], 0, 0, premultiplied
+        )
+        result.paste(Image.fromarray(roi), (bg_cols.start, bg_rows.start))
+        return result
\ No newline at end of file
@@ -0,0 +1,116 @@
+import numpy as np
+from typing import NamedTuple, Optional, Sequence, Tuple
+
+class Layer(NamedTuple):
+    """Слой для пакетного наложения: изображение, альфа-маска и точка на фоне"""
+    foreground: np.ndarray
+    alpha: np.ndarray
+    x: int
+    y: int
+    premultiplied: bool = False
+
+def clip_region(
+    background_shape: Tuple[int, ...],
+    foreground_shape: Tuple[int, ...],
+    x: int,
+    y: int
+) -> Optional[Tuple[Tuple[slice, slice], Tuple[slice, slice]]]:
+    """Пересечение переднего плана с фоном: срезы для фона и для переднего плана"""
+    bg_height, bg_width = background_shape[:2]
+    fg_height, fg_width = foreground_shape[:2]
+    
+    # Обрезаем если выходит за границы
+    x1, y1 = max(0, x), max(0, y)
+    x2, y2 = min(bg_width, x + fg_width), min(bg_height, y + fg_height)
+    if x2 <= x1 or y2 <= y1:
+        return None
+        
+    fg_x1, fg_y1 = x1 - x, y1 - y
+    fg_x2, fg_y2 = fg_x1 + (x2 - x1), fg_y1 + (y2 - y1)
+    return (
+        (slice(y1, y2), slice(x1, x2)),
+        (slice(fg_y1, fg_y2), slice(fg_x1, fg_x2))
+    )
+
+class AlphaCompositor:
+    """Альфа-смешивание uint8 в фиксированной точке с записью на месте"""
+    
+    def __init__(self):
+        # Рабочие буферы uint16 переиспользуются между вызовами
+        self._scratch = np.empty(0, dtype=np.uint16)
+    
+    def _take_buffers(self, shape: Tuple[int, ...]) -> Tuple[np.ndarray, np.ndarray]:
+        size = int(np.prod(shape))
+        if self._scratch.size < 2 * size:
+            self._scratch = np.empty(2 * size, dtype=np.uint16)
+        return (
+            self._scratch[:size].reshape(shape),
+            self._scratch[size:2 * size].reshape(shape)
+        )
+    
+    def blend(
+        self,
+        background: np.ndarray,
+        foreground: np.ndarray,
+        alpha: np.ndarray,
+        x: int,
+        y: int,
+        premultiplied: bool = False
+    ) -> np.ndarray:
+        """
+        Наложение foreground с маской alpha (uint8, 0..255) на background в точке (x, y).
+        Меняется только область под передним планом, background должен быть записываемым.
+        premultiplied=True — цвет foreground уже умножен на альфу.
+        """
+        region = clip_region(background.shape, foreground.shape, x, y)
+        if region is None:
+            return background
+            
+        (bg_rows, bg_cols), (fg_rows, fg_cols) = region
+        self._blend_region(
+            background[bg_rows, bg_cols], foreground[fg_rows, fg_cols, :3],
+            alpha[fg_rows, fg_cols, np.newaxis], premultiplied
+        )
+        return background
+    
+    def blend_many(self, background: np.ndarray, layers: Sequence[Layer]) -> np.ndarray:
+        """
+        Наложение нескольких слоев по порядку на один фон за один вызов, каждый со своим
+        premultiplied. Слои пишутся в background на месте; рабочие буферы выделяются
+        один раз под самый большой слой. Результат совпадает с blend по очереди.
+        """
+        regions = []
+        largest = 0
+        for layer in layers:
+            region = clip_region(background.shape, layer.foreground.shape, layer.x, layer.y)
+            if region is None:
+                continue
+            (bg_rows, bg_cols), _ = region
+            largest = max(largest, (bg_rows.stop - bg_rows.start) * (bg_cols.stop - bg_cols.start))
+            regions.append((layer, region))
+        self._take_buffers((largest, background.shape[2]))
+        
+        for layer, ((bg_rows, bg_cols), (fg_rows, fg_cols)) in regions:
+            self._blend_region(
+                background[bg_rows, bg_cols], layer.foreground[fg_rows, fg_cols, :3],
+                layer.alpha[fg_rows, fg_cols, np.newaxis], layer.premultiplied
+            )
+        return background
+    
+    def _blend_region(self, dst: np.ndarray, src: np.ndarray, a: np.ndarray, premultiplied: bool):
+        """Смешивание на месте в dst — область фона под слоем"""
+        # dst = round((src * a + dst * (255 - a)) / 255) во всех каналах за один проход;
+        # сумма не превышает 255 * 255, поэтому помещается в uint16.
+        # Для premultiplied src * a заменяется на src * 255 (src <= a, оценка та же)
+        acc, tmp = self._take_buffers(dst.shape)
+        np.multiply(src, 255 if premultiplied else a, out=acc, dtype=np.uint16)
+        np.multiply(dst, np.subtract(255, a, dtype=np.uint8), out=tmp, dtype=np.uint16)
+        acc += tmp
+        
+        # Деление на 255 с округлением: (t + (t >> 8)) >> 8, где t = v + 128
+        acc += 128
+        np.right_shift(acc, 8, out=tmp)
+        acc += tmp
+        acc >>= 8
+        
+        np.copyto(dst, acc, casting='unsafe')
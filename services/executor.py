@@ -0,0 +1,255 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+import tracemalloc
+from typing import List, Optional, Tuple
+
+from config import config
+from utils.metrics import metrics, StageSample
+
+logger = logging.getLogger(__name__)
+
+# Процессор, созданный один раз внутри каждого рабочего процесса
+_worker_processor = None
+# Общие с основным процессом флаги отмены по слотам задач и слот текущей задачи
+_cancel_flags = None
+_current_slot: Optional[int] = None
+
+class ExecutorBusyError(Exception):
+    """Очередь задач примерки переполнена"""
+
+class JobCancelled(Exception):
+    """Задачу отменили, пока она выполнялась в рабочем процессе"""
+
+def _job_cancelled() -> bool:
+    return _current_slot is not None and bool(_cancel_flags[_current_slot])
+
+def _init_worker(cancel_flags=None):
+    """Инициализация рабочего процесса: сервисы создаются один раз"""
+    global _worker_processor, _cancel_flags
+    from services.image_processor import ImageProcessor
+    from services.garment_cache import GarmentCache
+    _cancel_flags = cancel_flags
+    _worker_processor = ImageProcessor()
+    _worker_processor.is_cancelled = _job_cancelled
+    # Лимит памяти кэша одежды делится между процессами пула; общий уровень — диск,
+    # через него одежда, подготовленная одним процессом, достается всем остальным
+    _worker_processor.garment_cache = GarmentCache(
+        max_bytes=config.cache.garment_cache_bytes // max(1, config.workers.workers)
+    )
+    
+    # Замеры этапов возвращаются в основной процесс вместе с результатом
+    metrics.start_forwarding()
+    if config.metrics.trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+def _warm_up() -> int:
+    """Задача для запуска процесса и прогрева синтетической примеркой"""
+    if config.workers.warm_up:
+        _worker_processor.warm_up()
+    return os.getpid()
+
+def _run_job(slot: Optional[int], func, *args):
+    """Задача в слоте slot: между этапами рендер проверяет его флаг отмены"""
+    global _current_slot
+    _current_slot = slot
+    try:
+        return func(*args)
+    except JobCancelled:
+        # Результат уже никто не ждет
+        return None, metrics.take_forwarded()
+    finally:
+        _current_slot = None
+
+def _run_try_on(
+    human_image_data: bytes,
+    clothes_image_data: Optional[bytes],
+    clothes_key: Optional[str],
+    profile: Optional[str],
+    tier: Optional[str] = None
+) -> Tuple[Optional[bytes], List[StageSample]]:
+    """Выполнение примерки в рабочем процессе"""
+    result = _worker_processor.render_try_on(
+        human_image_data, clothes_image_data, clothes_key, profile, tier
+    )
+    return result, metrics.take_forwarded()
+
+def _run_preview(
+    human_image_data: bytes,
+    clothes_image_data: Optional[bytes],
+    clothes_key: Optional[str]
+) -> Tuple[Optional[bytes], List[StageSample]]:
+    """Предпросмотр в рабочем процессе"""
+    result = _worker_processor.render_preview(human_image_data, clothes_image_data, clothes_key)
+    return result, metrics.take_forwarded()
+
+def _run_batch_try_on(
+    human_image_data: bytes,
+    garments: List[Tuple[Optional[bytes], Optional[str]]],
+    profile: Optional[str]
+) -> Tuple[List[Optional[bytes]], List[StageSample]]:
+    """Пакетная примерка в рабочем процессе"""
+    results = _worker_processor.render_batch_try_on(human_image_data, garments, profile)
+    return results, metrics.take_forwarded()
+
+class TryOnExecutor:
+    """Пул процессов для CPU-тяжелой части примерки"""
+    
+    def __init__(
+        self,
+        workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        job_timeout: Optional[float] = None
+    ):
+        self.workers = config.workers.workers if workers is None else workers
+        self.max_pending = config.workers.max_pending if max_pending is None else max_pending
+        self.job_timeout = config.workers.job_timeout if job_timeout is None else job_timeout
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        # Слот на каждую задачу в работе: флаг в общей памяти отменяет уже запущенную
+        self._cancel_flags = None
+        self._free_slots = list(range(self.max_pending))
+    
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+    
+    @property
+    def pending(self) -> int:
+        """Количество задач в работе и в очереди"""
+        return self._pending
+    
+    async def start(self):
+        """Запуск и прогрев пула процессов"""
+        if not self.enabled or self._pool is not None:
+            return
+            
+        context = multiprocessing.get_context(config.workers.start_method or None)
+        if self._cancel_flags is None:
+            self._cancel_flags = context.RawArray('b', self.max_pending)
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self._cancel_flags,)
+        )
+        
+        # Отправляем по задаче на каждый процесс, чтобы все они поднялись заранее
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*(
+            loop.run_in_executor(self._pool, _warm_up) for _ in range(self.workers)
+        ))
+        logger.info(f"Try-on pool started: {len(set(pids))} worker processes")
+    
+    async def run_try_on(
+        self,
+        human_image_data: bytes,
+        clothes_image_data: Optional[bytes],
+        clothes_key: Optional[str] = None,
+        profile: Optional[str] = None,
+        tier: Optional[str] = None
+    ) -> Optional[bytes]:
+        """Постановка примерки в пул с ограничением очереди и таймаутом"""
+        return await self._submit(
+            self.job_timeout, _run_try_on,
+            human_image_data, clothes_image_data, clothes_key, profile, tier
+        )
+    
+    async def run_preview(
+        self,
+        human_image_data: bytes,
+        clothes_image_data: Optional[bytes],
+        clothes_key: Optional[str] = None
+    ) -> Optional[bytes]:
+        return await self._submit(
+            self.job_timeout, _run_preview,
+            human_image_data, clothes_image_data, clothes_key
+        )
+    
+    async def run_batch_try_on(
+        self,
+        human_image_data: bytes,
+        garments: List[Tuple[Optional[bytes], Optional[str]]],
+        profile: Optional[str] = None
+    ) -> List[Optional[bytes]]:
+        """Пакет идет в один процесс целиком, чтобы человек декодировался один раз"""
+        return await self._submit(
+            self.job_timeout * max(1, len(garments)), _run_batch_try_on,
+            human_image_data, garments, profile
+        )
+    
+    async def _submit(self, timeout: float, func, *args):
+        if self._pending >= self.max_pending:
+            raise ExecutorBusyError(f"Too many pending try-on jobs: {self._pending}")
+            
+        self._pending += 1
+        try:
+            if self._pool is None:
+                await self.start()
+                
+            future, slot = self._submit_job(func, args)
+            try:
+                result, samples = await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+            except (asyncio.CancelledError, asyncio.TimeoutError):
+                # Задача из очереди пула снимается, а запущенная останавливается
+                # на ближайшей проверке флага между этапами рендера
+                if not future.cancel() and slot is not None:
+                    self._cancel_flags[slot] = 1
+                raise
+            metrics.merge(samples)
+            return result
+        except BrokenProcessPool:
+            # Следующая задача поднимет новый пул
+            logger.error("Try-on pool is broken, restarting it")
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+            raise
+        finally:
+            self._pending -= 1
+    
+    def _submit_job(self, func, args):
+        """
+        Отправка в пул со слотом флага отмены. Слот освобождается, когда процесс
+        закончил задачу, а не когда ее перестали ждать: иначе новая задача в том же
+        слоте сбросила бы флаг еще работающей. Без свободного слота задача идет без него.
+        """
+        slot = self._free_slots.pop() if self._free_slots else None
+        if slot is None:
+            return self._pool.submit(_run_job, None, func, *args), None
+            
+        self._cancel_flags[slot] = 0
+        try:
+            future = self._pool.submit(_run_job, slot, func, *args)
+        except BaseException:
+            self._free_slots.append(slot)
+            raise
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(partial(self._release_slot, loop, slot))
+        return future, slot
+    
+    def _release_slot(self, loop, slot: int, _future):
+        # Вызывается из потока пула; список слотов меняется только в цикле событий
+        try:
+            loop.call_soon_threadsafe(self._free_slots.append, slot)
+        except RuntimeError:
+            # Цикл уже закрыт при остановке
+            pass
+    
+    async def shutdown(self):
+        """Остановка пула с отменой ожидающих задач"""
+        if self._pool is None:
+            return
+            
+        pool, self._pool = self._pool, None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, partial(pool.shutdown, wait=True, cancel_futures=True)
+        )
+        logger.info("Try-on pool stopped")
+
+try_on_executor = TryOnExecutor()
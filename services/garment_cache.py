@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional
+
+from config import config
+from utils.disk_lru import DiskLRU
+
+# NumPy нужен только записям и диску; исключение и ключи импортируют хендлеры
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DISK_SUFFIX = '.npz'
+
+class GarmentCacheMiss(Exception):
+    """Одежды нет в кэше, а исходные bytes не переданы"""
+
+@dataclass
+class GarmentEntry:
+    """Подготовленная одежда: RGB в рабочем разрешении и ее альфа-маска"""
+    pixels: np.ndarray
+    mask: np.ndarray
+    # Цвет уже умножен на альфу (одежда из каталога)
+    premultiplied: bool = False
+    
+    @property
+    def nbytes(self) -> int:
+        return self.pixels.nbytes + self.mask.nbytes
+
+class GarmentCache:
+    """LRU-кэш подготовленной одежды с лимитом по памяти и необязательным диском"""
+    
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        disk_dir: Optional[str] = None,
+        disk_bytes: Optional[int] = None
+    ):
+        self.max_bytes = config.cache.garment_cache_bytes if max_bytes is None else max_bytes
+        self.disk_dir = config.cache.garment_cache_dir if disk_dir is None else disk_dir
+        self.disk_bytes = config.cache.garment_cache_disk_bytes if disk_bytes is None else disk_bytes
+        self._entries: 'OrderedDict[str, GarmentEntry]' = OrderedDict()
+        self._size = 0
+        # Каталог создается при первой записи: процессы, которые только читают
+        # или сразу заменяют кэш, диск не трогают
+        self._disk = DiskLRU(self.disk_dir, self.disk_bytes, (DISK_SUFFIX,)) if self.disk_dir else None
+    
+    @staticmethod
+    def content_key(image_data: bytes) -> str:
+        """Ключ по содержимому, когда file_unique_id недоступен"""
+        return 'sha256:' + hashlib.sha256(image_data).hexdigest()
+    
+    def get(self, key: str) -> Optional[GarmentEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            return entry
+            
+        entry = self._load_from_disk(key)
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+    
+    def put(self, key: str, entry: GarmentEntry):
+        # Закэшированные массивы раздаются всем запросам, запрещаем их изменение
+        entry.pixels.setflags(write=False)
+        entry.mask.setflags(write=False)
+        self._remember(key, entry)
+        self._save_to_disk(key, entry)
+    
+    def contains(self, key: str) -> bool:
+        """Есть ли одежда в памяти этого процесса или на общем диске"""
+        if key in self._entries:
+            return True
+        return self._disk is not None and self._disk.exists(self._disk_name(key))
+    
+    def _remember(self, key: str, entry: GarmentEntry):
+        if entry.nbytes > self.max_bytes:
+            return
+            
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= old.nbytes
+            
+        self._entries[key] = entry
+        self._size += entry.nbytes
+        
+        # Вытесняем самые давно использованные записи
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.nbytes
+    
+    def _disk_name(self, key: str) -> str:
+        # Рабочий размер входит в имя: после его смены старые файлы не подходят
+        # и просто вытесняются
+        disk_key = f'{key}@{config.image.working_max_side}'
+        return hashlib.sha256(disk_key.encode('utf-8')).hexdigest()[:32] + DISK_SUFFIX
+    
+    def _load_from_disk(self, key: str) -> Optional[GarmentEntry]:
+        if self._disk is None:
+            return None
+            
+        name = self._disk_name(key)
+        if not self._disk.exists(name):
+            return None
+            
+        import numpy as np
+        try:
+            with np.load(self._disk.path(name)) as data:
+                entry = GarmentEntry(pixels=data['pixels'], mask=data['mask'])
+            self._disk.touch(name)
+            entry.pixels.setflags(write=False)
+            entry.mask.setflags(write=False)
+            return entry
+        except Exception as e:
+            logger.error(f"Error loading garment from disk cache: {e}")
+            return None
+    
+    def _save_to_disk(self, key: str, entry: GarmentEntry):
+        if self._disk is None:
+            return
+            
+        name = self._disk_name(key)
+        if self._disk.exists(name):
+            return
+            
+        import numpy as np
+        try:
+            with self._disk.open_write(name) as f:
+                np.savez(f, pixels=entry.pixels, mask=entry.mask)
+        except Exception as e:
+            logger.error(f"Error saving garment to disk cache: {e}")
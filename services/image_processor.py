@@ -1,82 +1,488 @@
-from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
 from PIL import Image
+import asyncio
+import os
+import time
 import cv2
 import numpy as np
 import logging
 
 from .segmentation import SimpleSegmentation
 from .clothes_placer import ClothesPlacer
+from .executor import TryOnExecutor, ExecutorBusyError, JobCancelled
+from .garment_cache import GarmentCache, GarmentCacheMiss, GarmentEntry
+from .catalog import GarmentCatalog, CATALOG_PREFIX
+from .pose import PoseEstimator
+from .quality import QualityTier, TierScheduler, get_tier
 from utils.file_handlers import FileHandler
+from utils.image_buffer import DecodedImage
+from utils.validators import ImageValidator
+from utils.metrics import metrics
 from config import config
 
 logger = logging.getLogger(__name__)
 
+# Одежда для пакетной примерки: байты файла (None, если она уже в кэше) и ключ
+GarmentInput = Tuple[Optional[bytes], Optional[str]]
+
+def _retrieve_result(future: asyncio.Future):
+    # Исключение брошенной задачи забирается, чтобы asyncio не писал о нем в лог
+    if not future.cancelled():
+        future.exception()
+
 class ImageProcessor:
-    def __init__(self):
+    def __init__(self, executor: Optional[TryOnExecutor] = None):
         self.segmentation_service = SimpleSegmentation()  # Используем простую сегментацию
         self.clothes_placer = ClothesPlacer()
         self.file_handler = FileHandler()
+        self.garment_cache = GarmentCache()
+        self.catalog = GarmentCatalog()
+        self.pose = PoseEstimator()
+        self.executor = executor
+        self.tiers = TierScheduler(executor)
+        # Отменена ли текущая задача; в пуле процессов проверку подставляет рабочий процесс
+        self.is_cancelled: Callable[[], bool] = lambda: False
     
     async def process_try_on(
         self, 
         human_image_data: bytes, 
-        clothes_image_data: bytes
+        clothes_image_data: Optional[bytes],
+        clothes_key: Optional[str] = None,
+        on_preview: Optional[Callable[[bytes], Awaitable[bool]]] = None,
+        tier: Optional[QualityTier] = None
     ) -> Optional[bytes]:
-        """Основной метод обработки примерки"""
+        """
+        Основной метод обработки примерки.
+        С on_preview сначала отдается быстрый предпросмотр в уменьшенном размере.
+        Если on_preview вернул False (пользователь уже ушел дальше), полный
+        результат не ждем и возвращаем None.
+        tier — уровень качества от self.tiers.choose(); по умолчанию полный.
+        """
+        tier = tier or get_tier()
+        if not tier.preview:
+            on_preview = None
+        # Режим профилирования включает администратор, он действует на следующие запросы
+        profile = metrics.profile_mode
+        if self.executor is None or not self.executor.enabled:
+            if on_preview is not None:
+                preview = self.render_preview(human_image_data, clothes_image_data, clothes_key)
+                if preview and not await on_preview(preview):
+                    return None
+            ahead = self.tiers.ahead
+            started = time.perf_counter()
+            result = self.render_try_on(human_image_data, clothes_image_data, clothes_key, profile, tier.name)
+            if result is not None:
+                self.tiers.observe(tier, time.perf_counter() - started, ahead)
+            return result
+            
+        # CPU-работа уходит в пул процессов, event loop остается свободным.
+        # Полный рендер и предпросмотр идут параллельно на разных процессах
+        full = asyncio.ensure_future(self._run_tier(
+            tier, human_image_data, clothes_image_data, clothes_key, profile
+        ))
         try:
-            logger.info("Starting image processing...")
+            if on_preview is not None:
+                try:
+                    preview = await self._run_in_pool(
+                        'preview', self.executor.run_preview,
+                        human_image_data, clothes_image_data, clothes_key
+                    )
+                except (ExecutorBusyError, GarmentCacheMiss):
+                    preview = None
+                if preview and not full.done() and not await on_preview(preview):
+                    return None
+            return await full
+        finally:
+            if not full.done():
+                # Полный результат больше не нужен: отмена снимает задачу с пула
+                # или останавливает ее в рабочем процессе между этапами
+                full.cancel()
+            full.add_done_callback(_retrieve_result)
+    
+    async def _run_tier(
+        self,
+        tier: QualityTier,
+        human_image_data: bytes,
+        clothes_image_data: Optional[bytes],
+        clothes_key: Optional[str],
+        profile: Optional[str]
+    ) -> Optional[bytes]:
+        """Полный рендер в пуле с замером для выбора следующих уровней"""
+        ahead = self.executor.pending
+        started = time.perf_counter()
+        with metrics.stage(f'tier_{tier.name}', sync=False):
+            result = await self._run_in_pool(
+                'try_on', self.executor.run_try_on,
+                human_image_data, clothes_image_data, clothes_key, profile, tier.name
+            )
+        if result is not None:
+            self.tiers.observe(tier, time.perf_counter() - started, ahead)
+        return result
+    
+    async def _run_in_pool(self, stage: str, submit, *args):
+        try:
+            with metrics.stage(stage, sync=False):
+                return await submit(*args)
+        except (ExecutorBusyError, GarmentCacheMiss):
+            raise
+        except asyncio.TimeoutError:
+            logger.error(f"Job {stage} timed out")
+            return None
+        except Exception as e:
+            logger.error(f"Error in try-on executor ({stage}): {e}")
+            return None
+    
+    async def process_batch_try_on(
+        self,
+        human_image_data: bytes,
+        garments: List[GarmentInput]
+    ) -> List[Optional[bytes]]:
+        """Примерка нескольких вещей на одно фото человека"""
+        profile = metrics.profile_mode
+        if self.executor is None or not self.executor.enabled:
+            return self.render_batch_try_on(human_image_data, garments, profile)
             
-            # Конвертируем в PIL Image
-            human_image = self.file_handler.bytes_to_pil_image(human_image_data)
-            clothes_image = self.file_handler.bytes_to_pil_image(clothes_image_data)
+        results = await self._run_in_pool(
+            'try_on_batch', self.executor.run_batch_try_on, human_image_data, garments, profile
+        )
+        return results or [None] * len(garments)
+    
+    def warm_up(self):
+        """
+        Крошечная синтетическая примерка до первого пользователя: первые вызовы
+        OpenCV, кодеков и модели позы (пулы потоков, выделения памяти, загрузка модели)
+        не достаются реальному запросу. Кэши не заполняются, замеры не пишутся.
+        """
+        if self.executor is not None and self.executor.enabled:
+            # Рабочие процессы пула прогреваются сами при его запуске
+            return
             
-            if not human_image or not clothes_image:
-                logger.error("Failed to convert images to PIL format")
-                return None
+        started = time.perf_counter()
+        pixels = np.full((320, 240, 3), 200, dtype=np.uint8)
+        pixels[80:240, 60:180] = (40, 60, 120)
+        with metrics.muted():
+            image_data = self.file_handler.pil_to_bytes(Image.fromarray(pixels))
+            human_image = self.file_handler.decode_image(image_data)
+            garment = self._build_garment(image_data)
+            body_points = self._detect_pose(human_image)
+            self._compose(human_image, garment, body_points)
+            self._compose(
+                human_image, garment, body_points,
+                quality=config.image.preview_quality, fast=True
+            )
+        logger.info(f"Image processor warmed up in {time.perf_counter() - started:.2f}s")
+    
+    def has_garment(self, clothes_key: str) -> bool:
+        """Можно ли обработать одежду без скачивания файла"""
+        if clothes_key.startswith(CATALOG_PREFIX):
+            return clothes_key[len(CATALOG_PREFIX):] in self.catalog
+        return self.garment_cache.contains(clothes_key)
+    
+    def render_try_on(
+        self,
+        human_image_data: bytes,
+        clothes_image_data: Optional[bytes],
+        clothes_key: Optional[str] = None,
+        profile: Optional[str] = None,
+        tier: Optional[str] = None
+    ) -> Optional[bytes]:
+        """
+        Синхронная обработка примерки (в рабочем процессе или inline).
+        clothes_image_data можно не передавать, если одежда уже есть в кэше по clothes_key.
+        tier — имя уровня качества (см. services.quality).
+        """
+        with metrics.profile(profile), metrics.stage('render'):
+            return self._render_try_on(human_image_data, clothes_image_data, clothes_key, get_tier(tier))
+    
+    def _render_try_on(
+        self,
+        human_image_data: bytes,
+        clothes_image_data: Optional[bytes],
+        clothes_key: Optional[str],
+        tier: QualityTier
+    ) -> Optional[bytes]:
+        try:
+            logger.info(f"Starting image processing ({tier.name})...")
             
-            # Конвертируем в OpenCV для обработки
-            human_cv = self.file_handler.pil_to_cv2(human_image)
-            clothes_cv = self.file_handler.pil_to_cv2(clothes_image)
+            # Декодируем человека один раз сразу в размере результата
+            human_image = self.file_handler.decode_image(
+                human_image_data, max_side=tier.output_max_side
+            )
+            garment = self._prepare_garment(clothes_image_data, clothes_key, tier=tier)
             
-            # Детектируем позу для умного позиционирования
-            body_points = self.segmentation_service.detect_pose_landmarks(human_cv)
-            logger.info(f"Detected body points: {body_points is not None}")
+            if not human_image or not garment:
+                logger.error("Failed to decode images")
+                return None
             
-            # Выполняем примерку
-            result_image = self.clothes_placer.place_clothes_smart(
-                human_image, clothes_image, body_points
+            self._check_cancelled()
+            body_points = self._detect_pose(human_image, human_image_data)
+            self._check_cancelled()
+            width, height = (
+                ImageValidator.get_image_dimensions(human_image_data)
+                or (human_image.width, human_image.height)
+            )
+            result_bytes = self._compose(
+                human_image, garment, body_points,
+                quality=tier.encode_quality(width, height), fast=tier.fast_encode
             )
-            
-            # Конвертируем обратно в bytes
-            result_bytes = self.file_handler.pil_to_bytes(result_image)
             logger.info("Image processing completed successfully")
             
             return result_bytes
             
+        except (GarmentCacheMiss, JobCancelled):
+            raise
         except Exception as e:
             logger.error(f"Error in image processing: {e}")
             return None
     
+    def render_preview(
+        self,
+        human_image_data: bytes,
+        clothes_image_data: Optional[bytes],
+        clothes_key: Optional[str] = None
+    ) -> Optional[bytes]:
+        """Быстрый предпросмотр: человек в размере preview_max_side, сжатие с низким качеством"""
+        with metrics.stage('render_preview'):
+            try:
+                human_image = self.file_handler.decode_image(
+                    human_image_data, max_side=config.image.preview_max_side
+                )
+                garment = self._prepare_garment(
+                    clothes_image_data, clothes_key, max_side=config.image.preview_max_side
+                )
+                if not human_image or not garment:
+                    return None
+                    
+                body_points = self._detect_pose(human_image, human_image_data)
+                return self._compose(
+                    human_image, garment, body_points,
+                    quality=config.image.preview_quality, fast=True
+                )
+            except GarmentCacheMiss:
+                raise
+            except Exception as e:
+                logger.error(f"Error rendering preview: {e}")
+                return None
+    
+    def render_batch_try_on(
+        self,
+        human_image_data: bytes,
+        garments: List[GarmentInput],
+        profile: Optional[str] = None
+    ) -> List[Optional[bytes]]:
+        """
+        Синхронная пакетная примерка: человек декодируется и поза ищется один раз,
+        маски одежды считаются параллельно, на каждую вещь остаются размещение и смешивание.
+        """
+        with metrics.profile(profile), metrics.stage('render_batch'):
+            return self._render_batch_try_on(human_image_data, garments)
+    
+    def _render_batch_try_on(
+        self,
+        human_image_data: bytes,
+        garments: List[GarmentInput]
+    ) -> List[Optional[bytes]]:
+        results: List[Optional[bytes]] = [None] * len(garments)
+        try:
+            logger.info(f"Starting batch processing of {len(garments)} garments...")
+            
+            for i, result in self.iter_batch_try_on(human_image_data, garments):
+                results[i] = result
+                
+            logger.info("Batch processing completed")
+            return results
+            
+        except (GarmentCacheMiss, JobCancelled):
+            raise
+        except Exception as e:
+            logger.error(f"Error in batch image processing: {e}")
+            return results
+    
+    def iter_batch_try_on(
+        self,
+        human_image_data: bytes,
+        garments: List[GarmentInput]
+    ) -> Iterator[Tuple[int, Optional[bytes]]]:
+        """
+        Пакетная примерка с выдачей результатов по мере готовности: (номер вещи, bytes
+        или None). Результаты не копятся в памяти, их можно сразу записывать.
+        """
+        for _, i, result in self.iter_people_try_on([(human_image_data, garments)]):
+            yield i, result
+    
+    def iter_people_try_on(
+        self,
+        people: List[Tuple[bytes, List[GarmentInput]]]
+    ) -> Iterator[Tuple[int, int, Optional[bytes]]]:
+        """
+        Примерка нескольких людей, каждого со своими вещами: (номер человека, номер вещи,
+        bytes или None). Позы всех людей ищутся одним пакетом модели.
+        """
+        # Декодируем каждого человека один раз сразу в размере результата
+        human_images = []
+        for person, (human_image_data, _) in enumerate(people):
+            human_image = self.file_handler.decode_image(
+                human_image_data, max_side=config.image.output_max_side
+            )
+            if not human_image:
+                logger.error(f"Failed to decode human image {person}")
+            human_images.append(human_image)
+            
+        decoded = [person for person, human_image in enumerate(human_images) if human_image]
+        poses = self.pose.detect_many([(human_images[p], people[p][0]) for p in decoded])
+        logger.info(f"Detected body points: {sum(p is not None for p in poses)}/{len(decoded)}")
+        
+        for person, body_points in zip(decoded, poses):
+            entries = self._prepare_garments(people[person][1])
+            for i, garment in enumerate(entries):
+                self._check_cancelled()
+                result = None
+                if garment is not None:
+                    try:
+                        result = self._compose(human_images[person], garment, body_points)
+                    except Exception as e:
+                        logger.error(f"Error placing garment {i}: {e}")
+                yield person, i, result
+            # Результат уже выдан, декодированный человек больше не нужен
+            human_images[person] = None
+    
+    def _check_cancelled(self):
+        if self.is_cancelled():
+            raise JobCancelled()
+    
+    def _detect_pose(self, human_image: DecodedImage, human_image_data: Optional[bytes] = None) -> Optional[Dict]:
+        """
+        Точки в координатах human_image. Бэкенд сам уменьшает вход, а по bytes фото
+        повторное селфи берется из кэша без инференса.
+        """
+        body_points = self.pose.detect(human_image, human_image_data)
+        logger.info(f"Detected body points: {body_points is not None}")
+        return body_points
+    
+    def _compose(
+        self,
+        human_image: DecodedImage,
+        garment: GarmentEntry,
+        body_points: Optional[Dict],
+        quality: Optional[int] = None,
+        fast: bool = False
+    ) -> bytes:
+        """Размещение одной вещи и кодирование результата"""
+        # Выполняем примерку
+        result_image = self.clothes_placer.place_clothes_smart(
+            human_image.rgb, garment.pixels, body_points,
+            clothes_mask=garment.mask, premultiplied=garment.premultiplied
+        )
+        
+        # Конвертируем обратно в bytes
+        return self.file_handler.pil_to_bytes(result_image, quality=quality, fast=fast)
+    
+    def _prepare_garment(
+        self,
+        clothes_image_data: Optional[bytes],
+        clothes_key: Optional[str],
+        max_side: Optional[int] = None,
+        tier: Optional[QualityTier] = None
+    ) -> Optional[GarmentEntry]:
+        """Одежда в рабочем разрешении вместе с маской: из каталога, кэша или с нуля"""
+        return self._prepare_garments([(clothes_image_data, clothes_key)], max_side, tier)[0]
+    
+    def _prepare_garments(
+        self,
+        garments: List[GarmentInput],
+        max_side: Optional[int] = None,
+        tier: Optional[QualityTier] = None
+    ) -> List[Optional[GarmentEntry]]:
+        """
+        Подготовка нескольких вещей; промахи кэша обрабатываются параллельно в потоках.
+        max_side выбирает размер только для вещей каталога, кэш хранит рабочий размер.
+        На упрощенном уровне промахи строятся в его рабочем размере и в кэш не попадают.
+        """
+        degraded = tier is not None and tier.degraded
+        if degraded and max_side is None:
+            max_side = tier.working_max_side
+        entries: List[Optional[GarmentEntry]] = []
+        missing = []
+        for i, (clothes_image_data, clothes_key) in enumerate(garments):
+            if clothes_key and clothes_key.startswith(CATALOG_PREFIX):
+                # Каталог уже хранит готовые маски, сегментация не нужна
+                entries.append(self.catalog.get(clothes_key[len(CATALOG_PREFIX):], max_side))
+                continue
+                
+            garment = self.garment_cache.get(clothes_key) if clothes_key else None
+            if garment is not None:
+                logger.info("Garment cache hit")
+            elif clothes_image_data is None:
+                raise GarmentCacheMiss(clothes_key)
+            else:
+                missing.append(i)
+            entries.append(garment)
+            
+        # OpenCV и NumPy отпускают GIL, поэтому маски считаются одновременно
+        datas = [garments[i][0] for i in missing]
+        build = self._build_garment
+        if degraded:
+            build = partial(build, max_side=max_side, refine=tier.refine_mask)
+        if len(datas) > 1:
+            with ThreadPoolExecutor(max_workers=min(len(datas), os.cpu_count() or 1)) as pool:
+                built = list(pool.map(build, datas))
+        else:
+            built = [build(data) for data in datas]
+            
+        # Кэш не потокобезопасен, заполняем его в текущем потоке
+        for i, garment in zip(missing, built):
+            entries[i] = garment
+            if garment is not None and not degraded:
+                clothes_image_data, clothes_key = garments[i]
+                self.garment_cache.put(
+                    clothes_key or GarmentCache.content_key(clothes_image_data), garment
+                )
+        return entries
+    
+    def _build_garment(
+        self,
+        clothes_image_data: bytes,
+        max_side: Optional[int] = None,
+        refine: bool = True
+    ) -> Optional[GarmentEntry]:
+        clothes_image = self.file_handler.decode_image(
+            clothes_image_data, max_side=max_side or config.image.working_max_side
+        )
+        if not clothes_image:
+            return None
+            
+        return GarmentEntry(
+            pixels=clothes_image.rgb,
+            mask=self.segmentation_service.remove_clothes_background(clothes_image.rgb, refine=refine)
+        )
+    
     def validate_images(
         self, 
         human_image_data: bytes, 
-        clothes_image_data: bytes
+        clothes_image_data: Optional[bytes]
     ) -> Tuple[bool, str]:
-        """Валидация входных изображений"""
-        from utils.validators import ImageValidator
+        """Валидация входных изображений (одежда из кэша уже проверена)"""
+        from utils.validators import ImageRejectedError
         
         # Проверка размера файлов
         if not self.file_handler.validate_image_size(human_image_data):
             return False, "Фото человека слишком большое"
         
-        if not self.file_handler.validate_image_size(clothes_image_data):
+        if clothes_image_data is not None and not self.file_handler.validate_image_size(clothes_image_data):
             return False, "Фото одежды слишком большое"
         
-        # Проверка форматов
-        if not ImageValidator.validate_image_format(human_image_data):
-            return False, "Неверный формат фото человека"
+        # Проверка формата и размеров только по заголовкам, без декодирования
+        try:
+            ImageValidator.check_header(human_image_data)
+        except ImageRejectedError as e:
+            return False, f"Фото человека: {str(e).lower()}"
         
-        if not ImageValidator.validate_image_format(clothes_image_data):
-            return False, "Неверный формат фото одежды"
+        if clothes_image_data is not None:
+            try:
+                ImageValidator.check_header(clothes_image_data)
+            except ImageRejectedError as e:
+                return False, f"Фото одежды: {str(e).lower()}"
         
         return True, "OK"
\ No newline at end of file
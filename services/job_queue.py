@@ -0,0 +1,188 @@
+import json
+import logging
+import os
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_until REAL,
+    worker TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, available_at);
+"""
+
+# Статусы задачи
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Типы задач
+TRY_ON = 'try_on'
+TRY_ON_BATCH = 'try_on_batch'
+
+@dataclass
+class Job:
+    id: int
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int
+
+class JobQueue:
+    """
+    Надежная очередь задач на SQLite: переживает перезапуски и позволяет
+    нескольким процессам-воркерам разбирать задачи из одного файла.
+    Взятая задача арендуется на visibility_timeout; если воркер упал,
+    она снова становится доступной.
+    """
+    
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        visibility_timeout: Optional[float] = None,
+        max_attempts: Optional[int] = None
+    ):
+        self.path = path or config.queue.path
+        self.visibility_timeout = visibility_timeout or config.queue.visibility_timeout
+        self.max_attempts = max_attempts or config.queue.max_attempts
+        
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        # WAL не работает на сетевых дисках, для них задается JOB_QUEUE_WAL=0
+        if config.queue.wal:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+    
+    def close(self):
+        self._conn.close()
+    
+    def enqueue(self, kind: str, payload: Dict[str, Any], delay: float = 0) -> int:
+        now = time.time()
+        cursor = self._conn.execute(
+            'INSERT INTO jobs (kind, payload, status, available_at, created_at, updated_at) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (kind, json.dumps(payload), QUEUED, now + delay, now, now)
+        )
+        return cursor.lastrowid
+    
+    def claim(self, worker: str) -> Optional[Job]:
+        """Взять следующую готовую задачу или задачу с истекшей арендой"""
+        now = time.time()
+        # BEGIN IMMEDIATE сразу берет блокировку записи: двое не возьмут одну задачу
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Задачи, на которых воркеры падали слишком часто, не выдаются (см. expire)
+            row = self._conn.execute(
+                'SELECT id, kind, payload, attempts FROM jobs '
+                'WHERE (status = ? AND available_at <= ?) '
+                'OR (status = ? AND lease_until < ? AND attempts < ?) '
+                'ORDER BY id LIMIT 1',
+                (QUEUED, now, RUNNING, now, self.max_attempts)
+            ).fetchone()
+            if row is None:
+                self._conn.execute('COMMIT')
+                return None
+                
+            self._conn.execute(
+                'UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, '
+                'worker = ?, updated_at = ? WHERE id = ?',
+                (RUNNING, now + self.visibility_timeout, worker, now, row['id'])
+            )
+            self._conn.execute('COMMIT')
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+            
+        return Job(
+            id=row['id'],
+            kind=row['kind'],
+            payload=json.loads(row['payload']),
+            attempts=row['attempts'] + 1
+        )
+    
+    def expire(self) -> List[Job]:
+        """
+        Задачи с истекшей арендой, исчерпавшие попытки (воркер падал на каждой),
+        переводятся в FAILED. Возвращаются ровно одному вызвавшему, чтобы он
+        сообщил об ошибке пользователю.
+        """
+        now = time.time()
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = self._conn.execute(
+                'SELECT id, kind, payload, attempts FROM jobs '
+                'WHERE status = ? AND lease_until < ? AND attempts >= ?',
+                (RUNNING, now, self.max_attempts)
+            ).fetchall()
+            self._conn.executemany(
+                'UPDATE jobs SET status = ?, lease_until = NULL, error = ?, updated_at = ? WHERE id = ?',
+                [(FAILED, 'lease expired', now, row['id']) for row in rows]
+            )
+            self._conn.execute('COMMIT')
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+            
+        return [
+            Job(id=row['id'], kind=row['kind'], payload=json.loads(row['payload']), attempts=row['attempts'])
+            for row in rows
+        ]
+    
+    def extend(self, job_id: int):
+        """Продление аренды для долгой задачи"""
+        now = time.time()
+        self._conn.execute(
+            'UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND status = ?',
+            (now + self.visibility_timeout, now, job_id, RUNNING)
+        )
+    
+    def complete(self, job_id: int):
+        self._conn.execute(
+            'UPDATE jobs SET status = ?, lease_until = NULL, updated_at = ? WHERE id = ?',
+            (DONE, time.time(), job_id)
+        )
+    
+    def fail(self, job: Job, error: str) -> str:
+        """Повтор с экспоненциальной задержкой или окончательная ошибка"""
+        now = time.time()
+        if job.attempts >= self.max_attempts:
+            status, available_at = FAILED, now
+        else:
+            status, available_at = QUEUED, now + 2 ** job.attempts
+            
+        self._conn.execute(
+            'UPDATE jobs SET status = ?, available_at = ?, lease_until = NULL, error = ?, '
+            'updated_at = ? WHERE id = ?',
+            (status, available_at, error, now, job.id)
+        )
+        return status
+    
+    def purge(self, older_than: float):
+        """Удаление завершенных задач старше older_than секунд"""
+        self._conn.execute(
+            'DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?',
+            (DONE, FAILED, time.time() - older_than)
+        )
+    
+    def counts(self) -> Dict[str, int]:
+        rows = self._conn.execute('SELECT status, COUNT(*) AS n FROM jobs GROUP BY status')
+        return {row['status']: row['n'] for row in rows}
@@ -0,0 +1,222 @@
+import hashlib
+import logging
+from abc import ABC, abstractmethod
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from config import config
+from utils.image_buffer import DecodedImage
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Ключевые точки в долях ширины и высоты кадра; так их можно перевести
+# в любой размер того же фото (предпросмотр, результат)
+Landmarks = Dict[str, Tuple[float, float]]
+
+def to_pixels(landmarks: Landmarks, width: int, height: int) -> Dict[str, Tuple[int, int]]:
+    return {name: (int(x * width), int(y * height)) for name, (x, y) in landmarks.items()}
+
+class PoseBackend(ABC):
+    """Источник ключевых точек тела для пакета изображений BGR"""
+    # Результат стоит кэшировать по хэшу фото
+    cacheable = True
+    # Бэкенду нужна уменьшенная копия фото в BGR; без пикселей вместо нее передается None
+    needs_pixels = True
+    
+    @abstractmethod
+    def detect_batch(self, images: List[Optional[np.ndarray]]) -> List[Optional[Landmarks]]:
+        """Точки для каждого изображения пакета в том же порядке, None — тело не найдено"""
+
+class HeuristicPoseBackend(PoseBackend):
+    """Упрощенное определение ключевых точек по геометрии кадра"""
+    cacheable = False
+    # Эвристике пиксели не нужны, для нее не готовим уменьшенную копию
+    needs_pixels = False
+    
+    POINTS: Landmarks = {
+        'left_shoulder': (1 / 4, 1 / 3),
+        'right_shoulder': (3 / 4, 1 / 3),
+        'left_hip': (1 / 3, 2 / 3),
+        'right_hip': (2 / 3, 2 / 3),
+        'nose': (1 / 2, 1 / 4),
+    }
+    
+    def detect_batch(self, images: List[Optional[np.ndarray]]) -> List[Optional[Landmarks]]:
+        return [dict(self.POINTS) for _ in images]
+
+class DnnPoseBackend(PoseBackend):
+    """
+    Модель позы в формате OpenCV DNN (например, OpenPose COCO: Caffe или ONNX) на CPU.
+    Выход — тепловые карты N x C x H x W, точка — максимум карты своего канала.
+    Левая и правая стороны — в координатах кадра, как у эвристики.
+    """
+    # Номера каналов COCO: правое плечо человека — слева в кадре
+    CHANNELS = {
+        'nose': 0,
+        'left_shoulder': 2,
+        'right_shoulder': 5,
+        'left_hip': 8,
+        'right_hip': 11,
+    }
+    
+    def __init__(self, model_path: str, input_size: int, min_confidence: float):
+        self.model_path = model_path
+        self.input_size = input_size
+        self.min_confidence = min_confidence
+        self._net = None
+    
+    def _load(self):
+        # Модель загружается один раз на процесс, при первой примерке
+        if self._net is None:
+            with metrics.stage('pose_model_load'):
+                self._net = cv2.dnn.readNet(self.model_path)
+            logger.info(f"Pose model loaded: {self.model_path}")
+        return self._net
+    
+    def detect_batch(self, images: List[Optional[np.ndarray]]) -> List[Optional[Landmarks]]:
+        net = self._load()
+        blob = cv2.dnn.blobFromImages(
+            [np.ascontiguousarray(image) for image in images],
+            1 / 255, (self.input_size, self.input_size), (0, 0, 0), swapRB=False, crop=False
+        )
+        net.setInput(blob)
+        return [self._parse(heatmaps) for heatmaps in net.forward()]
+    
+    def _parse(self, heatmaps: np.ndarray) -> Optional[Landmarks]:
+        height, width = heatmaps.shape[1:]
+        landmarks = {}
+        for name, channel in self.CHANNELS.items():
+            if channel >= len(heatmaps):
+                continue
+            _, confidence, _, (x, y) = cv2.minMaxLoc(heatmaps[channel])
+            if confidence >= self.min_confidence:
+                landmarks[name] = ((x + 0.5) / width, (y + 0.5) / height)
+        return landmarks or None
+
+def create_backend(name: Optional[str] = None) -> PoseBackend:
+    name = (name or config.pose.backend).lower()
+    if name == 'heuristic':
+        return HeuristicPoseBackend()
+    if name == 'dnn':
+        if not config.pose.model_path:
+            raise ValueError("POSE_MODEL_PATH is required for the dnn pose backend")
+        return DnnPoseBackend(config.pose.model_path, config.pose.input_size, config.pose.min_confidence)
+    raise ValueError(f"Unknown pose backend: {name}")
+
+class _PoseRequest:
+    def __init__(self, pixels: Optional[np.ndarray]):
+        self.pixels = pixels
+        self.result: Optional[Landmarks] = None
+        self.done = False
+
+class PoseEstimator:
+    """
+    Ключевые точки через выбранный бэкенд с кэшем по хэшу фото человека.
+    Инференс идет по одному за раз; фото из detect_many и запросы других потоков,
+    пришедшие за это время, уходят в бэкенд общими пакетами.
+    """
+    
+    def __init__(self, backend: Optional[PoseBackend] = None):
+        self.backend = backend or create_backend()
+        self.input_size = config.pose.input_size
+        self.max_batch = config.pose.max_batch
+        self.cache_size = config.pose.cache_size
+        self._cache: 'OrderedDict[str, Landmarks]' = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._pending: List[_PoseRequest] = []
+        self._pending_lock = threading.Lock()
+        self._inference_lock = threading.Lock()
+    
+    def detect(self, image: DecodedImage, image_data: Optional[bytes] = None) -> Optional[Dict]:
+        """Точки в пикселях image; image_data — исходные bytes фото для кэша"""
+        return self.detect_many([(image, image_data)])[0]
+    
+    @metrics.timed('pose')
+    def detect_many(self, items: List[Tuple[DecodedImage, Optional[bytes]]]) -> List[Optional[Dict]]:
+        """
+        Точки для нескольких фото (изображение, bytes для кэша или None);
+        промахи кэша уходят в бэкенд пакетами до max_batch.
+        """
+        results: List[Optional[Dict]] = [None] * len(items)
+        try:
+            keys: List[Optional[str]] = []
+            missing = []
+            for i, (image, image_data) in enumerate(items):
+                key = None
+                if self.backend.cacheable and image_data is not None and self.cache_size:
+                    key = hashlib.sha256(image_data).hexdigest()
+                    landmarks = self._cache_get(key)
+                    if landmarks is not None:
+                        results[i] = to_pixels(landmarks, image.width, image.height)
+                keys.append(key)
+                if results[i] is None:
+                    missing.append(i)
+                
+            # Модели хватает уменьшенной копии
+            pixels = [
+                items[i][0].resized(self.input_size).bgr if self.backend.needs_pixels else None
+                for i in missing
+            ]
+            for i, landmarks in zip(missing, self._infer_many(pixels)):
+                if landmarks is None:
+                    continue
+                if keys[i] is not None:
+                    self._cache_put(keys[i], landmarks)
+                image = items[i][0]
+                results[i] = to_pixels(landmarks, image.width, image.height)
+            return results
+            
+        except Exception as e:
+            logger.error(f"Pose detection error: {e}")
+            return results
+    
+    def _cache_get(self, key: str) -> Optional[Landmarks]:
+        with self._cache_lock:
+            landmarks = self._cache.get(key)
+            if landmarks is not None:
+                self._cache.move_to_end(key)
+            return landmarks
+    
+    def _cache_put(self, key: str, landmarks: Landmarks):
+        with self._cache_lock:
+            self._cache[key] = landmarks
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+    
+    def _infer_many(self, pixels: List[Optional[np.ndarray]]) -> List[Optional[Landmarks]]:
+        requests = [_PoseRequest(p) for p in pixels]
+        with self._pending_lock:
+            self._pending.extend(requests)
+            
+        for request in requests:
+            while not request.done:
+                with self._inference_lock:
+                    if request.done:
+                        break
+                    with self._pending_lock:
+                        batch = self._pending[:self.max_batch]
+                        del self._pending[:len(batch)]
+                    self._run_batch(batch)
+        return [request.result for request in requests]
+    
+    def _run_batch(self, batch: List[_PoseRequest]):
+        try:
+            with metrics.stage('pose_inference'):
+                results = list(self.backend.detect_batch([request.pixels for request in batch]))
+        except Exception as e:
+            logger.error(f"Pose backend error: {e}")
+            results = []
+        if len(results) != len(batch):
+            if results:
+                logger.error(f"Pose backend returned {len(results)} results for {len(batch)} images")
+            # Без ответа бэкенда запрос остается без точек, иначе его поток ждал бы вечно
+            results = (results + [None] * len(batch))[:len(batch)]
+        for request, result in zip(batch, results):
+            request.result = result
+            request.done = True
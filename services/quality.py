@@ -0,0 +1,155 @@
+import logging
+import math
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+FULL = 'full'
+
+@dataclass(frozen=True)
+class QualityTier:
+    """Параметры конвейера для одного запроса; уровни идут от лучшего к самому быстрому"""
+    name: str
+    # Сторона результата и рабочая сторона одежды, пиксели
+    output_max_side: int
+    working_max_side: int
+    # Морфологическая доводка маски одежды
+    refine_mask: bool = True
+    # На сколько ниже качества, которое полный уровень подобрал бы для того же фото;
+    # 0 — качество подбирается под output_target_bytes
+    quality_step: int = 0
+    fast_encode: bool = False
+    preview: bool = True
+    
+    @property
+    def degraded(self) -> bool:
+        return self.name != FULL
+    
+    def encode_quality(self, width: int, height: int) -> Optional[int]:
+        """
+        Качество кодирования для фото width x height (исходный размер), None — подбор.
+        Меньшему результату подбор дал бы то же или более высокое качество, поэтому
+        упрощенный уровень отсчитывает шаг от качества полного уровня.
+        """
+        if not self.quality_step:
+            return None
+        from utils.file_handlers import FileHandler, MIN_OUTPUT_QUALITY
+        from utils.image_buffer import _fit_size
+        side = config.image.output_max_side
+        if max(width, height) > side:
+            width, height = _fit_size((width, height), side)
+        full = FileHandler.choose_quality(
+            width * height, config.image.output_target_bytes, config.image.output_format.upper()
+        )
+        return max(MIN_OUTPUT_QUALITY, full - self.quality_step)
+
+def _build_tiers() -> Tuple[QualityTier, ...]:
+    image = config.image
+    return (
+        QualityTier(FULL, image.output_max_side, image.working_max_side),
+        QualityTier(
+            'reduced', image.output_max_side * 3 // 4, image.working_max_side * 3 // 4,
+            quality_step=10
+        ),
+        QualityTier(
+            'fast', image.output_max_side // 2, image.working_max_side // 2,
+            refine_mask=False, quality_step=20, fast_encode=True, preview=False
+        ),
+    )
+
+TIERS = _build_tiers()
+
+def get_tier(name: Optional[str] = None) -> QualityTier:
+    """Уровень по имени; в пул процессов уходит только имя"""
+    for tier in TIERS:
+        if tier.name == name:
+            return tier
+    return TIERS[0]
+
+class TierScheduler:
+    """
+    Выбор уровня качества под срок ответа. Для каждого уровня хранится сглаженное
+    время обработки без ожидания в очереди; по нему и числу задач в пуле оценивается,
+    когда будет готов результат, и выбирается лучший уровень, успевающий к сроку.
+    Когда очередь рассасывается, оценки снова пропускают полный уровень.
+    """
+    # Вес нового замера в сглаженном времени
+    SMOOTHING = 0.2
+    
+    def __init__(self, executor=None, deadline: Optional[float] = None, enabled: Optional[bool] = None):
+        self.executor = executor
+        self.deadline = deadline or config.quality.deadline
+        self.enabled = config.quality.tiers if enabled is None else enabled
+        self.tiers = TIERS
+        self._service_time: Dict[str, float] = {}
+        # Сколько запросов обслужено на каждом уровне
+        self.served: Counter = Counter()
+    
+    @property
+    def parallelism(self) -> int:
+        if self.executor is not None and self.executor.enabled:
+            return self.executor.workers
+        return 1
+    
+    @property
+    def ahead(self) -> int:
+        """Задачи, которые пул выполнит раньше новой"""
+        if self.executor is not None and self.executor.enabled:
+            return self.executor.pending
+        return 0
+    
+    def service_time(self, tier: QualityTier) -> Optional[float]:
+        """
+        Сглаженное время уровня. Для уровня без замеров оно пересчитывается
+        из соседнего по площади результата, пока своих замеров нет.
+        """
+        seconds = self._service_time.get(tier.name)
+        if seconds is not None:
+            return seconds
+        for other in self.tiers:
+            seconds = self._service_time.get(other.name)
+            if seconds is not None:
+                return seconds * (tier.output_max_side / other.output_max_side) ** 2
+        return None
+    
+    def estimate(self, tier: QualityTier) -> Optional[float]:
+        """Через сколько секунд будет готов результат уровня, если отправить его сейчас"""
+        seconds = self.service_time(tier)
+        if seconds is None:
+            return None
+        return math.ceil((self.ahead + 1) / self.parallelism) * seconds
+    
+    def choose(self, spent: float = 0.0) -> QualityTier:
+        """Лучший уровень, успевающий к сроку; spent — уже прошедшее время запроса"""
+        if not self.enabled:
+            return self.tiers[0]
+            
+        budget = self.deadline - spent
+        for tier in self.tiers:
+            estimate = self.estimate(tier)
+            # Без замеров оценивать нечего: первый запрос и дает замер
+            if estimate is None or estimate <= budget:
+                return tier
+        return self.tiers[-1]
+    
+    def observe(self, tier: QualityTier, seconds: float, ahead: int = 0):
+        """
+        Замер выполненного запроса; ahead — задачи перед ним в момент отправки.
+        Ожидание в очереди вычитается, чтобы оценка зависела только от уровня.
+        """
+        self.served[tier.name] += 1
+        service = seconds / math.ceil((ahead + 1) / self.parallelism)
+        previous = self._service_time.get(tier.name)
+        if previous is None:
+            self._service_time[tier.name] = service
+        else:
+            self._service_time[tier.name] = previous + self.SMOOTHING * (service - previous)
+        if tier.degraded:
+            logger.info(f"Served quality tier {tier.name} in {seconds:.2f}s ({ahead} jobs ahead)")
+    
+    def report(self) -> str:
+        return ', '.join(f'{tier.name} {self.served[tier.name]}' for tier in self.tiers)
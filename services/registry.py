@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator
+
+logger = logging.getLogger(__name__)
+
+class LazyService:
+    """Заместитель сервиса: сервис создается при первом обращении к его атрибуту"""
+    
+    def __init__(self, registry: 'ServiceRegistry', name: str):
+        self._registry = registry
+        self._name = name
+    
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._registry.get(self._name), attr)
+
+class ServiceRegistry:
+    """
+    Сервисы, создаваемые при первом обращении. Тяжелые модули (OpenCV, модели)
+    импортируются внутри фабрик, поэтому импорт хендлеров почти ничего не стоит,
+    а создание и прогрев выполняются заранее в warm_up при запуске.
+    """
+    
+    def __init__(self):
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._instances: Dict[str, Any] = {}
+        # Сервис создается один раз, даже если его запросили одновременно из потока прогрева
+        self._lock = threading.RLock()
+        # Время создания сервисов и этапов запуска, секунды
+        self.timings: Dict[str, float] = {}
+    
+    def register(self, name: str, factory: Callable[[], Any]):
+        self._factories[name] = factory
+    
+    def lazy(self, name: str) -> LazyService:
+        return LazyService(self, name)
+    
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(name)
+                if instance is None:
+                    with self.timed(name):
+                        instance = self._instances[name] = self._factories[name]()
+        return instance
+    
+    @contextmanager
+    def timed(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - started
+    
+    async def warm_up(self):
+        """
+        Создание всех сервисов и вызов их warm_up, если он есть. Создание и прогрев
+        идут в потоке, чтобы цикл событий (например, webhook-сервер) не блокировался.
+        """
+        loop = asyncio.get_running_loop()
+        for name in self._factories:
+            service = await loop.run_in_executor(None, self.get, name)
+            warm_up = getattr(service, 'warm_up', None)
+            if warm_up is not None:
+                with self.timed(f'{name}.warm_up'):
+                    await loop.run_in_executor(None, warm_up)
+    
+    def report(self) -> str:
+        return ', '.join(f'{name} {seconds:.2f} s' for name, seconds in self.timings.items())
+
+registry = ServiceRegistry()
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from config import config
+from .catalog import catalog_build_id
+from .garment_cache import GarmentCache
+from utils.disk_lru import DiskLRU
+
+logger = logging.getLogger(__name__)
+
+# Увеличивается при любом изменении конвейера, влияющем на результат
+PIPELINE_VERSION = 3
+# file_id занимают немного, ограничиваем только их количество
+MAX_FILE_IDS = 100_000
+# Файлы записи на диске: результат и file_id отправленного фото
+DISK_SUFFIXES = ('.img', '.id')
+
+def _model_identity(path: str) -> str:
+    """Имя, размер и время записи файла модели: замененная модель дает новый ключ"""
+    if not path:
+        return ''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return os.path.basename(path)
+    return f'{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+def _pipeline_fingerprint() -> bytes:
+    """Версия конвейера и параметры, от которых зависит результат"""
+    image = config.image
+    params = {
+        'version': PIPELINE_VERSION,
+        'working_max_side': image.working_max_side,
+        'output_max_side': image.output_max_side,
+        'clothes_scale_factor': image.clothes_scale_factor,
+        'clothes_position_offset': image.clothes_position_offset,
+        'output_format': image.output_format,
+        'output_quality': image.output_quality,
+        'output_target_bytes': image.output_target_bytes,
+        'output_progressive': image.output_progressive,
+        'pose_backend': config.pose.backend,
+        'pose_model': _model_identity(config.pose.model_path),
+        'pose_input_size': config.pose.input_size,
+        # Пересобранный каталог дает другие маски и пиксели тех же номеров
+        'catalog_build': catalog_build_id(),
+    }
+    return json.dumps(params, sort_keys=True).encode('utf-8')
+
+@dataclass
+class CachedRender:
+    """Готовый результат: file_id уже отправленного фото и/или его bytes"""
+    file_id: Optional[str] = None
+    data: Optional[bytes] = None
+
+class RenderCache:
+    """
+    Кэш результатов примерки по содержимому входов и параметрам конвейера.
+    Bytes хранятся в LRU в памяти и на диске, а для уже отправленных результатов —
+    file_id Telegram: повторная отправка по нему не требует загрузки файла.
+    """
+    
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        disk_dir: Optional[str] = None,
+        disk_bytes: Optional[int] = None
+    ):
+        self.max_bytes = config.cache.render_cache_bytes if max_bytes is None else max_bytes
+        self.disk_dir = config.cache.render_cache_dir if disk_dir is None else disk_dir
+        self.disk_bytes = config.cache.render_cache_disk_bytes if disk_bytes is None else disk_bytes
+        self._entries: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._file_ids: 'OrderedDict[str, str]' = OrderedDict()
+        self._size = 0
+        self._fingerprint = _pipeline_fingerprint()
+        # Результат и его file_id вытесняются вместе; file_id без результата на диске тоже
+        self._disk = DiskLRU(self.disk_dir, self.disk_bytes, DISK_SUFFIXES) if self.disk_dir else None
+    
+    def render_key(
+        self,
+        human_image_data: bytes,
+        clothes_key: Optional[str],
+        clothes_image_data: Optional[bytes] = None
+    ) -> str:
+        """
+        Ключ результата. Одежда задается своим ключом (file_unique_id Telegram
+        или номер в каталоге уже определяют содержимое), иначе хэшем bytes.
+        """
+        garment = clothes_key or GarmentCache.content_key(clothes_image_data)
+        hasher = hashlib.sha256(self._fingerprint)
+        hasher.update(hashlib.sha256(human_image_data).digest())
+        hasher.update(garment.encode('utf-8'))
+        return hasher.hexdigest()
+    
+    def get(self, key: str) -> Optional[CachedRender]:
+        # По file_id результат отправляется без bytes, диск не читаем
+        file_id = self._file_ids.get(key) or self._load_file_id(key)
+        if file_id is not None:
+            self._file_ids[key] = file_id
+            self._file_ids.move_to_end(key)
+            return CachedRender(file_id=file_id)
+            
+        data = self._entries.get(key)
+        if data is not None:
+            self._entries.move_to_end(key)
+            return CachedRender(data=data)
+            
+        data = self._load_from_disk(key)
+        if data is not None:
+            self._remember(key, data)
+            return CachedRender(data=data)
+        return None
+    
+    def put(self, key: str, data: bytes):
+        self._remember(key, data)
+        self._save_to_disk(key, data)
+    
+    def set_file_id(self, key: str, file_id: str):
+        """file_id результата после первой отправки"""
+        self._file_ids[key] = file_id
+        self._file_ids.move_to_end(key)
+        while len(self._file_ids) > MAX_FILE_IDS:
+            self._file_ids.popitem(last=False)
+            
+        if self._disk is not None:
+            try:
+                self._disk.write(key + '.id', file_id.encode('utf-8'))
+            except OSError as e:
+                logger.error(f"Error saving render file_id: {e}")
+    
+    def _remember(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+            
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+            
+        self._entries[key] = data
+        self._size += len(data)
+        
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+    
+    def _load_file_id(self, key: str) -> Optional[str]:
+        if self._disk is None:
+            return None
+        data = self._disk.read(key + '.id')
+        if data is None:
+            return None
+        # Результат, отправляемый по file_id, тоже считается использованным
+        self._disk.touch(key + '.img')
+        return data.decode('utf-8') or None
+    
+    def _load_from_disk(self, key: str) -> Optional[bytes]:
+        if self._disk is None:
+            return None
+        return self._disk.read(key + '.img')
+    
+    def _save_to_disk(self, key: str, data: bytes):
+        if self._disk is None or len(data) > self.disk_bytes:
+            return
+            
+        if self._disk.exists(key + '.img'):
+            return
+            
+        try:
+            self._disk.write(key + '.img', data)
+        except OSError as e:
+            logger.error(f"Error saving render to disk cache: {e}")
@@ -0,0 +1,35 @@
+import asyncio
+from typing import Awaitable, Callable, List, Optional, TypeVar
+
+from .garment_cache import GarmentCacheMiss
+
+# Ответы пользователю, общие для хендлеров и воркеров очереди
+RESULT_CAPTION = "🎉 Вот результат примерки!\n\nХотите попробовать еще? Отправьте новое фото человека."
+FAILURE_TEXT = "❌ Произошла ошибка при обработке. Попробуйте еще раз."
+RENDER_FAILED_TEXT = "❌ Не удалось обработать фото. Попробуйте с другими изображениями."
+REJECTED_PHOTO_TEXT = "❌ {error}. Отправьте другое фото."
+
+T = TypeVar('T')
+
+async def render_with_refetch(
+    render: Callable[[List[Optional[bytes]], bool], Awaitable[T]],
+    clothes_data: List[Optional[bytes]],
+    download: Callable[[int], Awaitable[Optional[bytes]]]
+) -> Optional[T]:
+    """
+    Рендер с докачкой одежды, которую вытеснили из кэша между проверкой и рендером.
+    render(clothes_data, retry) получает bytes одежды (None — взять из кэша);
+    download(i) скачивает i-ю вещь. Недостающие вещи докачиваются одновременно,
+    как и при первой загрузке. None — какую-то вещь скачать не удалось.
+    """
+    try:
+        return await render(clothes_data, False)
+    except GarmentCacheMiss:
+        missing = [i for i, data in enumerate(clothes_data) if data is None]
+        downloaded = await asyncio.gather(*(download(i) for i in missing))
+        if not all(downloaded):
+            return None
+        clothes_data = list(clothes_data)
+        for i, data in zip(missing, downloaded):
+            clothes_data[i] = data
+        return await render(clothes_data, True)
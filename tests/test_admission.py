@@ -0,0 +1,28 @@
+import struct
+
+from config import config
+from services.admission import AdmissionController
+
+def _jpeg_header(width: int, height: int) -> bytes:
+    """Начало JPEG до SOF0 — достаточно для чтения размеров по заголовку"""
+    sof = struct.pack('>BHHB', 8, height, width, 3) + b'\x01\x22\x00\x02\x11\x01\x03\x11\x01'
+    return b'\xff\xd8' + b'\xff\xc0' + struct.pack('>H', len(sof) + 2) + sof
+
+def test_cost_is_capped_to_decode_size():
+    # 12 МП: 4000 x 3000
+    photo = _jpeg_header(4000, 3000)
+    output_side = config.image.output_max_side
+    working_side = config.image.working_max_side
+    expected = (
+        output_side * round(3000 * output_side / 4000)
+        + working_side * round(3000 * working_side / 4000)
+    ) / 1_000_000
+    
+    cost = AdmissionController.estimate_cost(photo, photo)
+    
+    assert cost == expected
+    assert cost < 2
+
+def test_small_photo_costs_its_own_size():
+    photo = _jpeg_header(400, 300)
+    assert AdmissionController.estimate_cost(photo) == 400 * 300 / 1_000_000
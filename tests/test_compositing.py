@@ -0,0 +1,38 @@
+import numpy as np
+
+from services.compositing import AlphaCompositor, Layer
+
+def _layer(rng, height, width, x, y, premultiplied=False):
+    alpha = rng.integers(0, 256, (height, width), dtype=np.uint8)
+    rgb = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    if premultiplied:
+        rgb = ((rgb.astype(np.uint16) * alpha[..., np.newaxis] + 127) // 255).astype(np.uint8)
+    return Layer(rgb, alpha, x, y, premultiplied)
+
+def test_blend_many_matches_sequential_blend():
+    rng = np.random.default_rng(0)
+    background = rng.integers(0, 256, (120, 90, 3), dtype=np.uint8)
+    layers = [
+        _layer(rng, 60, 50, 10, 20),
+        # Перекрывает первый слой и выходит за край фона
+        _layer(rng, 70, 40, 60, -15, premultiplied=True),
+        _layer(rng, 30, 30, 200, 200),
+        _layer(rng, 50, 80, -20, 70, premultiplied=True),
+    ]
+    
+    expected = background.copy()
+    compositor = AlphaCompositor()
+    for layer in layers:
+        compositor.blend(expected, layer.foreground, layer.alpha, layer.x, layer.y, layer.premultiplied)
+        
+    actual = AlphaCompositor().blend_many(background.copy(), layers)
+    
+    np.testing.assert_array_equal(actual, expected)
+
+def test_blend_many_without_visible_layers_keeps_background():
+    rng = np.random.default_rng(1)
+    background = rng.integers(0, 256, (40, 40, 3), dtype=np.uint8)
+    
+    result = AlphaCompositor().blend_many(background.copy(), [_layer(rng, 10, 10, 100, 100)])
+    
+    np.testing.assert_array_equal(result, background)
@@ -0,0 +1,31 @@
+import os
+
+from utils.disk_lru import DiskLRU, write_atomic
+
+def test_directory_created_on_first_write(tmp_path):
+    directory = tmp_path / 'cache'
+    lru = DiskLRU(str(directory), 1000, ('.img',))
+    assert not directory.exists()
+    
+    lru.write('a.img', b'x' * 10)
+    
+    assert lru.read('a.img') == b'x' * 10
+
+def test_evicts_oldest_entry_with_all_its_files(tmp_path):
+    lru = DiskLRU(str(tmp_path), 250, ('.img', '.id'))
+    lru.write('old.img', b'x' * 100)
+    lru.write('old.id', b'file-id')
+    os.utime(tmp_path / 'old.img', (1, 1))
+    os.utime(tmp_path / 'old.id', (1, 1))
+    
+    lru.write('new.img', b'y' * 100)
+    lru.write('newer.img', b'z' * 100)
+    
+    assert sorted(os.listdir(tmp_path)) == ['new.img', 'newer.img']
+
+def test_write_atomic_leaves_no_temporary_files(tmp_path):
+    path = tmp_path / 'result.jpg'
+    write_atomic(str(path), b'data')
+    
+    assert path.read_bytes() == b'data'
+    assert os.listdir(tmp_path) == ['result.jpg']
@@ -0,0 +1,21 @@
+import pytest
+
+from services.quality import TIERS
+from utils.file_handlers import FileHandler
+from utils.image_buffer import _fit_size
+from config import config
+
+@pytest.mark.parametrize('size', [(4000, 3000), (3000, 4000), (1280, 960), (960, 720), (2048, 2048), (800, 600)])
+def test_tier_quality_decreases(size):
+    side = config.image.output_max_side
+    width, height = _fit_size(size, side) if max(size) > side else size
+    # Полный уровень подбирает качество сам
+    qualities = [
+        FileHandler.choose_quality(width * height, config.image.output_target_bytes)
+    ]
+    assert TIERS[0].encode_quality(*size) is None
+    for tier in TIERS[1:]:
+        qualities.append(tier.encode_quality(*size))
+        
+    assert qualities == sorted(qualities, reverse=True)
+    assert len(set(qualities)) == len(qualities)
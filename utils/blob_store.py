@@ -0,0 +1,108 @@
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+class BlobStore:
+    """Временное хранилище bytes с TTL и лимитом объема: в памяти или на диске"""
+    
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        disk_dir: Optional[str] = None
+    ):
+        self.max_bytes = config.cache.photo_store_bytes if max_bytes is None else max_bytes
+        self.ttl = config.cache.photo_store_ttl if ttl is None else ttl
+        self.disk_dir = config.cache.photo_store_dir if disk_dir is None else disk_dir
+        # key -> (время истечения, размер, данные; None если лежат на диске)
+        self._entries: 'OrderedDict[str, Tuple[float, int, Optional[bytes]]]' = OrderedDict()
+        self._size = 0
+        
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self._remove_stale_files()
+    
+    def put(self, data: bytes) -> Optional[str]:
+        """Сохранение данных, возвращает ключ или None, если они не помещаются"""
+        if len(data) > self.max_bytes:
+            return None
+            
+        key = uuid.uuid4().hex
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), 'wb') as f:
+                    f.write(data)
+            except OSError as e:
+                logger.error(f"Error writing blob to disk: {e}")
+                return None
+                
+        self._entries[key] = (
+            time.monotonic() + self.ttl,
+            len(data),
+            None if self.disk_dir else data
+        )
+        self._size += len(data)
+        self._evict()
+        return key if key in self._entries else None
+    
+    def get(self, key: Optional[str]) -> Optional[bytes]:
+        """Данные по ключу или None, если они истекли или вытеснены"""
+        if not key:
+            return None
+            
+        self._evict()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+            
+        _, _, data = entry
+        if data is not None:
+            return data
+            
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            self.delete(key)
+            return None
+    
+    def delete(self, key: Optional[str]):
+        entry = self._entries.pop(key, None) if key else None
+        if entry is None:
+            return
+            
+        self._size -= entry[1]
+        if self.disk_dir:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+    
+    def _evict(self):
+        """Удаление истекших записей и самых старых сверх лимита объема"""
+        now = time.monotonic()
+        # Записи упорядочены по времени добавления, а TTL у всех одинаковый
+        while self._entries:
+            key, (expires_at, _, _) = next(iter(self._entries.items()))
+            if expires_at > now and self._size <= self.max_bytes:
+                break
+            self.delete(key)
+    
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f'{key}.blob')
+    
+    def _remove_stale_files(self):
+        """Файлы прошлого запуска не попадут в индекс, поэтому удаляем их"""
+        for name in os.listdir(self.disk_dir):
+            if name.endswith('.blob'):
+                try:
+                    os.remove(os.path.join(self.disk_dir, name))
+                except OSError:
+                    pass
@@ -0,0 +1,114 @@
+import os
+import tempfile
+from contextlib import contextmanager
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+@contextmanager
+def atomic_file(path: str) -> Iterator[BinaryIO]:
+    """
+    Файл для записи, который появляется под именем path целиком или не появляется:
+    запись идет во временный файл рядом и атомарно переименовывается. Недописанный
+    файл не виден другим процессам и не выглядит готовым после падения.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def write_atomic(path: str, data: bytes):
+    with atomic_file(path) as f:
+        f.write(data)
+
+class DiskLRU:
+    """
+    Каталог файлов с лимитом объема, общий для процессов. Время изменения файла
+    служит отметкой использования; при превышении лимита давно не использованные
+    записи удаляются до 90% лимита. Запись — файлы с одним именем и разными
+    суффиксами из suffixes, они вытесняются вместе.
+    """
+    
+    def __init__(self, directory: str, max_bytes: int, suffixes: Tuple[str, ...]):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffixes = suffixes
+        # Каталог создается и подсчитывается при первой записи
+        self._size: Optional[int] = None
+    
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+    
+    def exists(self, name: str) -> bool:
+        return os.path.exists(self.path(name))
+    
+    def read(self, name: str) -> Optional[bytes]:
+        """Содержимое файла с отметкой использования или None"""
+        try:
+            with open(self.path(name), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        self.touch(name)
+        return data
+    
+    def touch(self, *names: str):
+        for name in names:
+            try:
+                os.utime(self.path(name))
+            except OSError:
+                pass
+    
+    @contextmanager
+    def open_write(self, name: str) -> Iterator[BinaryIO]:
+        """Атомарная запись файла с учетом объема; OSError — запись не удалась"""
+        if self._size is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._size = sum(size for _, size, _ in self._scan().values())
+        path = self.path(name)
+        with atomic_file(path) as f:
+            yield f
+        self._size += os.path.getsize(path)
+        if self._size > self.max_bytes:
+            self.evict()
+    
+    def write(self, name: str, data: bytes):
+        with self.open_write(name) as f:
+            f.write(data)
+    
+    def _scan(self) -> Dict[str, Tuple[float, int, List[str]]]:
+        """Записи каталога: имя без суффикса -> (последнее использование, размер, файлы)"""
+        entries: Dict[str, Tuple[float, int, List[str]]] = {}
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(self.suffixes):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            key = os.path.splitext(entry.name)[0]
+            used, size, paths = entries.get(key, (0.0, 0, []))
+            entries[key] = (
+                max(used, stat.st_mtime), size + stat.st_size, paths + [entry.path]
+            )
+        return entries
+    
+    def evict(self):
+        """Удаление давно не использованных записей до 90% лимита"""
+        entries = self._scan()
+        # Каталог общий для процессов, поэтому размер пересчитываем
+        self._size = sum(size for _, size, _ in entries.values())
+        for _, size, paths in sorted(entries.values(), key=lambda entry: entry[0]):
+            if self._size <= self.max_bytes * 0.9:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._size -= size
@@ -1,26 +1,48 @@
-import aiohttp
 from io import BytesIO
 from PIL import Image
-import cv2
 import numpy as np
-from typing import Optional, Tuple
+import threading
+from typing import List, Optional, Tuple
+from aiogram import types
 from config import config
+from utils.image_buffer import DecodedImage
+from utils.http_client import download_client
+from utils.validators import ImageValidator, ImageRejectedError
+from utils.metrics import metrics
+
+# Примерный объем фото в JPEG 4:2:0, бит на пиксель при данном качестве
+JPEG_BITS_PER_PIXEL = (
+    (95, 4.0), (90, 2.8), (85, 2.1), (80, 1.7), (75, 1.4), (70, 1.2), (60, 1.0), (50, 0.85)
+)
+# WebP при том же качестве примерно на треть компактнее
+WEBP_SIZE_FACTOR = 0.7
+MIN_OUTPUT_QUALITY = 50
+
+# Буфер кодирования переиспользуется между результатами в каждом потоке
+_encode_buffers = threading.local()
 
 class FileHandler:
     @staticmethod
-    async def download_telegram_file(bot, file_id: str) -> Optional[bytes]:
-        """Скачивание файла из Telegram"""
+    async def download_telegram_file(bot, file_id: str, validate: bool = False) -> Optional[bytes]:
+        """
+        Скачивание файла из Telegram.
+        С validate=True заголовок изображения проверяется по первым байтам,
+        и неподходящий файл обрывается с ImageRejectedError.
+        """
         try:
             file = await bot.get_file(file_id)
-            file_path = file.file_path
+            if file.file_size and file.file_size > config.image.max_file_size:
+                print(f"File is too large: {file.file_size} bytes")
+                return None
             
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    f'https://api.telegram.org/file/bot{config.bot.token}/{file_path}',
-                    timeout=aiohttp.ClientTimeout(total=config.api.request_timeout)
-                ) as resp:
-                    if resp.status == 200:
-                        return await resp.read()
+            # Общий клиент переиспользует соединения между загрузками
+            with metrics.stage('download', sync=False):
+                return await download_client.download(
+                    download_client.file_url(config.bot.token, file.file_path),
+                    head_check=ImageValidator.check_header if validate else None
+                )
+        except ImageRejectedError:
+            raise
         except Exception as e:
             print(f"Error downloading file: {e}")
             return None
@@ -35,25 +57,109 @@ class FileHandler:
             return None
     
     @staticmethod
-    def pil_to_bytes(image: Image.Image, format: str = 'JPEG') -> Optional[bytes]:
-        """Конвертация PIL Image в bytes"""
+    def decode_image(image_data: bytes, max_side: Optional[int] = None) -> Optional[DecodedImage]:
+        """Однократное декодирование bytes для всего конвейера"""
+        try:
+            with metrics.stage('decode') as stage:
+                image = DecodedImage.from_bytes(image_data, max_side=max_side)
+                stage.pixels = image.width * image.height
+            return image
+        except Exception as e:
+            print(f"Error decoding image: {e}")
+            return None
+    
+    @staticmethod
+    @metrics.timed('encode')
+    def pil_to_bytes(
+        image: Image.Image,
+        format: Optional[str] = None,
+        quality: Optional[int] = None,
+        fast: bool = False
+    ) -> Optional[bytes]:
+        """
+        Конвертация PIL Image в bytes.
+        Без quality качество подбирается по разрешению так, чтобы файл уложился
+        в output_target_bytes: Telegram все равно пережимает фото, лишние байты
+        только замедляют загрузку. fast=True — baseline JPEG без оптимизации таблиц.
+        """
         try:
-            output_buffer = BytesIO()
-            image.save(output_buffer, format=format, quality=config.image.output_quality)
-            output_buffer.seek(0)
-            return output_buffer.getvalue()
+            format = (format or config.image.output_format).upper()
+            target_bytes = config.image.output_target_bytes
+            adaptive = quality is None
+            if adaptive:
+                quality = FileHandler.choose_quality(
+                    image.size[0] * image.size[1], target_bytes, format
+                )
+                
+            data = FileHandler._encode(image, format, quality, fast)
+            # Оценка промахнулась: одна повторная попытка с меньшим качеством
+            if adaptive and len(data) > target_bytes * 1.15 and quality > MIN_OUTPUT_QUALITY:
+                quality = max(MIN_OUTPUT_QUALITY, quality - 10)
+                data = FileHandler._encode(image, format, quality, fast)
+            return data
         except Exception as e:
             print(f"Error converting PIL to bytes: {e}")
             return None
     
+    @staticmethod
+    def choose_quality(pixels: int, target_bytes: int, format: str = 'JPEG') -> int:
+        """Наибольшее качество не выше output_quality, при котором файл уложится в target_bytes"""
+        factor = WEBP_SIZE_FACTOR if format == 'WEBP' else 1.0
+        for quality, bits in JPEG_BITS_PER_PIXEL:
+            if quality <= config.image.output_quality and pixels * bits * factor / 8 <= target_bytes:
+                return quality
+        return MIN_OUTPUT_QUALITY
+    
+    @staticmethod
+    def _encode(image: Image.Image, format: str, quality: int, fast: bool) -> bytes:
+        buffer = getattr(_encode_buffers, 'buffer', None)
+        if buffer is None:
+            buffer = _encode_buffers.buffer = BytesIO()
+        buffer.seek(0)
+        buffer.truncate()
+        
+        if format == 'WEBP':
+            image.save(buffer, format='WEBP', quality=quality, method=0 if fast else 4)
+        elif format == 'JPEG':
+            # Baseline 4:2:0 — самый быстрый путь libjpeg-turbo. Progressive с optimize
+            # (TRYON_OUTPUT_PROGRESSIVE=1) дает файл меньше, но кодирует в разы дольше
+            progressive = config.image.output_progressive and not fast
+            image.save(
+                buffer, format='JPEG', quality=quality, subsampling=2,
+                optimize=progressive, progressive=progressive
+            )
+        else:
+            image.save(buffer, format=format)
+        return buffer.getvalue()
+    
+    @staticmethod
+    def as_input_file(image_data: bytes, filename: str = 'tryon') -> types.InputFile:
+        """Обертка bytes для отправки через Bot API; расширение берется по сигнатуре"""
+        extension = '.webp' if image_data[8:12] == b'WEBP' else '.jpg'
+        return types.InputFile(BytesIO(image_data), filename=filename + extension)
+    
+    @staticmethod
+    def as_media_group(results: List[bytes], caption: Optional[str] = None) -> types.MediaGroup:
+        """Альбом из нескольких результатов; подпись показывается у первого фото"""
+        media = types.MediaGroup()
+        for i, image_data in enumerate(results):
+            media.attach_photo(
+                FileHandler.as_input_file(image_data, filename=f'tryon_{i + 1}'),
+                caption=caption if i == 0 else None
+            )
+        return media
+    
     @staticmethod
     def pil_to_cv2(image: Image.Image) -> np.ndarray:
         """Конвертация PIL Image в OpenCV format"""
+        # OpenCV не нужен процессу бота, пока работа идет в пуле
+        import cv2
         return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
     
     @staticmethod
     def cv2_to_pil(image: np.ndarray) -> Image.Image:
         """Конвертация OpenCV image в PIL"""
+        import cv2
         return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
     
     @staticmethod
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+from typing import Any, Callable, Optional
+import aiohttp
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Статусы, при которых имеет смысл повторить запрос
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+CHUNK_SIZE = 64 * 1024
+
+class FileTooLargeError(Exception):
+    """Файл превышает допустимый размер"""
+
+class DownloadClient:
+    """Долгоживущий HTTP-клиент для скачивания файлов Telegram с пулом соединений"""
+    
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        max_connections: Optional[int] = None,
+        retries: Optional[int] = None,
+        max_file_size: Optional[int] = None
+    ):
+        self.base_url = (base_url or config.api.telegram_api_url).rstrip('/')
+        self.max_connections = max_connections or config.api.download_connections
+        self.retries = config.api.download_retries if retries is None else retries
+        self.max_file_size = max_file_size or config.image.max_file_size
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+    
+    async def start(self):
+        """Создание сессии; вызывается при старте бота или лениво при первом запросе"""
+        if self._session is not None and not self._session.closed:
+            return
+            
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            limit_per_host=self.max_connections,
+            keepalive_timeout=60
+        )
+        self._semaphore = asyncio.Semaphore(self.max_connections)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=config.api.request_timeout)
+        )
+    
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+    
+    def file_url(self, token: str, file_path: str) -> str:
+        return f'{self.base_url}/file/bot{token}/{file_path}'
+    
+    async def download(
+        self,
+        url: str,
+        head_check: Optional[Callable[[bytes, bool], Any]] = None
+    ) -> bytes:
+        """
+        Скачивание с повторами и обрывом при превышении max_file_size.
+        head_check(data, complete) вызывается на накопленных первых байтах, пока
+        не вернет не-None; исключение из него прерывает загрузку.
+        """
+        await self.start()
+        
+        delay = 0.5
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    return await self._read(url, head_check)
+            except FileTooLargeError:
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                retryable = not (
+                    isinstance(e, aiohttp.ClientResponseError) and e.status not in RETRY_STATUSES
+                )
+                if not retryable or attempt >= self.retries:
+                    raise
+                logger.warning(f"Download failed ({e}), retry {attempt + 1}/{self.retries}")
+                
+            await asyncio.sleep(delay)
+            delay *= 2
+    
+    async def _read(self, url: str, head_check: Optional[Callable[[bytes, bool], Any]]) -> bytes:
+        async with self._session.get(url) as resp:
+            resp.raise_for_status()
+            
+            if resp.content_length and resp.content_length > self.max_file_size:
+                raise FileTooLargeError(f"File is too large: {resp.content_length} bytes")
+                
+            # Читаем потоком и обрываем загрузку, как только превышен лимит
+            buffer = bytearray()
+            async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                buffer.extend(chunk)
+                if len(buffer) > self.max_file_size:
+                    raise FileTooLargeError(f"File is too large: over {self.max_file_size} bytes")
+                # Заголовок проверяется по первым чанкам, до скачивания всего файла
+                if head_check is not None and head_check(buffer, False) is not None:
+                    head_check = None
+                    
+            if head_check is not None:
+                head_check(buffer, True)
+            return bytes(buffer)
+
+download_client = DownloadClient()
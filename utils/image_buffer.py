@@ -0,0 +1,99 @@
+from dataclasses import dataclass
+from functools import cached_property
+from io import BytesIO
+from typing import Optional, Tuple
+import numpy as np
+from PIL import Image
+
+from config import config
+
+def _fit_size(size: Tuple[int, int], max_side: int) -> Tuple[int, int]:
+    """Размер с сохранением пропорций, вписанный в max_side"""
+    width, height = size
+    scale = max_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+@dataclass(frozen=True)
+class DecodedImage:
+    """Изображение, декодированное один раз: формат, размеры и единый RGB-буфер"""
+    format: str
+    pixels: np.ndarray  # H x W x 3, uint8, RGB, только для чтения
+    
+    @classmethod
+    def from_bytes(cls, image_data: bytes, max_side: Optional[int] = None) -> 'DecodedImage':
+        """Декодирование bytes в единый RGB-буфер, при необходимости сразу уменьшенный"""
+        image = Image.open(BytesIO(image_data))
+        image_format = (image.format or '').lower()
+        
+        # Image.open читает только заголовок: отсекаем "бомбы" до выделения памяти
+        if image.width * image.height > config.image.max_megapixels * 1_000_000:
+            raise ValueError(f"Image has too many pixels: {image.width}x{image.height}")
+            
+        target = None
+        if max_side and max(image.size) > max_side:
+            target = _fit_size(image.size, max_side)
+            # JPEG декодируется сразу в уменьшенном масштабе (DCT scaling 1/2..1/8)
+            image.draft('RGB', target)
+            
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+            
+        if target and image.size != target:
+            factor = min(image.size[0] // target[0], image.size[1] // target[1])
+            if factor > 1:
+                image = image.reduce(factor)
+            if image.size != target:
+                image = image.resize(target, Image.BILINEAR)
+                
+        # np.asarray забирает буфер PIL одной копией; массив только для чтения,
+        # поэтому его можно безопасно раздавать всем этапам конвейера
+        return cls(format=image_format, pixels=np.asarray(image))
+    
+    def resized(self, max_side: int) -> 'DecodedImage':
+        """Уменьшенная копия, если изображение больше max_side"""
+        if max(self.size) <= max_side:
+            return self
+            
+        # OpenCV импортируется при первом уменьшении, а не при запуске бота
+        import cv2
+        target = _fit_size(self.size, max_side)
+        pixels = cv2.resize(self.pixels, target, interpolation=cv2.INTER_AREA)
+        pixels.setflags(write=False)
+        return DecodedImage(format=self.format, pixels=pixels)
+    
+    @property
+    def width(self) -> int:
+        return self.pixels.shape[1]
+    
+    @property
+    def height(self) -> int:
+        return self.pixels.shape[0]
+    
+    @property
+    def size(self) -> Tuple[int, int]:
+        """Размеры в порядке PIL: (ширина, высота)"""
+        return self.width, self.height
+    
+    @property
+    def nbytes(self) -> int:
+        return self.pixels.nbytes
+    
+    @property
+    def rgb(self) -> np.ndarray:
+        return self.pixels
+    
+    @cached_property
+    def bgr(self) -> np.ndarray:
+        """
+        BGR-копия для OpenCV, создается один раз. Срез [:, :, ::-1] дал бы view
+        с отрицательным шагом, который OpenCV копирует при каждом вызове.
+        """
+        import cv2
+        pixels = cv2.cvtColor(self.pixels, cv2.COLOR_RGB2BGR)
+        pixels.setflags(write=False)
+        return pixels
+    
+    @property
+    def pil(self) -> Image.Image:
+        """PIL Image с копией пикселей: для режима RGB PIL не может использовать буфер NumPy"""
+        return Image.fromarray(self.pixels)
@@ -0,0 +1,316 @@
+import asyncio
+import copy
+import cProfile
+import functools
+import io
+import logging
+import os
+import pstats
+import tempfile
+import threading
+import time
+import tracemalloc
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BYTES_BUCKETS = tuple(2 ** p for p in range(20, 31))  # 1 МБ .. 1 ГБ
+PIXEL_BUCKETS = (0.1e6, 0.3e6, 1e6, 2e6, 4e6, 8e6, 12e6, 24e6, 48e6)
+
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+
+def _pixels_of(obj: Any) -> Optional[int]:
+    """Число пикселей массива NumPy или PIL Image"""
+    shape = getattr(obj, 'shape', None)
+    if shape is not None and len(shape) >= 2:
+        return int(shape[0]) * int(shape[1])
+    size = getattr(obj, 'size', None)
+    if isinstance(size, tuple) and len(size) == 2:
+        return int(size[0]) * int(size[1])
+    return None
+
+@dataclass
+class StageSample:
+    """Замер одного этапа конвейера"""
+    stage: str
+    wall_time: float
+    cpu_time: Optional[float] = None
+    peak_bytes: Optional[int] = None
+    pixels: Optional[int] = None
+
+@dataclass
+class _ActiveStage:
+    stage: str
+    pixels: Optional[int] = None
+    peak_bytes: int = 0
+
+class Histogram:
+    """Кумулятивная гистограмма в стиле Prometheus"""
+    
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+    
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по верхней границе корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+@dataclass
+class StageStats:
+    wall_time: Histogram = field(default_factory=lambda: Histogram(TIME_BUCKETS))
+    cpu_time: Histogram = field(default_factory=lambda: Histogram(TIME_BUCKETS))
+    peak_bytes: Histogram = field(default_factory=lambda: Histogram(BYTES_BUCKETS))
+    pixels: Histogram = field(default_factory=lambda: Histogram(PIXEL_BUCKETS))
+
+class LogExporter:
+    """Сводка по этапам в лог"""
+    
+    def export(self, stats: Dict[str, StageStats]):
+        for stage, s in sorted(stats.items()):
+            if not s.wall_time.count:
+                continue
+            logger.info(
+                f"stage={stage} count={s.wall_time.count} "
+                f"avg={s.wall_time.sum / s.wall_time.count:.3f}s "
+                f"p50<={s.wall_time.quantile(0.5)}s p95<={s.wall_time.quantile(0.95)}s"
+            )
+
+class PrometheusFileExporter:
+    """Текстовый файл в формате Prometheus (для node_exporter textfile collector)"""
+    
+    def __init__(self, path: str):
+        self.path = path
+    
+    def export(self, stats: Dict[str, StageStats]):
+        lines = []
+        for metric, attr in (
+            ('tryon_stage_wall_seconds', 'wall_time'),
+            ('tryon_stage_cpu_seconds', 'cpu_time'),
+            ('tryon_stage_peak_bytes', 'peak_bytes'),
+            ('tryon_stage_pixels', 'pixels'),
+        ):
+            lines.append(f'# TYPE {metric} histogram')
+            for stage, s in sorted(stats.items()):
+                histogram = getattr(s, attr)
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float('inf'),), histogram.counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{metric}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'{metric}_count{{stage="{stage}"}} {histogram.count}')
+                
+        # Атомарная запись, чтобы сборщик не прочитал половину файла
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
+
+class InMemoryExporter:
+    """Хранит последнюю выгрузку (для тестов и команды /stats)"""
+    
+    def __init__(self):
+        self.last: Dict[str, StageStats] = {}
+    
+    def export(self, stats: Dict[str, StageStats]):
+        self.last = stats
+
+class Metrics:
+    """Замеры этапов конвейера: время, CPU, пик памяти и размер изображений"""
+    
+    def __init__(self, exporter=None):
+        self.exporter = exporter
+        self.stats: Dict[str, StageStats] = {}
+        self.profile_mode: Optional[str] = None
+        # Стек вложенных этапов свой у каждого потока
+        self._local = threading.local()
+        # Замеры приходят из потоков (подготовка одежды, прогрев) и из цикла событий;
+        # без блокировки параллельные observe теряют обновления корзин и счетчиков
+        self._lock = threading.Lock()
+        # В рабочих процессах замеры копятся и возвращаются вместе с результатом
+        self._forwarded: Optional[List[StageSample]] = None
+    
+    @property
+    def _stack(self) -> List[_ActiveStage]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+    
+    @contextmanager
+    def stage(self, name: str, pixels: Optional[int] = None, sync: bool = True) -> Iterator[_ActiveStage]:
+        """
+        Замер этапа. pixels можно задать заранее или через возвращаемый объект.
+        Для этапов с await передавайте sync=False: у них замеряется только время,
+        потому что CPU и память потока в это время делят другие задачи.
+        """
+        active = _ActiveStage(stage=name, pixels=pixels)
+        tracing = sync and tracemalloc.is_tracing()
+        if tracing:
+            # Пик родительского этапа сохраняем до сброса счетчика
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1].peak_bytes = max(self._stack[-1].peak_bytes, peak)
+            tracemalloc.reset_peak()
+            start_memory = current
+            
+        if sync:
+            self._stack.append(active)
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield active
+        finally:
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = None
+            if sync:
+                cpu_time = time.thread_time() - cpu_start
+                self._stack.pop()
+                
+            peak_bytes = None
+            if tracing:
+                absolute_peak = max(active.peak_bytes, tracemalloc.get_traced_memory()[1])
+                if self._stack:
+                    self._stack[-1].peak_bytes = max(self._stack[-1].peak_bytes, absolute_peak)
+                peak_bytes = max(0, absolute_peak - start_memory)
+                
+            self.record(StageSample(name, wall_time, cpu_time, peak_bytes, active.pixels))
+    
+    def timed(self, name: str, size_arg: Optional[int] = None):
+        """
+        Декоратор для синхронных этапов. Размер изображения берется из позиционного
+        аргумента size_arg или из первого аргумента-изображения.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if size_arg is not None:
+                    pixels = _pixels_of(args[size_arg]) if len(args) > size_arg else None
+                else:
+                    pixels = next((p for p in map(_pixels_of, args) if p is not None), None)
+                with self.stage(name, pixels=pixels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+    
+    @contextmanager
+    def muted(self) -> Iterator[None]:
+        """Замеры в текущем потоке не записываются (прогрев)"""
+        self._local.muted = True
+        try:
+            yield
+        finally:
+            self._local.muted = False
+    
+    def record(self, sample: StageSample):
+        if getattr(self._local, 'muted', False):
+            return
+        with self._lock:
+            stats = self.stats.get(sample.stage)
+            if stats is None:
+                stats = self.stats[sample.stage] = StageStats()
+                
+            stats.wall_time.observe(sample.wall_time)
+            if sample.cpu_time is not None:
+                stats.cpu_time.observe(sample.cpu_time)
+            if sample.peak_bytes is not None:
+                stats.peak_bytes.observe(sample.peak_bytes)
+            if sample.pixels is not None:
+                stats.pixels.observe(sample.pixels)
+                
+            if self._forwarded is not None:
+                self._forwarded.append(sample)
+    
+    def start_forwarding(self):
+        """Включается в рабочем процессе пула"""
+        self._forwarded = []
+    
+    def take_forwarded(self) -> List[StageSample]:
+        with self._lock:
+            samples, self._forwarded = self._forwarded or [], []
+        return samples
+    
+    def merge(self, samples: List[StageSample]):
+        """Замеры, пришедшие из рабочего процесса"""
+        for sample in samples:
+            self.record(sample)
+    
+    def snapshot(self) -> Dict[str, StageStats]:
+        """Согласованная копия сводки для выгрузки и /stats"""
+        with self._lock:
+            return copy.deepcopy(self.stats)
+    
+    def export(self):
+        if self.exporter is not None:
+            try:
+                self.exporter.export(self.snapshot())
+            except Exception as e:
+                logger.error(f"Error exporting metrics: {e}")
+    
+    async def run_export_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.export()
+    
+    @contextmanager
+    def profile(self, mode: Optional[str]) -> Iterator[None]:
+        """Профилирование одного запроса: cProfile или tracemalloc, отчет пишется в лог"""
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                output = io.StringIO()
+                pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(25)
+                logger.info(f"cProfile report:\n{output.getvalue()}")
+        elif mode == 'tracemalloc':
+            started = not tracemalloc.is_tracing()
+            if started:
+                tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            try:
+                yield
+            finally:
+                after = tracemalloc.take_snapshot()
+                if started:
+                    tracemalloc.stop()
+                top = after.compare_to(before, 'lineno')[:25]
+                logger.info("tracemalloc report:\n" + '\n'.join(str(stat) for stat in top))
+        else:
+            yield
+
+def create_exporter():
+    """Экспортер по настройкам METRICS_EXPORTER"""
+    if config.metrics.exporter == 'log':
+        return LogExporter()
+    if config.metrics.exporter == 'prometheus':
+        return PrometheusFileExporter(config.metrics.prometheus_path)
+    if config.metrics.exporter == 'memory':
+        return InMemoryExporter()
+    return None
+
+metrics = Metrics(create_exporter())
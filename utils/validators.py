@@ -1,12 +1,132 @@
-from PIL import Image
+import struct
+from dataclasses import dataclass
 from io import BytesIO
 from typing import Tuple, Optional
 from config import config
 
+# Маркеры SOF в JPEG (кроме DHT, JPG и DAC), содержащие размеры кадра
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# Заголовки PNG и WebP с размерами укладываются в столько первых байт
+MIN_HEADER_BYTES = 30
+
+class ImageRejectedError(ValueError):
+    """Изображение отклонено по заголовку; текст ошибки можно показать пользователю"""
+
+@dataclass
+class ImageHeader:
+    format: str
+    width: int
+    height: int
+
 class ImageValidator:
+    @staticmethod
+    def probe_header(data: bytes) -> Optional[ImageHeader]:
+        """
+        Формат и размеры по заголовку контейнера (JPEG SOF, PNG IHDR, WebP VP8/VP8L/VP8X)
+        без декодирования. None — данных пока недостаточно или формат не распознан.
+        """
+        if data[:2] == b'\xff\xd8':
+            return ImageValidator._probe_jpeg(data)
+        if data[:8] == b'\x89PNG\r\n\x1a\n':
+            if len(data) < 24 or data[12:16] != b'IHDR':
+                return None
+            width, height = struct.unpack('>II', data[16:24])
+            return ImageHeader('png', width, height)
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            return ImageValidator._probe_webp(data)
+        return None
+    
+    @staticmethod
+    def needs_more_data(data: bytes) -> bool:
+        """
+        Заголовок с размерами еще не дочитан, но уже пришедшие байты ему не противоречат.
+        У JPEG перед SOF могут идти большие сегменты (миниатюра EXIF, профиль ICC),
+        поэтому ждем, пока не дочитаны объявленные длины сегментов, а не фиксированное
+        число байт; общий объем ограничен лимитом размера файла при скачивании.
+        """
+        if data[:2] == b'\xff\xd8':
+            return ImageValidator._scan_jpeg(data)[1]
+        return len(data) < MIN_HEADER_BYTES
+    
+    @staticmethod
+    def _probe_jpeg(data: bytes) -> Optional[ImageHeader]:
+        return ImageValidator._scan_jpeg(data)[0]
+    
+    @staticmethod
+    def _scan_jpeg(data: bytes) -> Tuple[Optional[ImageHeader], bool]:
+        """Сегменты до SOF пропускаются по их длине: (заголовок, нужны ли еще байты)"""
+        pos = 2
+        while pos + 4 <= len(data):
+            if data[pos] != 0xFF:
+                return None, False
+            marker = data[pos + 1]
+            # Заполняющие байты 0xFF между маркерами
+            if marker == 0xFF:
+                pos += 1
+                continue
+            # Маркеры без длины
+            if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                pos += 2
+                continue
+            # Данные скана до SOF: размеров в файле нет
+            if marker == 0xDA:
+                return None, False
+            if marker in JPEG_SOF_MARKERS:
+                if pos + 9 > len(data):
+                    return None, True
+                height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+                return ImageHeader('jpeg', width, height), False
+            segment_length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+            if segment_length < 2:
+                return None, False
+            pos += 2 + segment_length
+        return None, True
+    
+    @staticmethod
+    def _probe_webp(data: bytes) -> Optional[ImageHeader]:
+        if len(data) < 30:
+            return None
+        chunk = data[12:16]
+        if chunk == b'VP8 ' and data[23:26] == b'\x9d\x01\x2a':
+            width, height = struct.unpack('<HH', data[26:30])
+            return ImageHeader('webp', width & 0x3FFF, height & 0x3FFF)
+        if chunk == b'VP8L' and data[20] == 0x2F:
+            bits = struct.unpack('<I', data[21:25])[0]
+            return ImageHeader('webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1)
+        if chunk == b'VP8X':
+            width = int.from_bytes(data[24:27], 'little') + 1
+            height = int.from_bytes(data[27:30], 'little') + 1
+            return ImageHeader('webp', width, height)
+        return None
+    
+    @staticmethod
+    def check_header(data: bytes, complete: bool = True) -> Optional[ImageHeader]:
+        """
+        Проверка формата, размеров и числа пикселей по заголовку.
+        Бросает ImageRejectedError; при complete=False возвращает None, пока
+        для решения не хватает байт (для проверки на лету при скачивании).
+        """
+        header = ImageValidator.probe_header(data)
+        if header is None:
+            if not complete and ImageValidator.needs_more_data(data):
+                return None
+            raise ImageRejectedError("Неподдерживаемый формат изображения")
+            
+        if ImageValidator.is_image_too_small(header.width, header.height, config.image.min_image_side):
+            raise ImageRejectedError("Изображение слишком маленькое")
+            
+        if ImageValidator.is_image_too_large(header.width, header.height, config.image.max_image_side):
+            raise ImageRejectedError("Изображение слишком большое")
+            
+        if header.width * header.height > config.image.max_megapixels * 1_000_000:
+            raise ImageRejectedError("Изображение содержит слишком много пикселей")
+            
+        return header
+    
     @staticmethod
     def validate_image_format(image_data: bytes) -> bool:
         """Проверка формата изображения"""
+        from PIL import Image
         try:
             image = Image.open(BytesIO(image_data))
             format = image.format.lower()
@@ -17,6 +137,11 @@ class ImageValidator:
     @staticmethod
     def get_image_dimensions(image_data: bytes) -> Optional[Tuple[int, int]]:
         """Получение размеров изображения"""
+        header = ImageValidator.probe_header(image_data)
+        if header is not None:
+            return header.width, header.height
+            
+        from PIL import Image
         try:
             image = Image.open(BytesIO(image_data))
             return image.size
@@ -0,0 +1,115 @@
+"""
+Прием обновлений Telegram через webhook вместо long polling.
+
+Обновление подтверждается сразу после разбора, а обрабатывается в фоне с
+ограничением параллельности. Локально можно проверить без Telegram:
+
+    BOT_MODE=webhook python bot.py
+    curl -X POST localhost:8080/webhook -H 'Content-Type: application/json' \
+        -d '{"update_id": 1, "message": {"message_id": 1, "date": 0,
+             "chat": {"id": 1, "type": "private"}, "from": {"id": 1, "is_bot": false,
+             "first_name": "Test"}, "text": "/start"}}'
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+class WebhookServer:
+    """HTTP-сервер, принимающий обновления и передающий их диспетчеру в фоне"""
+    
+    def __init__(
+        self,
+        dp: Dispatcher,
+        max_concurrency: Optional[int] = None,
+        max_pending: Optional[int] = None
+    ):
+        self.dp = dp
+        self.max_concurrency = max_concurrency or config.webhook.max_concurrency
+        self.max_pending = max_pending or config.webhook.max_pending
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+    
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if config.webhook.secret_token and request.headers.get(SECRET_HEADER) != config.webhook.secret_token:
+            return web.Response(status=403)
+            
+        # Переполнение: Telegram повторит доставку позже, обновление не потеряется
+        if len(self._tasks) >= self.max_pending:
+            return web.Response(status=503)
+            
+        try:
+            update = types.Update(**(await request.json()))
+        except Exception as e:
+            logger.error(f"Bad webhook payload: {e}")
+            return web.Response(status=400)
+            
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response(status=200)
+    
+    async def _process(self, update: types.Update):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            
+        async with self._semaphore:
+            Bot.set_current(self.dp.bot)
+            Dispatcher.set_current(self.dp)
+            try:
+                await self.dp.process_update(update)
+            except Exception as e:
+                logger.error(f"Error processing update {update.update_id}: {e}")
+    
+    async def drain(self, timeout: float):
+        """Ожидание уже принятых обновлений перед остановкой"""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+    
+    def create_app(
+        self,
+        on_startup: Callable[[Dispatcher], Awaitable[None]],
+        on_shutdown: Callable[[Dispatcher], Awaitable[None]]
+    ) -> web.Application:
+        app = web.Application()
+        app.router.add_post(config.webhook.path, self.handle_update)
+        
+        async def startup(_app: web.Application):
+            await on_startup(self.dp)
+            # Без публичного URL сервер работает только для локальных POST-запросов
+            if config.webhook.url:
+                await self.dp.bot.set_webhook(
+                    config.webhook.url.rstrip('/') + config.webhook.path,
+                    secret_token=config.webhook.secret_token or None,
+                    max_connections=min(self.max_concurrency, 100)
+                )
+        
+        async def shutdown(_app: web.Application):
+            await self.drain(timeout=config.workers.job_timeout)
+            await on_shutdown(self.dp)
+            await self.dp.storage.close()
+            await self.dp.storage.wait_closed()
+            
+        app.on_startup.append(startup)
+        app.on_shutdown.append(shutdown)
+        return app
+
+def run_webhook(
+    dp: Dispatcher,
+    on_startup: Callable[[Dispatcher], Awaitable[None]],
+    on_shutdown: Callable[[Dispatcher], Awaitable[None]]
+):
+    server = WebhookServer(dp)
+    web.run_app(
+        server.create_app(on_startup, on_shutdown),
+        host=config.webhook.host,
+        port=config.webhook.port
+    )
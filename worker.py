@@ -0,0 +1,225 @@
+"""
+Воркер примерки: берет задачи из очереди JobQueue, рендерит их и отправляет результат.
+
+    JOB_QUEUE=1 python bot.py      # фронтенд только ставит задачи
+    JOB_QUEUE=1 python worker.py   # любое число воркеров на этом или других хостах
+
+Воркеры разных хостов должны видеть один файл очереди (JOB_QUEUE_PATH).
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+from typing import List, Optional
+
+from aiogram import Bot
+from aiogram.bot.api import TelegramAPIServer
+
+from config import config
+from services.image_processor import ImageProcessor
+from services.job_queue import JobQueue, Job, TRY_ON, TRY_ON_BATCH, FAILED
+from services.render_cache import RenderCache
+from services.try_on_flow import (
+    RESULT_CAPTION, FAILURE_TEXT, RENDER_FAILED_TEXT, REJECTED_PHOTO_TEXT, render_with_refetch
+)
+from utils.file_handlers import FileHandler
+from utils.http_client import download_client
+from utils.validators import ImageRejectedError
+
+logger = logging.getLogger(__name__)
+
+class TryOnWorker:
+    """Цикл разбора задач примерки из очереди"""
+    
+    def __init__(self, bot: Bot, queue: JobQueue, processor: ImageProcessor):
+        self.bot = bot
+        self.queue = queue
+        self.processor = processor
+        self.file_handler = FileHandler()
+        self.render_cache = RenderCache()
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self._stopping = False
+        self._purged_at = 0.0
+    
+    def stop(self):
+        """Текущая задача дорабатывается, новые не берутся"""
+        self._stopping = True
+    
+    async def run(self):
+        logger.info(f"Worker {self.name} started")
+        while not self._stopping:
+            self._purge()
+            for expired in self.queue.expire():
+                logger.error(f"Job {expired.id} failed: lease expired after {expired.attempts} attempts")
+                await self._notify(expired, FAILURE_TEXT)
+                
+            job = self.queue.claim(self.name)
+            if job is None:
+                await asyncio.sleep(config.queue.poll_interval)
+                continue
+            await self.handle(job)
+        logger.info(f"Worker {self.name} stopped")
+    
+    def _purge(self):
+        """Завершенные задачи старше JOB_RETENTION удаляются, чтобы файл очереди не рос"""
+        now = time.monotonic()
+        if not config.queue.retention or now - self._purged_at < config.queue.purge_interval:
+            return
+        self._purged_at = now
+        self.queue.purge(config.queue.retention)
+        logger.info(f"Job queue: {self.queue.counts()}")
+    
+    async def handle(self, job: Job):
+        heartbeat = asyncio.create_task(self._keep_lease(job.id))
+        try:
+            if job.kind == TRY_ON:
+                await self._try_on(job)
+            elif job.kind == TRY_ON_BATCH:
+                await self._try_on_batch(job)
+            else:
+                raise ValueError(f"Unknown job kind: {job.kind}")
+            self.queue.complete(job.id)
+        except ImageRejectedError as e:
+            # Повтор не поможет: сообщаем пользователю и закрываем задачу
+            await self._notify(job, REJECTED_PHOTO_TEXT.format(error=e))
+            self.queue.complete(job.id)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed (attempt {job.attempts}): {e}")
+            if self.queue.fail(job, str(e)) == FAILED:
+                await self._notify(job, FAILURE_TEXT)
+        finally:
+            heartbeat.cancel()
+    
+    async def _keep_lease(self, job_id: int):
+        while True:
+            await asyncio.sleep(self.queue.visibility_timeout / 3)
+            self.queue.extend(job_id)
+    
+    async def _download(self, file_id: str) -> bytes:
+        data = await self.file_handler.download_telegram_file(self.bot, file_id, validate=True)
+        if not data:
+            raise RuntimeError(f"Failed to download file {file_id}")
+        return data
+    
+    async def _try_on(self, job: Job):
+        payload = job.payload
+        clothes_key = payload['clothes_key']
+        
+        human_photo_data = await self._download(payload['human_file_id'])
+        
+        # Готовый результат отправляется по file_id без рендера и загрузки
+        render_key = self.render_cache.render_key(human_photo_data, clothes_key)
+        cached = self.render_cache.get(render_key)
+        if cached is not None:
+            sent = await self.bot.send_photo(
+                payload['chat_id'],
+                photo=cached.file_id or self.file_handler.as_input_file(cached.data),
+                caption=RESULT_CAPTION
+            )
+            if cached.file_id is None:
+                self.render_cache.set_file_id(render_key, sent.photo[-1].file_id)
+            return
+            
+        clothes_photo_data = None
+        if not self.processor.has_garment(clothes_key):
+            clothes_photo_data = await self._download(payload['clothes_file_id'])
+            
+        # Рендер в потоке, чтобы цикл событий продлевал аренду задачи
+        loop = asyncio.get_running_loop()
+        
+        async def render(clothes_data: List[Optional[bytes]], retry: bool) -> Optional[bytes]:
+            return await loop.run_in_executor(
+                None, self.processor.render_try_on,
+                human_photo_data, clothes_data[0], clothes_key
+            )
+            
+        result = await render_with_refetch(
+            render, [clothes_photo_data], lambda _: self._download(payload['clothes_file_id'])
+        )
+        if not result:
+            await self._notify(job, RENDER_FAILED_TEXT)
+            return
+            
+        sent = await self.bot.send_photo(
+            payload['chat_id'],
+            photo=self.file_handler.as_input_file(result),
+            caption=RESULT_CAPTION
+        )
+        self.render_cache.put(render_key, result)
+        self.render_cache.set_file_id(render_key, sent.photo[-1].file_id)
+    
+    async def _try_on_batch(self, job: Job):
+        payload = job.payload
+        human_photo_data = await self._download(payload['human_file_id'])
+        
+        async def download(garment) -> Optional[bytes]:
+            if self.processor.has_garment(garment['key']):
+                return None
+            return await self._download(garment['file_id'])
+            
+        garments = payload['garments']
+        clothes_data = await asyncio.gather(*(download(garment) for garment in garments))
+        
+        loop = asyncio.get_running_loop()
+        
+        async def render(clothes_data: List[Optional[bytes]], retry: bool) -> List[Optional[bytes]]:
+            return await loop.run_in_executor(
+                None, self.processor.render_batch_try_on, human_photo_data,
+                [(data, garment['key']) for data, garment in zip(clothes_data, garments)]
+            )
+            
+        results = await render_with_refetch(
+            render, clothes_data, lambda i: self._download(garments[i]['file_id'])
+        )
+        images = [result for result in results or [] if result]
+        if not images:
+            await self._notify(job, RENDER_FAILED_TEXT)
+        elif len(images) == 1:
+            await self.bot.send_photo(
+                payload['chat_id'],
+                photo=self.file_handler.as_input_file(images[0]),
+                caption=RESULT_CAPTION
+            )
+        else:
+            await self.bot.send_media_group(
+                payload['chat_id'],
+                self.file_handler.as_media_group(images, caption=RESULT_CAPTION)
+            )
+    
+    async def _notify(self, job: Job, text: str):
+        try:
+            await self.bot.send_message(job.payload['chat_id'], text)
+        except Exception as e:
+            logger.error(f"Failed to notify chat for job {job.id}: {e}")
+
+async def main():
+    bot = Bot(
+        token=config.bot.token,
+        server=TelegramAPIServer.from_base(config.api.telegram_api_url)
+    )
+    queue = JobQueue()
+    processor = ImageProcessor()
+    if config.workers.warm_up:
+        processor.warm_up()
+    worker = TryOnWorker(bot, queue, processor)
+    
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+        
+    await download_client.start()
+    try:
+        await worker.run()
+    finally:
+        await download_client.close()
+        queue.close()
+        await bot.close()
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    asyncio.run(main())